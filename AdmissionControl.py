@@ -0,0 +1,255 @@
+# AdmissionControl.py - التحكم في القبول أمام المحرك: طابور محدود، عدالة بين الجلسات، وإسقاط ما فات موعده
+
+import asyncio
+import math
+import os
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+import Metrics
+
+
+class AdmissionRejected(Exception):
+    """
+    رُفض الطلب قبل أن يصل إلى المحرك. reason: 'queue_full' أو 'session_queue_full' أو 'overloaded'
+    أو 'queue_timeout' (انتظار أطول من الحد) أو 'deadline_expired' (انتهى موعد العميل).
+    retry_after: الثواني المقترحة قبل إعادة المحاولة (ترويسة Retry-After).
+    """
+
+    def __init__(self, reason: str, retry_after: Optional[float] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def status_code(self) -> int:
+        # العميل لم يعد ينتظر الرد: لا فائدة من إعادة المحاولة
+        return 504 if self.reason == "deadline_expired" else 429
+
+
+class _Waiter:
+    __slots__ = ("future", "session_id", "deadline", "enqueued")
+
+    def __init__(self, future: asyncio.Future, session_id: str, deadline: float, enqueued: float):
+        self.future = future
+        self.session_id = session_id
+        self.deadline = deadline
+        self.enqueued = enqueued
+
+
+class AdmissionController:
+    """
+    يسمح بـ max_concurrency طلبًا داخل المحرك في نفس الوقت، والباقي ينتظر في طابور لكل جلسة.
+    - العدالة: الطوابير تُخدم بالتناوب (طلب واحد من كل جلسة في كل دورة)، فلا تستحوذ جلسة نشطة على السعة.
+    - المواعيد: الطلب الذي انتهى موعد عميله يُسقط عند الوصول إليه في الطابور بدل إرساله إلى Gemini.
+    - تخفيف الحمل مبكرًا: إذا تجاوز الانتظار المتوقع (من متوسط زمن الخدمة) max_wait أو امتلأ الطابور
+      يُرفض الطلب فورًا بـ 429 وRetry-After، وأي طلب ينتظر أكثر من max_wait يُرفض كذلك.
+    كل العمليات على حلقة الأحداث نفسها، فلا حاجة لأقفال.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, max_queue: Optional[int] = None,
+                 max_session_queue: Optional[int] = None, max_wait: Optional[float] = None,
+                 min_remaining: Optional[float] = None, default_timeout: float = 30.0, smoothing: float = 0.2):
+        """
+        max_concurrency: الطلبات داخل المحرك في نفس الوقت (ADMISSION_MAX_CONCURRENCY)؛ افتراضيًا حد تزامن
+        استدعاءات Gemini في المحرك (LLM_MAX_CONCURRENCY) حتى لا يكون القبول أضيق منه.
+        max_queue / max_session_queue: سعة الطابور الكلية ولكل جلسة (ADMISSION_MAX_QUEUE / ADMISSION_SESSION_QUEUE).
+        max_wait: أقصى انتظار في الطابور بالثواني قبل 429 (ADMISSION_MAX_WAIT).
+        min_remaining: أقل مهلة متبقية تستحق إرسال الطلب إلى المحرك؛ ما دونها يُعامل كموعد منتهٍ (ADMISSION_MIN_REMAINING).
+        default_timeout: موعد العميل عندما لا يرسل واحدًا.
+        smoothing: معامل المتوسط المتحرك الأسي لزمن الخدمة.
+        """
+        if max_concurrency is None:
+            max_concurrency = int(os.environ.get("ADMISSION_MAX_CONCURRENCY",
+                                                 os.environ.get("LLM_MAX_CONCURRENCY", "256")))
+        if max_queue is None:
+            max_queue = int(os.environ.get("ADMISSION_MAX_QUEUE", "256"))
+        if max_session_queue is None:
+            max_session_queue = int(os.environ.get("ADMISSION_SESSION_QUEUE", "4"))
+        if max_wait is None:
+            max_wait = float(os.environ.get("ADMISSION_MAX_WAIT", "5"))
+        if min_remaining is None:
+            min_remaining = float(os.environ.get("ADMISSION_MIN_REMAINING", "0.25"))
+
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.max_session_queue = max(1, max_session_queue)
+        self.max_wait = max_wait
+        self.min_remaining = max(0.0, min_remaining)
+        self.default_timeout = default_timeout
+        self.smoothing = smoothing
+
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {}
+        # متوسط زمن بقاء الطلب داخل المحرك (None حتى أول طلب مكتمل)
+        self.service_time: Optional[float] = None
+        # طابور لكل جلسة؛ ترتيب القاموس هو ترتيب التناوب
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls, default_timeout: float = 30.0,
+                 default_concurrency: Optional[int] = None) -> Optional["AdmissionController"]:
+        """
+        ADMISSION=0 يعطل التحكم في القبول (كل الطلبات تدخل المحرك مباشرة كما كان).
+        default_concurrency: السعة عند غياب ADMISSION_MAX_CONCURRENCY (حجم حد تزامن Gemini في المحرك).
+        """
+        if os.environ.get("ADMISSION", "1") == "0":
+            return None
+        max_concurrency = None
+        if "ADMISSION_MAX_CONCURRENCY" not in os.environ:
+            max_concurrency = default_concurrency
+        return cls(max_concurrency=max_concurrency, default_timeout=default_timeout)
+
+    # --- التقدير ---
+
+    def estimated_wait(self, position: Optional[int] = None) -> float:
+        """
+        الانتظار المتوقع لطلب في الموضع position من الطابور (افتراضيًا: آخره).
+        الأماكن تتحرر بمعدل max_concurrency / service_time في الثانية (لا دفعة واحدة كل service_time).
+        """
+        if self.service_time is None:
+            return 0.0
+        if position is None:
+            position = self.queued
+        return (position + 1) * self.service_time / self.max_concurrency
+
+    def _retry_after(self) -> float:
+        return max(1.0, math.ceil(self.estimated_wait()))
+
+    def _reject(self, reason: str, retry_after: Optional[float] = None) -> AdmissionRejected:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        Metrics.ADMISSION_REJECTED.labels(reason).inc()
+        return AdmissionRejected(reason, retry_after)
+
+    # --- القبول ---
+
+    @asynccontextmanager
+    async def slot(self, session_id: str, timeout: Optional[float] = None) -> AsyncIterator[float]:
+        """
+        يحجز مكانًا في المحرك طوال الكتلة (يرفع AdmissionRejected إذا رُفض الطلب).
+        timeout: المهلة المتبقية لدى العميل بالثواني؛ القيمة المعادة هي ما تبقى منها بعد الانتظار.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + (timeout if timeout is not None else self.default_timeout)
+        # آخر لحظة يُقبل فيها الطلب: بعدها لن يبقى وقت كافٍ لرد يصل إلى العميل
+        await self._acquire(session_id, deadline - self.min_remaining)
+        admitted_at = loop.time()
+        try:
+            yield max(0.0, deadline - admitted_at)
+        finally:
+            self._release(loop.time() - admitted_at)
+
+    async def _acquire(self, session_id: str, deadline: float):
+        """deadline: آخر موعد للقبول (بتوقيت الحلقة)."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if deadline <= now:
+            raise self._reject("deadline_expired")
+
+        if self.active < self.max_concurrency and self.queued == 0:
+            self._admit(0.0)
+            return
+
+        # تخفيف الحمل قبل دخول الطابور: لا جدوى من انتظار سينتهي بـ 429 أو بعد موعد العميل
+        if self.queued >= self.max_queue:
+            raise self._reject("queue_full", self._retry_after())
+        session_queue = self._queues.get(session_id)
+        if session_queue is not None and len(session_queue) >= self.max_session_queue:
+            raise self._reject("session_queue_full", self._retry_after())
+        expected = self.estimated_wait()
+        if expected > self.max_wait:
+            raise self._reject("overloaded", self._retry_after())
+
+        waiter = _Waiter(loop.create_future(), session_id, deadline, now)
+        if session_queue is None:
+            session_queue = self._queues[session_id] = deque()
+        session_queue.append(waiter)
+        self.queued += 1
+        Metrics.ADMISSION_QUEUE_DEPTH.set(self.queued)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=min(self.max_wait, deadline - now))
+        except AdmissionRejected:
+            # أُسقط عند الوصول إليه لأن موعد العميل انتهى
+            raise
+        except asyncio.TimeoutError:
+            # قد يكون المكان مُنح (أو الطلب أُسقط) في نفس لحظة انتهاء المهلة
+            if waiter.future.done() and not waiter.future.cancelled():
+                waiter.future.result()
+                return
+            self._remove(waiter)
+            if loop.time() >= deadline:
+                raise self._reject("deadline_expired")
+            raise self._reject("queue_timeout", self._retry_after())
+        except BaseException:
+            # انقطع العميل أثناء الانتظار: إعادة المكان إن كان قد مُنح، وإلا الخروج من الطابور
+            if waiter.future.done() and not waiter.future.cancelled():
+                if waiter.future.exception() is None:
+                    self._release(None)
+            else:
+                self._remove(waiter)
+            raise
+
+    def _remove(self, waiter: _Waiter):
+        """إزالة منتظر غادر الطابور قبل أن يصل دوره."""
+        waiter.future.cancel()
+        session_queue = self._queues.get(waiter.session_id)
+        if session_queue is not None:
+            session_queue.remove(waiter)
+            if not session_queue:
+                del self._queues[waiter.session_id]
+        self.queued -= 1
+        Metrics.ADMISSION_QUEUE_DEPTH.set(self.queued)
+
+    def _admit(self, waited: float):
+        self.active += 1
+        self.admitted += 1
+        Metrics.ADMISSION_WAIT_SECONDS.observe(waited)
+
+    def _release(self, service_seconds: Optional[float]):
+        self.active -= 1
+        if service_seconds is not None:
+            if self.service_time is None:
+                self.service_time = service_seconds
+            else:
+                self.service_time += self.smoothing * (service_seconds - self.service_time)
+        self._dispatch()
+
+    def _dispatch(self):
+        """منح الأماكن الشاغرة بالتناوب بين الجلسات، مع إسقاط من انتهى موعده دون إرساله إلى المحرك."""
+        now = asyncio.get_running_loop().time()
+        while self.active < self.max_concurrency and self._queues:
+            session_id, session_queue = next(iter(self._queues.items()))
+            waiter = session_queue.popleft()
+            if session_queue:
+                self._queues.move_to_end(session_id)
+            else:
+                del self._queues[session_id]
+            self.queued -= 1
+
+            if waiter.future.done():
+                continue
+            if waiter.deadline <= now:
+                waiter.future.set_exception(self._reject("deadline_expired"))
+                continue
+            self._admit(now - waiter.enqueued)
+            waiter.future.set_result(None)
+        Metrics.ADMISSION_QUEUE_DEPTH.set(self.queued)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "queued": self.queued,
+            "sessions_waiting": len(self._queues),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "service_time": self.service_time,
+            "estimated_wait": self.estimated_wait(),
+            "max_wait": self.max_wait,
+            "min_remaining": self.min_remaining,
+        }
@@ -0,0 +1,167 @@
+# CompiledForest.py - نسخة مُجمَّعة من RandomForestClassifier لتنبؤ سريع دون كلفة sklearn لكل استدعاء
+
+import json
+import os
+import numpy as np
+from typing import Any, List, Optional, Sequence
+
+
+class CompiledForest:
+    """
+    يحوّل أشجار الغابة إلى مصفوفات NumPy مسطحة (عقدة واحدة لكل فهرس) ويقيّمها بتجوال متجهي.
+    يطابق RandomForestClassifier.predict: متوسط احتمالات الأشجار ثم argmax.
+    """
+
+    # إصدار صيغة الملفات المحفوظة؛ يُرفع عند تغيير تخطيط المصفوفات
+    FORMAT_VERSION = 1
+    ARRAYS = ("feature", "threshold", "children_left", "children_right", "leaf_proba", "roots", "classes")
+
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray,
+                 children_left: np.ndarray, children_right: np.ndarray,
+                 leaf_proba: np.ndarray, roots: np.ndarray, classes: np.ndarray,
+                 max_depth: int):
+        self.feature = feature
+        self.threshold = threshold
+        self.children_left = children_left
+        self.children_right = children_right
+        self.leaf_proba = leaf_proba
+        self.roots = roots
+        self.classes = classes
+        self.max_depth = max_depth
+        self.n_trees = len(roots)
+        self.version: Optional[str] = None
+
+        # نسخ Python عادية لمسار الصف الواحد (أسرع من NumPy لعدد صغير من العقد)
+        self._feature_list = feature.tolist()
+        self._threshold_list = threshold.tolist()
+        self._left_list = children_left.tolist()
+        self._right_list = children_right.tolist()
+        self._proba_list = leaf_proba.tolist()
+        self._roots_list = roots.tolist()
+        self._classes_list = classes.tolist()
+
+    @classmethod
+    def from_sklearn(cls, forest: Any) -> "CompiledForest":
+        """تجميع غابة sklearn مدرّبة في مصفوفات مسطحة."""
+        features, thresholds, lefts, rights, probas, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            left = tree.children_left.astype(np.int64)
+            right = tree.children_right.astype(np.int64)
+            is_leaf = left == -1
+
+            # الأوراق تشير إلى نفسها حتى يتوقف التجوال عندها دون فروع شرطية
+            node_ids = np.arange(n_nodes, dtype=np.int64)
+            lefts.append(np.where(is_leaf, node_ids, left) + offset)
+            rights.append(np.where(is_leaf, node_ids, right) + offset)
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int64))
+            thresholds.append(tree.threshold.astype(np.float64))
+
+            # نفس تطبيع DecisionTreeClassifier.predict_proba
+            proba = tree.value[:, 0, :forest.n_classes_].astype(np.float64)
+            normalizer = proba.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            probas.append(proba / normalizer)
+
+            roots.append(offset)
+            offset += n_nodes
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds),
+            children_left=np.concatenate(lefts),
+            children_right=np.concatenate(rights),
+            leaf_proba=np.concatenate(probas),
+            roots=np.asarray(roots, dtype=np.int64),
+            classes=np.asarray(forest.classes_),
+            max_depth=int(max_depth),
+        )
+
+    def save(self, path: str, features: List[str], version: str):
+        """حفظ المصفوفات كملفات .npy منفصلة (قابلة للتحميل بـ mmap) مع ملف وصف meta.json."""
+        os.makedirs(path, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        meta = {
+            "format": self.FORMAT_VERSION,
+            "version": version,
+            "features": list(features),
+            "max_depth": self.max_depth,
+        }
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path: str, expected_features: Optional[List[str]] = None, mmap: bool = True) -> "CompiledForest":
+        """تحميل نموذج محفوظ؛ مع mmap تُقرأ الصفحات عند الحاجة وتتشاركها العمليات على نفس الجهاز."""
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported model format {meta.get('format')} in {path}")
+        if expected_features is not None and meta.get("features") != list(expected_features):
+            raise ValueError(f"Model features {meta.get('features')} do not match {expected_features}")
+
+        mmap_mode = "r" if mmap else None
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in cls.ARRAYS}
+        forest = cls(max_depth=int(meta["max_depth"]), **arrays)
+        forest.version = meta.get("version")
+        return forest
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """احتمالات الفئات لدفعة من الصفوف (n_samples, n_features) في استدعاء واحد."""
+        # sklearn يحوّل المدخلات إلى float32 قبل المقارنة بالعتبات؛ نفعل المثل لنطابق نتائجه تمامًا
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        rows = np.arange(X.shape[0])[:, np.newaxis]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], self.n_trees)).copy()
+
+        # خطوة لكل مستوى عمق لكل الصفوف والأشجار معًا
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.children_left[nodes], self.children_right[nodes])
+
+        # جمع الاحتمالات شجرة بعد شجرة بنفس ترتيب sklearn ثم القسمة على عدد الأشجار
+        leaf_proba = self.leaf_proba[nodes]
+        proba = np.zeros((X.shape[0], self.leaf_proba.shape[1]), dtype=np.float64)
+        for t in range(self.n_trees):
+            proba += leaf_proba[:, t, :]
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """الفئة المتوقعة لكل صف في الدفعة."""
+        return self.classes.take(np.argmax(self.predict_proba(X), axis=1))
+
+    def predict_one(self, features: Sequence[float]) -> Any:
+        """المسار السريع لصف واحد (طلب دردشة واحد) بلغة Python خالصة."""
+        x = np.asarray(features, dtype=np.float32).tolist()
+        feature, threshold = self._feature_list, self._threshold_list
+        left, right = self._left_list, self._right_list
+
+        totals = [0.0] * len(self._classes_list)
+        for node in self._roots_list:
+            for _ in range(self.max_depth):
+                node = left[node] if x[feature[node]] <= threshold[node] else right[node]
+            for i, p in enumerate(self._proba_list[node]):
+                totals[i] += p
+        totals = [total / self.n_trees for total in totals]
+
+        best = 0
+        for i in range(1, len(totals)):
+            if totals[i] > totals[best]:
+                best = i
+        return self._classes_list[best]
+
+    def matches(self, forest: Any, X: np.ndarray) -> bool:
+        """فحص التطابق مع sklearn على عينات معطاة (للمسارين الدفعي والفردي)."""
+        expected = forest.predict(X)
+        if not np.array_equal(self.predict(X), expected):
+            return False
+        return all(self.predict_one(row) == label for row, label in zip(X, expected))
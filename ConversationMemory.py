@@ -0,0 +1,267 @@
+# ConversationMemory.py - ذاكرة محادثة لكل جلسة ضمن ميزانية رموز: آخر K دورات حرفيًا + ملخص متدحرج لما قبلها
+
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, List, Optional, Sequence, Tuple
+
+# دورة محادثة: (مطالبة المستخدم، رد النموذج)
+Turn = Tuple[str, str]
+
+
+def estimate_tokens(text: str, chars_per_token: float = 4.0) -> int:
+    """تقدير سريع لعدد الرموز من طول النص (بدون استدعاء count_tokens عبر الشبكة)."""
+    return math.ceil(len(text) / chars_per_token) if text else 0
+
+
+def fold_turn(summary: str, turn: Turn, line_chars: int = 160) -> str:
+    """الملخص الافتراضي: سطر مختصر لكل دورة تخرج من النافذة (يُضاف دون إعادة معالجة ما قبله)."""
+    prompt, response = (" ".join(part.split())[:line_chars] for part in turn)
+    line = f"- المستخدم: {prompt} | الرد: {response}"
+    return f"{summary}\n{line}" if summary else line
+
+
+class _SessionMemory:
+    __slots__ = ("turns", "summary", "last_id", "unsynced", "checked")
+
+    def __init__(self, recent_turns: int):
+        self.turns: Deque[Turn] = deque(maxlen=recent_turns)
+        self.summary = ""
+        # أكبر معرف في سجل التفاعلات تعكسه هذه النسخة، وعدد الدورات المسجلة محليًا بعده
+        self.last_id = 0
+        self.unsynced = 0
+        # آخر تحقق من السجل (time.monotonic)
+        self.checked = 0.0
+
+
+class ConversationMemory:
+    """
+    يحتفظ لكل جلسة بآخر recent_turns دورة كما هي، ويطوي الأقدم في ملخص يُحدَّث تدريجيًا (دورة واحدة في كل مرة).
+    الذاكرة في LRU داخل العملية؛ عند غياب جلسة تُعاد بناؤها من سجل التفاعلات (InteractionLog).
+    الملخص لا يُحفظ: إعادة البناء (بعد الإخراج من الـ LRU أو إعادة التشغيل أو تحديث من عامل آخر) تطوي
+    فقط 2 * recent_turns دورة قبل النافذة، فما هو أقدم منها يسقط من الملخص (وهو أصلًا محدود بـ summary_tokens).
+    مع عدة عمال (uvicorn --workers) قد تصل دورات الجلسة إلى عمال مختلفين؛ عندها يُفعَّل التحقق من السجل
+    قبل الاستخدام (MEMORY_REVALIDATE_INTERVAL >= 0، مرة كل revalidate_interval ثانية على الأكثر):
+    إذا ظهرت فيه سطور للجلسة أكثر مما سجله هذا العامل منذ
+    آخر مزامنة فقد كتبها عامل آخر، وتُعاد بناء الذاكرة. دقة ذلك بحدود زمن تفريغ السجل (INTERACTION_LOG_FLUSH_INTERVAL).
+    """
+
+    def __init__(self, interaction_log: Any = None,
+                 recent_turns: Optional[int] = None,
+                 token_budget: Optional[int] = None,
+                 summary_tokens: Optional[int] = None,
+                 max_sessions: Optional[int] = None,
+                 chars_per_token: Optional[float] = None,
+                 revalidate_interval: Optional[float] = None,
+                 summarizer: Callable[[str, Turn], str] = fold_turn):
+        """
+        recent_turns: عدد الدورات المحفوظة حرفيًا (MEMORY_RECENT_TURNS).
+        token_budget: حد الرموز الكلي للطلب: التعليمات + السجل + الرسالة الحالية (MEMORY_TOKEN_BUDGET).
+        summary_tokens: أقصى حجم للملخص المتدحرج؛ تُحذف أقدم سطوره عند تجاوزه (MEMORY_SUMMARY_TOKENS).
+        max_sessions: عدد الجلسات في الذاكرة (MEMORY_CACHE_SIZE).
+        revalidate_interval: أقل فاصل بالثواني بين تحققين من السجل لنفس الجلسة؛ القيمة السالبة (الافتراضية،
+        عامل واحد) تعطل التحقق، ومع عدة عمال تُضبط مثلًا على 0.5 (MEMORY_REVALIDATE_INTERVAL).
+        summarizer: دالة (الملخص الحالي، الدورة الخارجة) -> الملخص الجديد.
+        """
+        if recent_turns is None:
+            recent_turns = int(os.environ.get("MEMORY_RECENT_TURNS", "6"))
+        if token_budget is None:
+            token_budget = int(os.environ.get("MEMORY_TOKEN_BUDGET", "2000"))
+        if summary_tokens is None:
+            summary_tokens = int(os.environ.get("MEMORY_SUMMARY_TOKENS", "300"))
+        if max_sessions is None:
+            max_sessions = int(os.environ.get("MEMORY_CACHE_SIZE", "10000"))
+        if chars_per_token is None:
+            chars_per_token = float(os.environ.get("MEMORY_CHARS_PER_TOKEN", "4"))
+        if revalidate_interval is None:
+            revalidate_interval = float(os.environ.get("MEMORY_REVALIDATE_INTERVAL", "-1"))
+
+        self.interaction_log = interaction_log
+        self.recent_turns = max(1, recent_turns)
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.max_sessions = max(1, max_sessions)
+        self.chars_per_token = chars_per_token
+        self.revalidate_interval = revalidate_interval
+        self.summarizer = summarizer
+
+        self._sessions: "OrderedDict[str, _SessionMemory]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, interaction_log: Any = None) -> Optional["ConversationMemory"]:
+        """ذاكرة المحادثة مفعلة افتراضيًا؛ CONVERSATION_MEMORY=0 يعيد السلوك القديم (الرسالة الحالية فقط)."""
+        if os.environ.get("CONVERSATION_MEMORY", "1") == "0":
+            return None
+        return cls(interaction_log)
+
+    def tokens(self, text: str) -> int:
+        return estimate_tokens(text, self.chars_per_token)
+
+    # --- الذاكرة المؤقتة ---
+
+    def cached(self, session_id: str) -> bool:
+        """هل الجلسة في الذاكرة (لا تحتاج قراءة من القرص)؟"""
+        return session_id in self._sessions
+
+    def _revalidates(self) -> bool:
+        return self.interaction_log is not None and self.revalidate_interval >= 0
+
+    def needs_read(self, session_id: str) -> bool:
+        """هل سيقرأ load() من السجل (جلسة غائبة أو حان وقت التحقق)؟ لتنفيذه خارج حلقة الأحداث."""
+        memory = self._sessions.get(session_id)
+        if memory is None:
+            return True
+        return self._revalidates() and time.monotonic() - memory.checked >= self.revalidate_interval
+
+    def _get(self, session_id: str) -> Optional[_SessionMemory]:
+        with self._lock:
+            memory = self._sessions.get(session_id)
+            if memory is not None:
+                self._sessions.move_to_end(session_id)
+            return memory
+
+    def _stale(self, session_id: str, memory: _SessionMemory) -> bool:
+        """هل كتب عامل آخر دورات لهذه الجلسة في السجل منذ آخر مزامنة؟"""
+        if not self._revalidates():
+            return False
+        now = time.monotonic()
+        if now - memory.checked < self.revalidate_interval:
+            return False
+        count, last_id = self.interaction_log.session_tail(session_id, memory.last_id)
+        with self._lock:
+            memory.checked = now
+            if count > memory.unsynced:
+                return True
+            if count == memory.unsynced and last_id is not None:
+                # كل السطور الجديدة من هذا العامل: تقديم نقطة المزامنة
+                memory.last_id = last_id
+                memory.unsynced = 0
+        return False
+
+    def load(self, session_id: str) -> _SessionMemory:
+        """ذاكرة الجلسة من الـ LRU (بعد التحقق من السجل)، أو إعادة بنائها من سجل التفاعلات (قراءة SQLite واحدة)."""
+        cached = self._get(session_id)
+        if cached is not None and not self._stale(session_id, cached):
+            return cached
+
+        memory = _SessionMemory(self.recent_turns)
+        if self.interaction_log is not None:
+            # آخر الدورات حرفيًا، وما قبلها (ضعف النافذة) يُطوى في الملخص؛ الدورات الفاشلة أو المخفضة مستبعدة
+            turns, memory.last_id = self.interaction_log.context_turns(session_id, self.recent_turns * 3)
+            for turn in turns:
+                self._append(memory, turn)
+            memory.checked = time.monotonic()
+
+        with self._lock:
+            current = self._sessions.get(session_id)
+            if current is None or current is cached:
+                current = self._sessions[session_id] = memory
+            # وإلا فقد بنى طلب آخر نسخة أحدث أثناء القراءة
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return current
+
+    def _append(self, memory: _SessionMemory, turn: Turn):
+        """إضافة دورة؛ الدورة التي تخرج من النافذة تُطوى في الملخص ثم يُقص الملخص إلى حده."""
+        if len(memory.turns) == memory.turns.maxlen:
+            memory.summary = self._trim_summary(self.summarizer(memory.summary, memory.turns[0]))
+        memory.turns.append(turn)
+
+    def _trim_summary(self, summary: str) -> str:
+        lines = summary.split("\n")
+        while len(lines) > 1 and self.tokens("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def record(self, session_id: str, user_prompt: str, response_text: str, remember: bool = True):
+        """
+        تسجيل دورة أُرسلت إلى سجل التفاعلات (الجلسات غير المحملة تُقرأ من السجل عند أول استخدام، فلا داعي لتحميلها هنا).
+        remember=False: الدورة تُحسب في المزامنة مع السجل دون أن تدخل السياق (رد فاشل أو مخفض).
+        """
+        memory = self._get(session_id)
+        if memory is None:
+            return
+        with self._lock:
+            memory.unsynced += 1
+            if remember:
+                self._append(memory, (user_prompt, response_text))
+
+    def digest(self, session_id: str) -> str:
+        """
+        بصمة سياق الجلسة (الدورات والملخص) لمفتاح ذاكرة الردود: نفس المطالبة بسياق مختلف ليست نفس الطلب.
+        سلسلة فارغة لجلسة بلا سياق بعد.
+        """
+        memory = self.load(session_id)
+        with self._lock:
+            if not memory.turns and not memory.summary:
+                return ""
+            payload = json.dumps([list(memory.turns), memory.summary], ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    # --- بناء الطلب ---
+
+    def build_contents(self, session_id: str, user_prompt: str, reserved_tokens: int = 0,
+                       prefix_parts: Sequence[str] = ()) -> List[Any]:
+        """
+        محتوى طلب Gemini متعدد الأدوار ضمن الميزانية: أحدث الدورات أولًا، ثم الملخص بما يتبقى.
+        reserved_tokens: رموز التعليمات المرسلة خارج المحتوى؛ prefix_parts: أجزاء تسبق الرسالة الحالية.
+        بدون سجل يعاد الشكل القديم (قائمة نصوص) كما هو.
+        """
+        memory = self.load(session_id)
+        with self._lock:
+            turns = list(memory.turns)
+            summary = memory.summary
+
+        remaining = (self.token_budget - reserved_tokens - self.tokens(user_prompt)
+                     - sum(self.tokens(part) for part in prefix_parts))
+        selected: List[Turn] = []
+        for prompt, response in reversed(turns):
+            cost = self.tokens(prompt) + self.tokens(response)
+            if cost > remaining:
+                break
+            selected.append((prompt, response))
+            remaining -= cost
+        selected.reverse()
+
+        summary_part = ""
+        if summary and remaining > 0:
+            header = "ملخص ما سبق من المحادثة:\n"
+            summary_part = header + self._fit(summary, remaining - self.tokens(header))
+            if summary_part == header:
+                summary_part = ""
+
+        if not selected and not summary_part:
+            return [*prefix_parts, user_prompt]
+
+        contents: List[Any] = []
+        for prompt, response in selected:
+            contents.append({"role": "user", "parts": [prompt]})
+            contents.append({"role": "model", "parts": [response]})
+        final_parts = [*prefix_parts, summary_part, user_prompt] if summary_part else [*prefix_parts, user_prompt]
+        contents.append({"role": "user", "parts": final_parts})
+        return contents
+
+    def _fit(self, summary: str, budget: int) -> str:
+        """أحدث سطور الملخص التي تتسع في budget رمزًا."""
+        if budget <= 0:
+            return ""
+        lines = summary.split("\n")
+        kept: List[str] = []
+        used = 0
+        for line in reversed(lines):
+            cost = self.tokens(line) + 1
+            if used + cost > budget:
+                break
+            kept.append(line)
+            used += cost
+        return "\n".join(reversed(kept))
@@ -0,0 +1,152 @@
+# EmotionVector.py - متجه عواطف مضغوط بمخطط ثابت (مصفوفة float64 متصلة بترتيب مفاتيح معروف)
+
+import math
+
+import numpy as np
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# ترتيب المفاتيح ثابت: كل عاطفة لها فهرس معروف في المصفوفة
+EMOTION_KEYS: Tuple[str, ...] = (
+    'temperament_bias', 'maturity', 'joy', 'fear', 'calm', 'anxiety', 'pride', 'guilt',
+)
+EMOTION_INDEX: Dict[str, int] = {key: i for i, key in enumerate(EMOTION_KEYS)}
+
+# المشاعر الإيجابية والسلبية بنفس ترتيب الجمع في _calculate_lambda الأصلية
+POSITIVE_INDEX = np.array([EMOTION_INDEX['pride'], EMOTION_INDEX['joy'], EMOTION_INDEX['calm']])
+NEGATIVE_INDEX = np.array([EMOTION_INDEX['guilt'], EMOTION_INDEX['fear'], EMOTION_INDEX['anxiety']])
+_PRIDE, _JOY, _CALM = (int(i) for i in POSITIVE_INDEX)
+_GUILT, _FEAR, _ANXIETY = (int(i) for i in NEGATIVE_INDEX)
+
+
+def batch_lambda(values: np.ndarray) -> np.ndarray:
+    """حساب Lambda لمصفوفة حالات (n, len(EMOTION_KEYS)) دفعة واحدة؛ المفاتيح الغائبة (NaN) تُعامل كصفر."""
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+    positive_affect = values[..., POSITIVE_INDEX].sum(axis=-1)
+    negative_affect = values[..., NEGATIVE_INDEX].sum(axis=-1)
+    weighted_emotions = (positive_affect * 1.5) - (negative_affect * 2.0)
+    return 1.0 / (1.0 + np.exp(-weighted_emotions / 4.0))
+
+
+class EmotionVector:
+    """
+    حالة عاطفية بمخطط ثابت. القيم الغائبة تُخزَّن كـ NaN حتى يبقى التحويل من/إلى القاموس وصفوف SQLite بلا فقد،
+    والمفاتيح خارج المخطط (أو القيم غير الرقمية) تُحفظ كما هي في extras.
+    """
+
+    __slots__ = ('values', 'extras')
+
+    def __init__(self, values: Optional[np.ndarray] = None, extras: Optional[Dict[str, Any]] = None):
+        if values is None:
+            values = np.full(len(EMOTION_KEYS), np.nan)
+        self.values = values
+        self.extras = extras if extras is not None else {}
+
+    # --- التحويلات ---
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any]) -> "EmotionVector":
+        """إنشاء متجه من قاموس الحالة الحالي."""
+        vector = cls()
+        vector.merge(state)
+        return vector
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, str]]) -> "EmotionVector":
+        """إنشاء متجه من صفوف (key, value) كما تُخزَّن في SQLite."""
+        state: Dict[str, Any] = {}
+        for key, value_str in rows:
+            try:
+                state[key] = float(value_str)
+            except ValueError:
+                state[key] = value_str
+        return cls.from_dict(state)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """تحويل المتجه إلى قاموس (المفاتيح الموجودة فقط، بترتيب المخطط ثم الإضافات)."""
+        state: Dict[str, Any] = {
+            key: value for key, value in zip(EMOTION_KEYS, self.values.tolist()) if value == value
+        }
+        state.update(self.extras)
+        return state
+
+    def to_rows(self) -> List[Tuple[str, str]]:
+        """تحويل المتجه إلى صفوف (key, value) جاهزة للحفظ في SQLite."""
+        return [(key, str(value)) for key, value in self.to_dict().items()]
+
+    def merge(self, state: Dict[str, Any]):
+        """دمج قاموس في المتجه (مثل dict.update)."""
+        for key, value in state.items():
+            index = EMOTION_INDEX.get(key)
+            if index is not None and isinstance(value, (int, float)):
+                self.values[index] = value
+                self.extras.pop(key, None)
+            else:
+                if index is not None:
+                    self.values[index] = np.nan
+                self.extras[key] = value
+
+    def copy(self) -> "EmotionVector":
+        return EmotionVector(self.values.copy(), dict(self.extras))
+
+    # --- الوصول ---
+
+    def get(self, key: str, default: Any = None) -> Any:
+        index = EMOTION_INDEX.get(key)
+        if index is None:
+            return self.extras.get(key, default)
+        value = self.values[index]
+        return default if value != value else float(value)
+
+    def select(self, keys: Sequence[str], default: float) -> List[float]:
+        """قيم مجموعة مفاتيح (مثل ميزات المصنف) مع قيمة افتراضية للغائب."""
+        return [self.get(key, default) for key in keys]
+
+    def items(self) -> Iterator[Tuple[str, float]]:
+        """أزواج (المفتاح، القيمة) الرقمية الموجودة فقط."""
+        for key, value in zip(EMOTION_KEYS, self.values.tolist()):
+            if value == value:
+                yield key, value
+        for key, value in self.extras.items():
+            if isinstance(value, (int, float)):
+                yield key, value
+
+    def is_empty(self) -> bool:
+        return not self.extras and bool(np.isnan(self.values).all())
+
+    # --- العمليات المتجهية ---
+
+    def clamp(self, low: float = 0.0, high: float = 1.0) -> "EmotionVector":
+        """قص القيم إلى [low, high] في مكانها (NaN يبقى غائبًا)."""
+        np.clip(self.values, low, high, out=self.values)
+        return self
+
+    def update(self, delta: np.ndarray) -> "EmotionVector":
+        """إضافة متجه تغيير ثم القص؛ المفتاح الغائب الذي يتغير يبدأ من صفر (مثل state.get(key, 0))."""
+        changed = delta != 0
+        self.values[changed & np.isnan(self.values)] = 0.0
+        self.values += delta
+        return self.clamp()
+
+    def random_walk(self, rng: np.random.Generator, step: float) -> "EmotionVector":
+        """تغيير عشوائي منتظم في [-step, step] لكل المفاتيح الموجودة ثم القص."""
+        self.values += rng.uniform(-step, step, size=self.values.shape)
+        return self.clamp()
+
+    def lambda_value(self) -> float:
+        """
+        قيمة Lambda لهذه الحالة بنفس معادلة batch_lambda، لكن بقراءات عددية وmath.exp:
+        لحالة واحدة تكلفة استدعاءات numpy أكبر بكثير من الحساب نفسه.
+        """
+        values = self.values.tolist()
+        positive_affect = values[_PRIDE] + values[_JOY] + values[_CALM]
+        negative_affect = values[_GUILT] + values[_FEAR] + values[_ANXIETY]
+        if positive_affect != positive_affect or negative_affect != negative_affect:
+            # مفتاح غائب (NaN) يُعامل كصفر
+            values = [0.0 if value != value else value for value in values]
+            positive_affect = values[_PRIDE] + values[_JOY] + values[_CALM]
+            negative_affect = values[_GUILT] + values[_FEAR] + values[_ANXIETY]
+        weighted_emotions = (positive_affect * 1.5) - (negative_affect * 2.0)
+        try:
+            return 1.0 / (1.0 + math.exp(-weighted_emotions / 4.0))
+        except OverflowError:
+            return 0.0
@@ -1,25 +1,74 @@
 # EmotionalProcessorV4.py - المنطق الأساسي والمحركات العاطفية
 
+import asyncio
 import numpy as np
 import os
 import json
 import random
-from typing import Dict, Any, Tuple, Optional
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+from typing import Dict, Any, List, Tuple, Optional, AsyncIterator, Iterator, Union, TYPE_CHECKING
 
 # تم تصحيح الاستيراد ليصبح مطلقًا
-from EmotionalState import EmotionalState
+from EmotionalState import EmotionalState, StateConflictError, DEFAULT_SESSION_ID
+from StateStore import SessionStateStore
 from PromptBuilder import PromptBuilder
+from CompiledForest import CompiledForest
+from EmotionVector import EmotionVector, EMOTION_INDEX, EMOTION_KEYS
+from ResponseCache import ResponseCache
+from ConversationMemory import ConversationMemory
+from LLMResilience import LLMGuard, LLMUnavailable
+from PromptLexicon import prompt_tone
+from SamplingProfiler import SamplingProfiler
+import Metrics
+
+# (يُتطلب تثبيت scikit-learn) - يُستورد عند التدريب فقط لتسريع بدء التشغيل
+if TYPE_CHECKING:
+    from sklearn.ensemble import RandomForestClassifier
+
+# مسار النموذج الداخلي المُدرَّب مسبقًا (انظر train_model.py)
+INTERNAL_MODEL_PATH = os.environ.get("INTERNAL_MODEL_PATH", os.path.join("models", "emotion_forest"))
+
+@contextmanager
+def _timed(trace: Optional[Dict[str, Any]], stage: str) -> Iterator[None]:
+    """يسجل زمن مرحلة (بالثواني) في trace['timings'] إذا كان التتبع مفعّلًا."""
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace["timings"][stage] = time.perf_counter() - start
+
+
+def _update_delta(joy: float, fear: float) -> np.ndarray:
+    """متجه تغيير ثابت لفئة تنبؤ (يُبنى مرة واحدة بدل تعديل القاموس مفتاحًا بمفتاح)."""
+    delta = np.zeros(len(EMOTION_KEYS))
+    delta[EMOTION_INDEX['joy']] = joy
+    delta[EMOTION_INDEX['fear']] = fear
+    return delta
 
-# (يُتطلب تثبيت scikit-learn)
-from sklearn.ensemble import RandomForestClassifier
 
 class EmotionalEngine:
     """يدير محرك الذكاء الاصطناعي والاستجابات العاطفية."""
 
-    def __init__(self, state_manager: EmotionalState):
-        """تهيئة المحرك."""
-        self.state = state_manager.state  # EmotionalState هي كائن EmotionalState
-        self.state_manager = state_manager # مدير الحالة للوصول لوظائف الحفظ والتحميل
+    update_magnitude = 0.15 # حجم التغيير
+    # متجهات التغيير لكل فئة: 1 إيجابي (فرح+، خوف-)، 2 سلبي (خوف+، فرح-)
+    update_deltas = {
+        1: _update_delta(update_magnitude, -update_magnitude),
+        2: _update_delta(-update_magnitude, update_magnitude),
+    }
+
+    def __init__(self, state_store: SessionStateStore, warm_up: bool = True):
+        """
+        تهيئة المحرك.
+        warm_up: تحميل النموذج الداخلي وعميل Gemini فورًا؛ عند False يجب استدعاء warm_up() لاحقًا
+        (مثلًا في الخلفية بعد بدء الخادم) وحتى ذلك الحين يُستخدم التنبؤ العشوائي الاحتياطي.
+        """
+        self.state_store = state_store # مخزن الحالات لكل جلسة (للوصول لوظائف الحفظ والتحميل)
 
         # === التصحيح الحاسم لخطأ AttributeError ===
         # يجب تعريف is_simulated هنا مباشرة قبل استخدامه
@@ -27,21 +76,83 @@ class EmotionalEngine:
         
         # يُستخدم وزن أخلاقي افتراضي، يمكن تغييره
         self.ethical_weight = PromptBuilder.ethical_weight.get('ethical_weight', 1.0) 
+
+        # مولد أرقام عشوائية للمسار المتجهي في وضع المحاكاة
+        self.rng = np.random.default_rng()
         
-        # تهيئة عميل LLM (يجب أن يتم بعد تعريف self.is_simulated)
-        self.llm_client = self._initialize_llm_client()
+        # عميل LLM يُهيأ أثناء الإحماء أو عند أول استدعاء (استيراد google.generativeai مكلف)
+        self.llm_client: Any = None
 
         # نموذج التعلم الآلي الداخلي (التطوير 14)
-        self.internal_llm_model: Optional[RandomForestClassifier] = None 
+        self.emotions_features = ['joy', 'fear', 'calm']
+        # مدخلات المصنف: ميزات الحالة ثم اتجاه رسالة المستخدم (PromptLexicon.prompt_tone)
+        self.model_features = self.emotions_features + ['prompt_tone']
+        self.internal_llm_model: Optional["RandomForestClassifier"] = None 
+        # النسخة المُجمَّعة من النموذج الداخلي (المسار السريع للتنبؤ)
+        self.internal_classifier: Optional[CompiledForest] = None
         
-        if not self.is_simulated:
-             # إذا كان المفتاح موجودًا، قم بتهيئة نموذج LLM داخلي
-             # نستخدم `gemini-2.5-flash` كنموذج افتراضي داخلي
-             self.internal_llm_model = 'gemini-2.5-flash' 
+        # نموذج Gemini المستخدم لتوليد الردود (منفصل عن المصنف الداخلي أعلاه)
+        # نستخدم `gemini-2.5-flash` كنموذج افتراضي
+        self.llm_model_name = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+
+        # حدود التزامن والمهلة لمسار الدردشة غير المتزامن
+        self.request_timeout = float(os.environ.get("CHAT_REQUEST_TIMEOUT", "30"))
+        self.llm_max_concurrency = int(os.environ.get("LLM_MAX_CONCURRENCY", "256"))
+        self.llm_semaphore = asyncio.Semaphore(self.llm_max_concurrency)
+        # أقصى عدد من استدعاءات Gemini المتزامنة لدفعة واحدة (/chat/batch) ضمن الحد العام أعلاه
+        self.batch_concurrency = max(1, int(os.environ.get("BATCH_CONCURRENCY", "16")))
+        # ميزانية زمن لكل استدعاء Gemini، طلبات تحوط بعد p95، وقاطع دائرة؛ عند الرفض أو انتهاء الميزانية
+        # يُرد برد المحاكاة المحلي ويُعلَّم الرد كمخفض (degraded)
+        self.llm_guard = LLMGuard()
+        # التخزين المؤقت للبادئة الثابتة لدى Gemini (context caching) حتى لا يعيد الخادم معالجتها في كل طلب
+        self.context_cache_enabled = os.environ.get("GEMINI_CONTEXT_CACHE", "0") == "1"
+        self.context_cache_ttl = float(os.environ.get("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+        self._context_cache: Any = None
+        self._context_cache_expires = 0.0
+        self._context_cache_lock = threading.Lock()
+
+        # ذاكرة مؤقتة اختيارية لردود Gemini (RESPONSE_CACHE=memory|sqlite)
+        self.response_cache: Optional[ResponseCache] = ResponseCache.from_env()
+
+        # ذاكرة المحادثة: آخر الدورات + ملخص متدحرج ضمن ميزانية رموز (CONVERSATION_MEMORY=0 يعطلها)
+        self.memory: Optional[ConversationMemory] = ConversationMemory.from_env(
+            getattr(state_store, "interaction_log", None)
+        )
+
+        # التأخير بين أجزاء الرد المتدفق في وضع المحاكاة (لتقليد سرعة توليد Gemini)
+        self.simulated_stream_delay = float(os.environ.get("SIMULATED_STREAM_DELAY", "0.02"))
         
-        # تهيئة البيانات التدريبية (لغرض العرض)
-        self._load_training_data()
-        self._train_internal_model()
+        # محلل أداء بأخذ عينات لنسبة من الطلبات (PROFILE_SAMPLE_RATE، قابل للتغيير أثناء التشغيل)
+        self.profiler = SamplingProfiler()
+
+        # يُضبط عند انتهاء الإحماء (نقطة /ready)
+        self.ready = threading.Event()
+        if warm_up:
+            self.warm_up()
+
+    def warm_up(self):
+        """تهيئة الأجزاء الثقيلة: عميل Gemini والنموذج الداخلي (من الملف المحفوظ أو بالتدريب)."""
+        if self.ready.is_set():
+            return
+        if self.llm_client is None:
+            self.llm_client = self._initialize_llm_client()
+
+        self.internal_classifier = self._load_internal_model(INTERNAL_MODEL_PATH)
+        if self.internal_classifier is None:
+            # لا يوجد نموذج محفوظ: تهيئة البيانات التدريبية (لغرض العرض) والتدريب الآن
+            self._load_training_data()
+            self._train_internal_model()
+        self.ready.set()
+
+    def _load_internal_model(self, path: str) -> Optional[CompiledForest]:
+        """تحميل النموذج المُجمَّع المحفوظ بتعيين الذاكرة (mmap) لتتشارك العمليات صفحاته."""
+        if not os.path.isdir(path):
+            return None
+        try:
+            return CompiledForest.load(path, expected_features=self.model_features)
+        except Exception as e:
+            print(f"Error loading internal model artifact: {e}")
+            return None
 
 
     def _initialize_llm_client(self) -> Any:
@@ -63,140 +174,665 @@ class EmotionalEngine:
 
 
     # دوال غير خطية والمشاعر الثانوية (Lambda) -> float
-    def _calculate_lambda(self) -> float:
-        """حساب تأثير المشاعر الإيجابية والسلبية على الاستجابة."""
-        
-        # المشاعر الإيجابية (تعزز التعبير)
-        positive_affect = self.state.get('pride', 0) + self.state.get('joy', 0) + self.state.get('calm', 0)
-        
-        # المشاعر السلبية (تخفض التعبير)
-        negative_affect = self.state.get('guilt', 0) + self.state.get('fear', 0) + self.state.get('anxiety', 0)
-        
-        # حساب التوتر الكلي للنموذج
-        weighted_emotions = (positive_affect * 1.5) - (negative_affect * 2.0)
-        
-        # تسطيح (ضمان قيمة بين 0 و 1) باستخدام دالة Sigmoid (التطوير 10)
-        # np.exp(-x) / (1 + np.exp(-x)) هو 1 / (1 + e^x)
-        # نستخدم الصيغة: 1 / (1 + np.exp(-weighted_emotions))
-        lambda_value = 1.0 / (1.0 + np.exp(-weighted_emotions / 4.0)) # تم تعديل القسمة لتنعيم المنحنى
-        
-        return float(lambda_value)
+    def _calculate_lambda(self, state: Union[Dict[str, float], EmotionVector]) -> float:
+        """
+        حساب تأثير المشاعر الإيجابية والسلبية على الاستجابة.
+        (pride+joy+calm)*1.5 - (guilt+fear+anxiety)*2.0 ثم Sigmoid (التطوير 10) مع قسمة على 4 لتنعيم المنحنى؛
+        الحساب المتجهي في EmotionVector.lambda_value / batch_lambda.
+        """
+        if not isinstance(state, EmotionVector):
+            state = EmotionVector.from_dict(state)
+        return state.lambda_value()
 
-    def _generate_simulated_response(self, user_prompt: str) -> Tuple[str, Dict[str, float]]:
+    def _generate_simulated_response(self, user_prompt: str, session: EmotionalState,
+                                     trace: Optional[Dict[str, Any]] = None) -> Tuple[str, Dict[str, float]]:
         """يولد استجابة وهمية وتحديث حالة وهمي في وضع المحاكاة."""
         
         # 1. تحديث الحالة العاطفية بشكل عشوائي (محاكاة)
-        new_emotions = {}
-        for key in self.state:
-             # يتم تحديث قيمة العاطفة بشكل عشوائي بين -0.1 و 0.1
-             change = random.uniform(-0.1, 0.1)
-             new_emotions[key] = max(0.0, min(1.0, self.state[key] + change))
-        
-        self.state.update(new_emotions)
+        with _timed(trace, "update"), session.lock:
+            if trace is not None:
+                session.refresh_locked()
+                trace["state_before"] = session.vector.to_dict()
+            # يتم تحديث قيمة كل عاطفة بشكل عشوائي بين -0.1 و 0.1 (عملية متجهية واحدة)،
+            # ويُحفظ حتى يرى كل العمال نفس الحالة
+            new_emotions = session.update_state(lambda state: state.random_walk(self.rng, 0.1)).copy()
 
         # 2. توليد استجابة وهمية بناءً على محتوى المطالبة
-        lambda_val = self._calculate_lambda()
+        lambda_val = self._calculate_lambda(new_emotions)
+        if trace is not None:
+            trace["lambda_value"] = lambda_val
+        return self._simulated_reply(user_prompt, lambda_val), new_emotions.to_dict()
+
+    def _simulated_reply(self, user_prompt: str, lambda_val: float) -> str:
+        """نص الرد المحلي حسب نطاق Lambda (وضع المحاكاة، والرد المخفض عند تعذر Gemini)."""
         if lambda_val > 0.75:
-            response = f"أنا سعيد جدًا بردك! (Lambda: {lambda_val:.2f}) - الرسالة: {user_prompt}"
+            return f"أنا سعيد جدًا بردك! (Lambda: {lambda_val:.2f}) - الرسالة: {user_prompt}"
         elif lambda_val < 0.25:
-            response = f"أنا أشعر ببعض التوتر بشأن هذا. (Lambda: {lambda_val:.2f}) - الرسالة: {user_prompt}"
+            return f"أنا أشعر ببعض التوتر بشأن هذا. (Lambda: {lambda_val:.2f}) - الرسالة: {user_prompt}"
         else:
-            response = f"حسناً، هذا مثير للاهتمام. (Lambda: {lambda_val:.2f}) - الرسالة: {user_prompt}"
-        
-        return response, new_emotions
+            return f"حسناً، هذا مثير للاهتمام. (Lambda: {lambda_val:.2f}) - الرسالة: {user_prompt}"
+
+    def _degraded_reply(self, user_prompt: str, lambda_val: float, reason: str,
+                        trace: Optional[Dict[str, Any]] = None) -> str:
+        """رد محلي بدل Gemini (القاطع مفتوح أو انتهت الميزانية)؛ الحالة المحدثة تبقى كما هي."""
+        Metrics.LLM_DEGRADED.labels(reason).inc()
+        if trace is not None:
+            trace["degraded"] = reason
+        return self._simulated_reply(user_prompt, lambda_val)
 
     def _load_training_data(self):
-        """تحميل بيانات تدريب وهمية للنموذج الداخلي."""
-        self.X_train = np.array([[0.5, 0.5, 0.5], [0.1, 0.9, 0.1], [0.9, 0.1, 0.9]])
-        self.y_train = np.array([0, 1, 2]) # 0: neutral, 1: positive, 2: negative
-        self.emotions_features = ['joy', 'fear', 'calm']
+        """تحميل بيانات تدريب وهمية للنموذج الداخلي (joy, fear, calm, prompt_tone)."""
+        self.X_train = np.array([[0.5, 0.5, 0.5, 0.5], [0.1, 0.9, 0.1, 1.0], [0.9, 0.1, 0.9, 0.0],
+                                 [0.5, 0.5, 0.5, 1.0], [0.5, 0.5, 0.5, 0.0]])
+        self.y_train = np.array([0, 1, 2, 1, 2]) # 0: neutral, 1: positive, 2: negative
 
     def _train_internal_model(self):
         """تدريب نموذج التعلم الآلي الداخلي."""
         try:
+             from sklearn.ensemble import RandomForestClassifier
              self.internal_llm_model = RandomForestClassifier(n_estimators=10)
              self.internal_llm_model.fit(self.X_train, self.y_train)
+             self.internal_classifier = self._compile_internal_model(self.internal_llm_model)
         except Exception as e:
              # في حالة وجود خطأ في تهيئة النموذج (نقص المكتبات أو غيرها)
              print(f"Error training internal model: {e}")
              self.internal_llm_model = None
 
-    def _predict_and_update_state(self, user_prompt: str) -> Dict[str, float]:
-        """يتنبأ بالحالة العاطفية من المطالبة وتحديث الحالة."""
+    def _compile_internal_model(self, model: "RandomForestClassifier",
+                                samples: Optional[np.ndarray] = None) -> Optional[CompiledForest]:
+        """
+        تجميع الغابة لمسار التنبؤ السريع بعد التحقق من تطابقه مع sklearn على عينات عشوائية
+        (مع samples إن مُررت، وإلا بيانات التدريب المحلية).
+        """
+        try:
+             compiled = CompiledForest.from_sklearn(model)
+             # الميزات (joy/fear/calm/prompt_tone) محصورة بين 0 و 1
+             random_samples = np.random.default_rng(0).uniform(0.0, 1.0, size=(512, len(self.model_features)))
+             if samples is None:
+                  samples = getattr(self, "X_train", None)
+             samples = random_samples if samples is None else np.vstack([random_samples, samples])
+             if compiled.matches(model, samples):
+                  return compiled
+             print("WARNING: compiled internal model disagrees with sklearn; using sklearn predict.")
+        except Exception as e:
+             print(f"Error compiling internal model: {e}")
+        return None
+
+    def swap_internal_model(self, compiled: CompiledForest, model: Optional["RandomForestClassifier"] = None):
+        """
+        استبدال النموذج الداخلي أثناء التشغيل (إعادة التدريب في الخلفية). كل تنبؤ يقرأ المرجع مرة واحدة،
+        فالتبديل بإسناد واحد لا يوقف الطلبات الجارية: ما بدأ بالنموذج القديم ينتهي به.
+        """
+        if model is not None:
+            self.internal_llm_model = model
+        self.internal_classifier = compiled
+
+    def predict_emotion_classes(self, features: np.ndarray) -> np.ndarray:
+        """تنبؤ دفعي: يصنف مصفوفة ميزات (n, len(model_features)) لعدة جلسات في استدعاء واحد."""
+        features = np.asarray(features, dtype=np.float64).reshape(-1, len(self.model_features))
+        # قراءة المرجعين مرة واحدة: قد يستبدلهما swap_internal_model في أي لحظة
+        classifier, model = self.internal_classifier, self.internal_llm_model
+        if classifier is not None:
+             return classifier.predict(features)
+        if model is not None:
+             return model.predict(features)
+        return np.random.choice([0, 1, 2], size=len(features))
+
+    def _predict_and_update_state(self, user_prompt: str, session: EmotionalState,
+                                  trace: Optional[Dict[str, Any]] = None) -> EmotionVector:
+        """يتنبأ بالحالة العاطفية من المطالبة وتحديث الحالة (يعيد نسخة من المتجه المحدث)."""
+        tone = prompt_tone(user_prompt)
+        with session.lock:
+            return self._predict_and_update_locked(session, tone, trace)
+
+    def _predict_and_update_locked(self, session: EmotionalState, tone: float,
+                                   trace: Optional[Dict[str, Any]] = None) -> EmotionVector:
+        """
+        تنفيذ التنبؤ والتحديث بينما قفل الجلسة مأخوذ. مع الحالة المشتركة بين العمال يُحفظ التحديث بمقارنة
+        الإصدار؛ إذا سبقه عامل آخر يُعاد التنبؤ على الحالة الأحدث بدل الكتابة فوقها.
+        """
+        session.refresh_locked()
+        for _ in range(session.storage.cas_retries):
+            new_emotions = self._predict_next_state(session.vector, tone, trace)
+
+            # خطوة 3: تحديث الحالة وحفظها
+            with _timed(trace, "save"):
+                saved = session.try_save(new_emotions) # حفظ الحالة في SQLite وتحديث الحالة في الذاكرة
+            if saved:
+                return new_emotions.copy()
+
+        raise StateConflictError(
+            f"Could not save session {session.session_id!r} after {session.storage.cas_retries} attempts"
+        )
+
+    def _predict_next_state(self, state: EmotionVector, tone: float,
+                            trace: Optional[Dict[str, Any]] = None) -> EmotionVector:
+        """يتنبأ بفئة التحديث من الحالة الحالية واتجاه الرسالة (tone) ويعيد نسخة جديدة محدثة (دون حفظ)."""
+        if trace is not None:
+            trace["state_before"] = state.to_dict()
         
-        # خطوة 1: استخراج الميزات العاطفية من المطالبة (محاكاة)
+        # خطوة 1: الميزات العاطفية من الحالة، واتجاه المطالبة من قائمتي الكلمات
         # في تطبيق حقيقي، سيتم استخدام LLM أو NLP لتحليل النص
+        current_features = state.select(self.emotions_features, 0.5)
+        current_features.append(tone)
         
-        # محاكاة تأثير المشاعر على الحالة:
-        current_features = np.array([
-            self.state.get('joy', 0.5), 
-            self.state.get('fear', 0.5), 
-            self.state.get('calm', 0.5)
-        ]).reshape(1, -1)
-        
-        if self.internal_llm_model:
-             prediction = self.internal_llm_model.predict(current_features)[0]
-        else:
-             # العودة إلى العشوائية إذا فشل النموذج
-             prediction = random.choice([0, 1, 2])
-        
-        # خطوة 2: تطبيق التحديثات
-        update_magnitude = 0.15 # حجم التغيير
-        new_emotions = self.state.copy()
+        with _timed(trace, "predict"):
+            classifier, model = self.internal_classifier, self.internal_llm_model
+            if classifier is not None:
+                 # المسار السريع: بدون تحقق sklearn وتوزيع joblib لكل طلب
+                 prediction = classifier.predict_one(current_features)
+            elif model:
+                 prediction = model.predict(np.array(current_features).reshape(1, -1))[0]
+            else:
+                 # العودة إلى العشوائية إذا فشل النموذج
+                 prediction = random.choice([0, 1, 2])
         
-        if prediction == 1: # إيجابي
-            new_emotions['joy'] = min(1.0, new_emotions.get('joy', 0) + update_magnitude)
-            new_emotions['fear'] = max(0.0, new_emotions.get('fear', 0) - update_magnitude)
-        elif prediction == 2: # سلبي
-            new_emotions['fear'] = min(1.0, new_emotions.get('fear', 0) + update_magnitude)
-            new_emotions['joy'] = max(0.0, new_emotions.get('joy', 0) - update_magnitude)
-        
-        # خطوة 3: تحديث الحالة وحفظها
-        self.state.update(new_emotions)
-        self.state_manager.save_state(new_emotions) # حفظ الحالة في SQLite
+        # خطوة 2: تطبيق التحديثات (0: محايد بلا تغيير، 1: إيجابي، 2: سلبي)
+        new_emotions = state.copy()
+        delta = self.update_deltas.get(int(prediction))
+        if delta is not None:
+            new_emotions.update(delta)
         
         return new_emotions
 
-    def _generate_llm_response(self, user_prompt: str) -> Tuple[str, Dict[str, float]]:
+    def _response_cache_key(self, user_prompt: str, state: EmotionVector, lambda_val: float, use_cache: bool,
+                            session_id: Optional[str] = None) -> Optional[str]:
+        """
+        مفتاح الذاكرة المؤقتة للرد، أو None إذا كانت معطلة أو تجاوزها الطلب.
+        مع ذاكرة المحادثة يدخل سياق الجلسة في المفتاح، فلا يُعاد رد كُتب لمحادثة أخرى.
+        """
+        if self.response_cache is None or not use_cache:
+            return None
+        context = ""
+        if self.memory is not None and session_id is not None:
+            context = self.memory.digest(session_id)
+        return self.response_cache.make_key(user_prompt, state, lambda_val, self.llm_model_name, context)
+
+    async def _response_cache_key_async(self, user_prompt: str, state: EmotionVector, lambda_val: float,
+                                        use_cache: bool, session_id: Optional[str] = None) -> Optional[str]:
+        """مثل _response_cache_key، لكن تحميل ذاكرة جلسة غير موجودة في الذاكرة (قراءة SQLite) يتم خارج حلقة الأحداث."""
+        if (self.response_cache is not None and use_cache and self.memory is not None
+                and session_id is not None and self.memory.needs_read(session_id)):
+            await asyncio.to_thread(self.memory.load, session_id)
+        return self._response_cache_key(user_prompt, state, lambda_val, use_cache, session_id)
+
+    async def _run_cache(self, method: Any, *args: Any) -> Any:
+        """تنفيذ عملية على الذاكرة المؤقتة؛ الواجهات التي تلمس القرص تُنفَّذ خارج حلقة الأحداث."""
+        if self.response_cache.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    def _generate_llm_response(self, user_prompt: str, session: EmotionalState, use_cache: bool = True,
+                               trace: Optional[Dict[str, Any]] = None) -> Tuple[str, Dict[str, float]]:
         """يستخدم Gemini API لتوليد الاستجابة."""
         
         # 1. تحديث الحالة
-        updated_state = self._predict_and_update_state(user_prompt)
-        lambda_val = self._calculate_lambda()
+        updated_state = self._predict_and_update_state(user_prompt, session, trace)
+        lambda_val = self._calculate_lambda(updated_state)
+        if trace is not None:
+            trace["lambda_value"] = lambda_val
+
+        # الرد المخزن لنفس المطالبة ونفس نطاق الحالة يغني عن استدعاء Gemini
+        cache_key = self._response_cache_key(user_prompt, updated_state, lambda_val, use_cache, session.session_id)
+        if cache_key is not None:
+            with _timed(trace, "cache"):
+                cached = self.response_cache.get(cache_key)
+            Metrics.CACHE_LOOKUPS.labels("miss" if cached is None else "hit").inc()
+            if cached is not None:
+                return cached, updated_state.to_dict()
         
         # 2. بناء المطالبة باستخدام الحالة الحالية
-        system_prompt = PromptBuilder.build_system_prompt(self.state, lambda_val)
-        
         # 3. استدعاء API
         try:
-            client = self.llm_client
-            
-            # هنا يجب استخدام النموذج الذي تم تحديده في التهيئة
-            model_name = self.internal_llm_model if self.internal_llm_model else 'gemini-2.5-flash'
-            
-            response = client.generate_content(
-                 model=model_name,
-                 contents=[user_prompt],
-                 system_instruction=system_prompt
-            )
-            
-            response_text = response.text
+            with _timed(trace, "prompt"):
+                model, contents = self._build_llm_request(user_prompt, updated_state, lambda_val, session.session_id)
+            with _timed(trace, "llm"):
+                response = self.llm_guard.call(lambda: model.generate_content(contents))
+                response_text = response.text
+            if cache_key is not None:
+                self.response_cache.set(cache_key, response_text)
+
+        except LLMUnavailable as e:
+            response_text = self._degraded_reply(user_prompt, lambda_val, e.reason, trace)
+        except Exception as e:
+            response_text = f"عذرًا، فشل الاتصال بخدمة Gemini API: {str(e)}"
+            print(f"Gemini API Error: {e}")
+            Metrics.GEMINI_ERRORS.inc()
+            if trace is not None:
+                trace["error"] = True
             
+        return response_text, updated_state.to_dict()
+
+    def _build_llm_request(self, user_prompt: str, state: EmotionVector, lambda_val: float,
+                           session_id: Optional[str] = None) -> Tuple[Any, list]:
+        """
+        ينشئ نموذج Gemini ومحتوى الطلب. مع التخزين المؤقت للسياق تُرسل البادئة الثابتة مرة واحدة
+        (CachedContent) وتُرفق اللاحقة المتغيرة مع رسالة المستخدم؛ وإلا تُرسل تعليمات النظام كاملة.
+        مع session_id وذاكرة المحادثة يسبق الرسالة سياق الجلسة (دورات + ملخص) ضمن MEMORY_TOKEN_BUDGET.
+        """
+        if self.llm_client is None:
+            self.llm_client = self._initialize_llm_client()
+
+        cached_prefix = self._get_cached_prefix()
+        if cached_prefix is not None:
+            model = self.llm_client.GenerativeModel.from_cached_content(cached_content=cached_prefix)
+            instructions = PromptBuilder.static_prefix
+            prefix_parts = [PromptBuilder.build_dynamic_suffix(state, lambda_val)]
+        else:
+            instructions = PromptBuilder.build_system_prompt(state, lambda_val)
+            model = self.llm_client.GenerativeModel(self.llm_model_name, system_instruction=instructions)
+            prefix_parts = []
+
+        if self.memory is None or session_id is None:
+            return model, [*prefix_parts, user_prompt]
+        return model, self.memory.build_contents(
+            session_id, user_prompt, reserved_tokens=self.memory.tokens(instructions), prefix_parts=prefix_parts
+        )
+
+    def _context_cache_stale(self) -> bool:
+        """هل يحتاج التخزين المؤقت للبادئة إلى إنشاء أو تجديد (قبل انتهائه بدقيقة)؟"""
+        return self.context_cache_enabled and time.time() >= self._context_cache_expires - 60
+
+    def _get_cached_prefix(self) -> Any:
+        """يعيد CachedContent للبادئة الثابتة (ينشئه أو يجدده عند الحاجة)، أو None إذا كان معطلًا."""
+        if not self.context_cache_enabled:
+            return None
+        with self._context_cache_lock:
+            if self._context_cache_stale():
+                try:
+                    self._context_cache = self.llm_client.caching.CachedContent.create(
+                        model=self.llm_model_name,
+                        system_instruction=PromptBuilder.static_prefix,
+                        ttl=timedelta(seconds=self.context_cache_ttl),
+                    )
+                    self._context_cache_expires = time.time() + self.context_cache_ttl
+                except Exception as e:
+                    # مثلًا: البادئة أقصر من الحد الأدنى للتخزين المؤقت، أو النموذج لا يدعمه
+                    print(f"Gemini context caching unavailable, sending full system prompt: {e}")
+                    self.context_cache_enabled = False
+                    self._context_cache = None
+            return self._context_cache
+
+    async def _generate_llm_response_async(self, user_prompt: str, session: EmotionalState, use_cache: bool = True,
+                                           trace: Optional[Dict[str, Any]] = None,
+                                           deadline: Optional[float] = None) -> Tuple[str, Dict[str, float]]:
+        """النسخة غير المتزامنة: SQLite في خيط منفصل واستدعاء Gemini دون حجز خيط أثناء الانتظار."""
+        
+        # 1. تحديث الحالة (كتابة SQLite خارج حلقة الأحداث)
+        updated_state = await asyncio.to_thread(self._predict_and_update_state, user_prompt, session, trace)
+        response_text = await self._respond_llm_async(user_prompt, updated_state, use_cache, trace, session.session_id,
+                                                      deadline)
+        return response_text, updated_state.to_dict()
+
+    async def _respond_llm_async(self, user_prompt: str, updated_state: EmotionVector, use_cache: bool = True,
+                                 trace: Optional[Dict[str, Any]] = None, session_id: Optional[str] = None,
+                                 deadline: Optional[float] = None) -> str:
+        """
+        توليد رد Gemini (أو من الذاكرة المؤقتة) لحالة محدثة مسبقًا؛ أخطاء Gemini تصبح نص الرد.
+        deadline: موعد الطلب (loop.time())؛ استدعاء Gemini لا يتجاوزه، وانتهاؤه يعطي الرد المخفض.
+        """
+        lambda_val = self._calculate_lambda(updated_state)
+        if trace is not None:
+            trace["lambda_value"] = lambda_val
+
+        cache_key = await self._response_cache_key_async(user_prompt, updated_state, lambda_val, use_cache, session_id)
+        if cache_key is not None:
+            with _timed(trace, "cache"):
+                cached = await self._run_cache(self.response_cache.get, cache_key)
+            Metrics.CACHE_LOOKUPS.labels("miss" if cached is None else "hit").inc()
+            if cached is not None:
+                return cached
+        
+        # 2. بناء المطالبة باستخدام الحالة الحالية
+        # 3. استدعاء API ضمن حد التزامن
+        try:
+            with _timed(trace, "prompt"):
+                model, contents = await self._build_llm_request_async(user_prompt, updated_state, lambda_val, session_id)
+            with _timed(trace, "llm"):
+                # طلب التحوط (إن وُجد) يشارك الطلب الأصلي مكانه في حد التزامن
+                async with self.llm_semaphore:
+                    response = await self.llm_guard.call_async(lambda: model.generate_content_async(contents), deadline)
+                response_text = response.text
+            if cache_key is not None:
+                await self._run_cache(self.response_cache.set, cache_key, response_text)
+
+        except LLMUnavailable as e:
+            response_text = self._degraded_reply(user_prompt, lambda_val, e.reason, trace)
         except Exception as e:
             response_text = f"عذرًا، فشل الاتصال بخدمة Gemini API: {str(e)}"
             print(f"Gemini API Error: {e}")
+            Metrics.GEMINI_ERRORS.inc()
+            if trace is not None:
+                trace["error"] = True
             
-        return response_text, updated_state
+        return response_text
+
+
+    async def _build_llm_request_async(self, user_prompt: str, state: EmotionVector, lambda_val: float,
+                                       session_id: Optional[str] = None) -> Tuple[Any, list]:
+        """
+        مثل _build_llm_request، لكن إنشاء/تجديد CachedContent (استدعاء شبكة) وتحميل ذاكرة جلسة
+        غير موجودة في الذاكرة (قراءة SQLite) يتمان خارج حلقة الأحداث.
+        """
+        memory_miss = self.memory is not None and session_id is not None and self.memory.needs_read(session_id)
+        if self.llm_client is None or self._context_cache_stale() or memory_miss:
+            return await asyncio.to_thread(self._build_llm_request, user_prompt, state, lambda_val, session_id)
+        return self._build_llm_request(user_prompt, state, lambda_val, session_id)
+
+    def process_message(self, user_prompt: str, session_id: str = DEFAULT_SESSION_ID,
+                        use_cache: bool = True, trace: Optional[Dict[str, Any]] = None) -> Tuple[str, Dict[str, float]]:
+        """
+        الواجهة العامة لمعالجة رسالة المستخدم ضمن جلسة محددة (use_cache=False يتجاوز ذاكرة الردود).
+        trace: قاموس اختياري يملؤه المحرك بتتبع الطلب (أزمنة المراحل، و'degraded' إذا كان الرد محليًا بدل Gemini).
+        """
+        with self._track_request("chat"):
+            trace = self._new_trace(trace)
+            session = self.state_store.get(session_id)
+            
+            if self.is_simulated:
+                 response_text, updated_state = self._generate_simulated_response(user_prompt, session, trace)
+            else:
+                 response_text, updated_state = self._generate_llm_response(user_prompt, session, use_cache, trace)
+            self._finish_request(session, user_prompt, response_text, updated_state, trace)
+            return response_text, updated_state
+
+    @contextmanager
+    def _track_request(self, endpoint: str) -> Iterator[None]:
+        """عدّاد الطلبات حسب الوضع، الطلبات الجارية، وأخذ عينات المحلل لنسبة من الطلبات."""
+        Metrics.REQUESTS.labels("simulated" if self.is_simulated else "llm", endpoint).inc()
+        Metrics.IN_FLIGHT.inc()
+        try:
+            with self.profiler.maybe_profile():
+                yield
+        finally:
+            Metrics.IN_FLIGHT.dec()
+
+    def _new_trace(self, trace: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """تتبع طلب واحد: الحالة قبل التحديث، Lambda، وزمن كل مرحلة (في trace إذا مرره المستدعي)."""
+        if trace is None:
+            trace = {}
+        trace.update(timings={}, start=time.perf_counter())
+        return trace
+
+    def _finish_request(self, session: EmotionalState, user_prompt: str, response_text: str,
+                        updated_state: Dict[str, float], trace: Dict[str, Any]):
+        """
+        تسجيل أزمنة المراحل في المقاييس وإرسال دورة الدردشة إلى سجل التفاعلات (طابور في الذاكرة)
+        وإلى ذاكرة المحادثة (إلا إذا فشل الرد أو كان مخفضًا).
+        """
+        trace["timings"]["total"] = time.perf_counter() - trace["start"]
+        Metrics.observe_timings(trace["timings"])
+        # الرد الفاشل أو المخفض أو المقطوع لا يدخل سياق المحادثة (ولا عند إعادة بنائه من السجل)
+        remember = bool(response_text) and not trace.get("error") and not trace.get("degraded")
+        if self.memory is not None:
+            # الدورة تُكتب في السجل على أي حال، فتُحسب في المزامنة حتى لو لم تدخل السياق
+            self.memory.record(session.session_id, user_prompt, response_text, remember=remember)
+        try:
+            session.log_interaction({
+                "prompt": user_prompt,
+                "response": response_text,
+                "in_context": remember,
+                "state_before": trace.get("state_before"),
+                "state_after": updated_state,
+                "lambda_value": trace.get("lambda_value"),
+                "timings": trace["timings"],
+            })
+        except Exception as e:
+            print(f"Interaction log error: {e}")
 
+    async def process_message_async(self, user_prompt: str, session_id: str = DEFAULT_SESSION_ID,
+                                    use_cache: bool = True,
+                                    trace: Optional[Dict[str, Any]] = None,
+                                    timeout: Optional[float] = None) -> Tuple[str, Dict[str, float]]:
+        """
+        الواجهة العامة غير المتزامنة لمعالجة رسالة المستخدم مع مهلة لكل طلب (CHAT_REQUEST_TIMEOUT)؛ trace كما في process_message.
+        timeout: ما تبقى من مهلة العميل إن كانت أقصر (مثلًا بعد الانتظار في طابور القبول).
+        """
+        if timeout is None or timeout > self.request_timeout:
+            timeout = self.request_timeout
+        # استدعاء Gemini ينتهي قبل الموعد بهامش ويعطي الرد المخفض؛ wait_for يبقى حدًا أخيرًا لباقي المراحل
+        deadline = asyncio.get_running_loop().time() + timeout
+        with self._track_request("chat"):
+            return await asyncio.wait_for(
+                self._process_message_async(user_prompt, session_id, use_cache, trace, deadline),
+                timeout=timeout
+            )
 
-    def process_message(self, user_prompt: str) -> Tuple[str, Dict[str, float]]:
-        """الواجهة العامة لمعالجة رسالة المستخدم."""
+    async def _process_message_async(self, user_prompt: str, session_id: str, use_cache: bool,
+                                     trace: Optional[Dict[str, Any]] = None,
+                                     deadline: Optional[float] = None) -> Tuple[str, Dict[str, float]]:
+        """توجيه الطلب إلى وضع المحاكاة أو إلى Gemini."""
+        trace = self._new_trace(trace)
+        # قد يتطلب تحميل الجلسة قراءة من SQLite
+        session = await asyncio.to_thread(self.state_store.get, session_id)
         
         if self.is_simulated:
-             return self._generate_simulated_response(user_prompt)
+             response_text, updated_state = await asyncio.to_thread(
+                 self._generate_simulated_response, user_prompt, session, trace
+             )
         else:
-             return self._generate_llm_response(user_prompt)
+             response_text, updated_state = await self._generate_llm_response_async(
+                 user_prompt, session, use_cache, trace, deadline
+             )
+        self._finish_request(session, user_prompt, response_text, updated_state, trace)
+        return response_text, updated_state
+
+    async def process_batch_async(self, items: List[Tuple[str, str]],
+                                  use_cache: bool = True) -> List[Dict[str, Any]]:
+        """
+        معالجة دفعة [(user_prompt, session_id), ...] بنفس نتيجة استدعاءات process_message المتتالية:
+        تحديثات الحالة تُطبَّق أولًا بترتيب الإدخال (لكل جلسة) في معاملة SQLite واحدة، ثم تُرسل طلبات Gemini
+        متزامنة (حتى batch_concurrency) كل منها على الحالة بعد تحديث عنصره. النتائج بترتيب الإدخال،
+        وفشل عنصر لا يوقف الباقي (يظهر كـ "error" في نتيجته).
+        مع ذاكرة المحادثة تُرسل عناصر الجلسة الواحدة بالتتابع حتى يرى كل عنصر دورات ما قبله وتُسجل بترتيب الإدخال؛
+        التوازي يبقى بين الجلسات المختلفة.
+        """
+        with self._track_request("batch"):
+            traces = [self._new_trace() for _ in items]
+            sessions = await asyncio.to_thread(self._load_sessions, [session_id for _, session_id in items])
+            updates = await asyncio.to_thread(self._apply_batch_updates, items, sessions, traces)
+            semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+            async def complete(index: int) -> Dict[str, Any]:
+                user_prompt, session_id = items[index]
+                update = updates[index]
+                if isinstance(update, Exception):
+                    return {"error": str(update)}
+
+                if self.is_simulated:
+                    response_text, current_state = update
+                else:
+                    current_state = update.to_dict()
+                    try:
+                        async with semaphore:
+                            deadline = asyncio.get_running_loop().time() + self.request_timeout
+                            response_text = await asyncio.wait_for(
+                                self._respond_llm_async(user_prompt, update, use_cache, traces[index], session_id,
+                                                        deadline),
+                                timeout=self.request_timeout
+                            )
+                    except asyncio.TimeoutError:
+                        return {"error": "Request timed out.", "current_state": current_state}
+
+                self._finish_request(sessions[session_id], user_prompt, response_text, current_state, traces[index])
+                result = {"response": response_text, "current_state": current_state}
+                if "degraded" in traces[index]:
+                    result["degraded"] = traces[index]["degraded"]
+                return result
+
+            if self.memory is None:
+                results = await asyncio.gather(*(complete(index) for index in range(len(items))))
+            else:
+                by_session: Dict[str, List[int]] = {}
+                for index, (_, session_id) in enumerate(items):
+                    by_session.setdefault(session_id, []).append(index)
+                results: List[Dict[str, Any]] = [{} for _ in items]
+
+                async def complete_session(indexes: List[int]):
+                    for index in indexes:
+                        results[index] = await complete(index)
+
+                await asyncio.gather(*(complete_session(indexes) for indexes in by_session.values()))
+        return [
+            {"index": index, "session_id": items[index][1], **result}
+            for index, result in enumerate(results)
+        ]
+
+    def _load_sessions(self, session_ids: List[str]) -> Dict[str, EmotionalState]:
+        """تحميل كل جلسات الدفعة مرة واحدة (بترتيب ظهورها الأول)."""
+        return {session_id: self.state_store.get(session_id) for session_id in dict.fromkeys(session_ids)}
+
+    def _apply_batch_updates(self, items: List[Tuple[str, str]], sessions: Dict[str, EmotionalState],
+                             traces: List[Dict[str, Any]]) -> List[Any]:
+        """
+        المرحلة الأولى من الدفعة: كل تحديثات الحالة بالترتيب تحت أقفال جلساتها وفي معاملة واحدة.
+        يعيد لكل عنصر المتجه المحدث (أو الرد والحالة في وضع المحاكاة) أو الاستثناء الذي رفعه.
+        """
+        results: List[Any] = []
+        with ExitStack() as locks:
+            # أقفال الجلسات قبل معاملة التخزين (نفس ترتيب المسار العادي)، وبترتيب ثابت يمنع الجمود بين دفعتين
+            for session_id in sorted(sessions):
+                locks.enter_context(sessions[session_id].lock)
+            try:
+                with self.state_store.storage.batch():
+                    for (user_prompt, session_id), trace in zip(items, traces):
+                        session = sessions[session_id]
+                        try:
+                            if self.is_simulated:
+                                results.append(self._generate_simulated_response(user_prompt, session, trace))
+                            else:
+                                results.append(self._predict_and_update_state(user_prompt, session, trace))
+                        except Exception as e:
+                            results.append(e)
+            except Exception:
+                # أُلغيت المعاملة كلها: إعادة النسخ في الذاكرة إلى ما في القاعدة
+                for session in sessions.values():
+                    session.reload()
+                raise
+        return results
+
+    async def stream_message(self, user_prompt: str, session_id: str = DEFAULT_SESSION_ID,
+                             use_cache: bool = True) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        يبث الرد جزءًا بجزء كأحداث (اسم الحدث، البيانات):
+        'state' بالحالة المحدثة وقيمة Lambda أولًا، ثم 'delta' لكل جزء من النص، ثم 'done' (أو 'error').
+        """
+        with self._track_request("stream"):
+            async for event in self._stream_message(user_prompt, session_id, use_cache):
+                yield event
+
+    async def _stream_message(self, user_prompt: str, session_id: str,
+                              use_cache: bool) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """تنفيذ البث: تحديث الحالة ثم أجزاء الرد (من المحاكاة أو الذاكرة المؤقتة أو Gemini)."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_timeout
+        trace = self._new_trace()
+        session = await asyncio.to_thread(self.state_store.get, session_id)
+
+        if self.is_simulated:
+            response_text, updated_state = await asyncio.to_thread(
+                self._generate_simulated_response, user_prompt, session, trace
+            )
+        else:
+            updated_state = await asyncio.to_thread(self._predict_and_update_state, user_prompt, session, trace)
+        lambda_val = self._calculate_lambda(updated_state)
+        trace["lambda_value"] = lambda_val
+        current_state = updated_state.to_dict() if isinstance(updated_state, EmotionVector) else updated_state
+        final_event = {"current_state": current_state, "lambda_value": lambda_val}
+
+        yield "state", final_event
+
+        parts = []
+        try:
+            if self.is_simulated:
+                # تقسيم الرد الوهمي إلى كلمات لمحاكاة البث دون اتصال بالشبكة
+                for index, word in enumerate(response_text.split(" ")):
+                    await asyncio.sleep(self.simulated_stream_delay)
+                    text = word if index == 0 else " " + word
+                    parts.append(text)
+                    yield "delta", {"text": text}
+            else:
+                cache_key = await self._response_cache_key_async(user_prompt, updated_state, lambda_val, use_cache,
+                                                                 session_id)
+                cached = None
+                if cache_key is not None:
+                    cached = await self._run_cache(self.response_cache.get, cache_key)
+                    Metrics.CACHE_LOOKUPS.labels("miss" if cached is None else "hit").inc()
+                if cached is not None:
+                    parts.append(cached)
+                    yield "delta", {"text": cached}
+                else:
+                    with _timed(trace, "llm"):
+                        async for text in self._stream_llm_chunks(user_prompt, updated_state, lambda_val, deadline,
+                                                                  session_id):
+                            parts.append(text)
+                            yield "delta", {"text": text}
+                    # لا يُخزَّن إلا الرد المكتمل دون أخطاء
+                    if cache_key is not None:
+                        await self._run_cache(self.response_cache.set, cache_key, "".join(parts))
+
+        except LLMUnavailable as e:
+            # لا يحدث إلا قبل أول جزء من Gemini، فيُبث الرد المحلي بدلًا منه
+            text = self._degraded_reply(user_prompt, lambda_val, e.reason, trace)
+            parts.append(text)
+            yield "delta", {"text": text}
+        except asyncio.TimeoutError:
+            trace["error"] = True
+            yield "error", {"message": "Request timed out."}
+        except Exception as e:
+            print(f"Gemini API Error: {e}")
+            Metrics.GEMINI_ERRORS.inc()
+            trace["error"] = True
+            yield "error", {"message": f"عذرًا، فشل الاتصال بخدمة Gemini API: {str(e)}"}
+
+        self._finish_request(session, user_prompt, "".join(parts), current_state, trace)
+        if "degraded" in trace:
+            final_event = {**final_event, "degraded": trace["degraded"]}
+        yield "done", final_event
+
+    async def _stream_llm_chunks(self, user_prompt: str, state: EmotionVector, lambda_val: float,
+                                 deadline: float, session_id: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        يبث أجزاء نص Gemini ضمن حد التزامن والموعد النهائي للطلب. القاطع يُفحص قبل الاستدعاء، وميزانية
+        llm_guard تحد زمن بدء البث (بعد أول جزء لا يمكن التحول إلى الرد المحلي)؛ لا تحوط في البث.
+        """
+        loop = asyncio.get_running_loop()
+        model, contents = await self._build_llm_request_async(user_prompt, state, lambda_val, session_id)
+        self.llm_guard.admit()
+        start = time.perf_counter()
+        settled = False
+        try:
+            async with self.llm_semaphore:
+                try:
+                    response = await asyncio.wait_for(
+                        model.generate_content_async(contents, stream=True),
+                        timeout=max(0.0, min(deadline - loop.time(), self.llm_guard.budget))
+                    )
+                except asyncio.TimeoutError:
+                    settled = True
+                    raise self.llm_guard.timed_out() from None
+                chunks = response.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(
+                            chunks.__anext__(), timeout=max(0.0, deadline - loop.time())
+                        )
+                    except StopAsyncIteration:
+                        break
+                    if chunk.text:
+                        yield chunk.text
+            settled = True
+            self.llm_guard.record_success(start)
+        except Exception:
+            if not settled:
+                settled = True
+                self.llm_guard.record_failure()
+            raise
+        finally:
+            if not settled:
+                # توقف المستهلك (انقطاع العميل) قبل النتيجة
+                self.llm_guard.breaker.release()
 
-    def get_current_state(self) -> Dict[str, float]:
-        """يعيد الحالة العاطفية الحالية."""
-        return self.state
+    def get_current_state(self, session_id: str = DEFAULT_SESSION_ID) -> Dict[str, float]:
+        """يعيد الحالة العاطفية الحالية للجلسة."""
+        return self.state_store.get_state(session_id)
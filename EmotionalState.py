@@ -1,116 +1,498 @@
 # EmotionalState.py - تخزين الحالة والذاكرة
 
+import atexit
+import concurrent.futures
+import os
 import sqlite3
 import json
+import threading
 import time
-from typing import Dict, Any
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple, Union, TYPE_CHECKING
 
-class EmotionalState:
-    """تدير تخزين حالة الكائن العاطفية في قاعدة بيانات SQLite."""
+from EmotionVector import EmotionVector
+import Metrics
 
-    def __init__(self, db_path: str = 'emotions.db'):
-        """تهيئة الكلاس وتحميل الحالة الحالية من DB أو تهيئتها."""
+if TYPE_CHECKING:
+    from InteractionLog import InteractionLog
+
+# معرف الجلسة المستخدم عندما لا يحدد العميل جلسة
+DEFAULT_SESSION_ID = 'default'
+
+# مدرجات زمن الحفظ والتحميل (تُحسب مرة واحدة بدل البحث عن التسمية في كل استدعاء)
+_SAVE_SECONDS = Metrics.STORAGE_SECONDS.labels("save")
+_LOAD_SECONDS = Metrics.STORAGE_SECONDS.labels("load")
+
+class StateConflictError(RuntimeError):
+    """فشل حفظ الحالة بعد استنفاد محاولات المقارنة والتبديل (عمال آخرون يكتبون نفس الجلسة باستمرار)."""
+
+
+class StateStorage:
+    """طبقة التخزين: اتصال SQLite طويل العمر بوضع WAL مع كتابة مؤجلة اختيارية (write-behind)."""
+
+    def __init__(self, db_path: str = 'emotions.db',
+                 write_behind: Optional[bool] = None,
+                 flush_interval: Optional[float] = None,
+                 flush_every: Optional[int] = None,
+                 shared: Optional[bool] = None,
+                 cas_retries: Optional[int] = None):
+        """
+        write_behind: دمج التحديثات في الذاكرة وكتابتها دفعة واحدة (افتراضيًا من EMOTION_WRITE_BEHIND).
+        flush_interval: أقصى مدة (ثوانٍ) تبقى فيها التحديثات غير مكتوبة، أي نافذة فقدان البيانات.
+        flush_every: الكتابة فورًا عند تراكم هذا العدد من التحديثات.
+        shared: حالة مشتركة بين عدة عمليات (uvicorn --workers N): كل حفظ يقارن رقم إصدار الجلسة
+                ويبدّله ذريًا، وكل قراءة تتحقق من الإصدار (افتراضيًا من EMOTION_SHARED_STATE، مفعّل
+                ما لم تُفعَّل الكتابة المؤجلة التي تناسب عملية واحدة فقط).
+        cas_retries: عدد محاولات الحفظ عند التعارض قبل رفع StateConflictError (EMOTION_CAS_RETRIES).
+        """
         self.db_path = db_path
-        self.initialize_db()
-        self.state = self.load_state()
-
-        # القيم الافتراضية
-        initial_state = {
-            'temperament_bias': 0.5, # الانحياز المزاجي (ثابت عادة)
-            'maturity': 1.0,         # النضج (يزداد بمرور الوقت)
-            'joy': 0.5,
-            'fear': 0.0,
-            'calm': 0.5,
-            'anxiety': 0.0,
-            'pride': 0.0,
-            'guilt': 0.0,
-            # يمكن إضافة المزيد من المشاعر هنا
-        }
-        
-        # تحميل الحالة أو استخدام الافتراضيات
-        if not self.state:
-            self.state = initial_state
-            self.save_state(self.state) # حفظ الحالة الأولية
 
-    def initialize_db(self):
-        """التطور 1: إنشاء قاعدة بيانات وتهيئة الجدول الرئيسي."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # جدول 'state' لتخزين بيانات الحالة الرئيسية (قيمة واحدة لكل مفتاح)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS state (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-        """)
+        if write_behind is None:
+            write_behind = os.environ.get("EMOTION_WRITE_BEHIND", "0") == "1"
+        if flush_interval is None:
+            flush_interval = float(os.environ.get("EMOTION_FLUSH_INTERVAL", "1.0"))
+        if flush_every is None:
+            flush_every = int(os.environ.get("EMOTION_FLUSH_EVERY", "50"))
+        if shared is None:
+            shared = os.environ.get("EMOTION_SHARED_STATE", "0" if write_behind else "1") == "1"
+        if cas_retries is None:
+            cas_retries = int(os.environ.get("EMOTION_CAS_RETRIES", "10"))
+        if shared and write_behind:
+            # التحديثات المؤجلة في ذاكرة عامل واحد لا يراها الآخرون ولا تمر بمقارنة الإصدار
+            print("--- WARNING: EMOTION_WRITE_BEHIND is disabled because state is shared between workers. ---")
+            write_behind = False
+
+        self.shared = shared
+        self.cas_retries = max(1, cas_retries)
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.flush_every = max(1, flush_every)
+
+        # اتصال واحد مشترك بين الخيوط، محمي بقفل (sqlite3 لا يسمح بالكتابة المتزامنة على نفس الاتصال)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # مع WAL يكفي synchronous=NORMAL: لا fsync لكل معاملة، مع بقاء القاعدة سليمة عند الانهيار
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+
+        # التحديثات المعلقة ((session_id, key) -> value) في وضع الكتابة المؤجلة
+        self._pending: Dict[Tuple[str, str], str] = {}
+        self._pending_updates = 0
+        self._closed = False
+        self._stop_event = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._schema_ready = False
+        # داخل batch(): كل الكتابات تنضم إلى معاملة واحدة مفتوحة بدل فتح معاملة لكل منها
+        self._in_batch = False
+        # كاتب جدول log (خيط واحد يحفظ الترتيب)؛ يُنشأ عند أول سطر
+        self._log_writer: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._log_writer_lock = threading.Lock()
+
+        if self.write_behind:
+            self._flusher = threading.Thread(target=self._flush_loop, name="state-flusher", daemon=True)
+            self._flusher.start()
+
+        self.initialize_schema()
+
+        # ضمان كتابة ما تبقى عند إيقاف العملية
+        atexit.register(self.close)
 
-        # جدول 'log' لتسجيل التفاعلات (اختياري)
-        cursor.execute("""
+    def initialize_schema(self):
+        """التطور 1: إنشاء الجداول (حالة لكل جلسة + جدول log) ونقل جدول state القديم إن وجد."""
+        if self._schema_ready:
+            return
+        self.execute_script(
+            # جدول 'session_state' لتخزين حالة كل جلسة (قيمة واحدة لكل مفتاح في كل جلسة)
+            """
+            CREATE TABLE IF NOT EXISTS session_state (
+                session_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                PRIMARY KEY (session_id, key)
+            ) WITHOUT ROWID
+            """,
+            # رقم إصدار لكل جلسة يزداد مع كل حفظ (المقارنة والتبديل بين العمال)
+            """
+            CREATE TABLE IF NOT EXISTS session_version (
+                session_id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            ) WITHOUT ROWID
+            """,
+            # جدول 'log' لتسجيل التفاعلات (اختياري)
+            """
             CREATE TABLE IF NOT EXISTS log (
                 id INTEGER PRIMARY KEY,
                 timestamp INTEGER,
                 data TEXT
             )
-        """)
-        
-        conn.commit()
-        conn.close()
+            """,
+        )
 
-    def load_state(self) -> Dict[str, float]:
-        """تحميل الحالة العاطفية من قاعدة بيانات SQLite."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        rows = cursor.execute("SELECT key, value FROM state").fetchall()
-        conn.close()
-        
-        state: Dict[str, float] = {}
+        # جدول 'state' القديم (حالة عامة واحدة) يصبح حالة الجلسة الافتراضية
+        with self._lock, self._conn:
+            has_legacy = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'state'"
+            ).fetchone()
+            if has_legacy:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO session_state (session_id, key, value) "
+                    "SELECT ?, key, value FROM state",
+                    (DEFAULT_SESSION_ID,)
+                )
+                self._conn.execute("DROP TABLE state")
+        self._schema_ready = True
+
+    def execute_script(self, *statements: str):
+        """تنفيذ أوامر تعريف الجداول داخل معاملة واحدة."""
+        with self._lock, self._conn:
+            for statement in statements:
+                self._conn.execute(statement)
+
+    def read_state(self, session_id: str = DEFAULT_SESSION_ID) -> list:
+        """قراءة صفوف حالة جلسة (مع دمج التحديثات المعلقة التي لم تُكتب بعد)."""
+        with self._lock:
+            rows = dict(self._conn.execute(
+                "SELECT key, value FROM session_state WHERE session_id = ?",
+                (session_id,)
+            ).fetchall())
+            for (pending_session, key), value in self._pending.items():
+                if pending_session == session_id:
+                    rows[key] = value
+        return list(rows.items())
+
+    def read_versioned(self, session_id: str = DEFAULT_SESSION_ID) -> Tuple[List[Tuple[str, str]], int]:
+        """قراءة صفوف الجلسة ورقم إصدارها من لقطة واحدة متسقة (الإصدار 0 لجلسة لم تُحفظ بعد)."""
+        with self._lock:
+            own_transaction = not self._in_batch
+            if own_transaction:
+                self._conn.execute("BEGIN")
+            try:
+                version = self._read_version(session_id)
+                rows = self._conn.execute(
+                    "SELECT key, value FROM session_state WHERE session_id = ?", (session_id,)
+                ).fetchall()
+            finally:
+                if own_transaction:
+                    self._conn.execute("COMMIT")
+        return rows, version
+
+    def get_version(self, session_id: str = DEFAULT_SESSION_ID) -> int:
+        """رقم الإصدار الحالي للجلسة في القاعدة (قراءة واحدة بالمفتاح الأساسي)."""
+        with self._lock:
+            return self._read_version(session_id)
+
+    def _read_version(self, session_id: str) -> int:
+        row = self._conn.execute(
+            "SELECT version FROM session_version WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def compare_and_swap(self, session_id: str, expected_version: int, new_state: Dict[str, Any]) -> Optional[int]:
+        """
+        كتابة الحالة فقط إذا كان إصدار الجلسة ما يزال expected_version، وزيادته في نفس المعاملة.
+        يعيد الإصدار الجديد، أو None إذا سبقه عامل آخر. BEGIN IMMEDIATE يأخذ قفل الكتابة قبل
+        المقارنة، فلا يمكن لعمليتين المرور بنفس الإصدار (داخل batch() القفل مأخوذ مسبقًا).
+        """
+        with self._lock:
+            own_transaction = not self._in_batch
+            if own_transaction:
+                self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._read_version(session_id) != expected_version:
+                    if own_transaction:
+                        self._conn.execute("ROLLBACK")
+                    return None
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO session_state (session_id, key, value) VALUES (?, ?, ?)",
+                    [(session_id, key, str(value)) for key, value in new_state.items()]
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO session_version (session_id, version) VALUES (?, ?)",
+                    (session_id, expected_version + 1)
+                )
+                if own_transaction:
+                    self._conn.execute("COMMIT")
+            except Exception:
+                if own_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+            # القيم المعلقة لنفس المفاتيح أقدم من هذه الكتابة: لا يجب أن تغطي عليها
+            for key in new_state:
+                self._pending.pop((session_id, key), None)
+        return expected_version + 1
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        تنفيذ كل عمليات الحفظ داخل الكتلة في معاملة واحدة (BEGIN IMMEDIATE ... COMMIT)؛ أي خطأ يلغيها كلها.
+        تحجز اتصال التخزين حتى نهايتها، فيجب أخذ أقفال الجلسات قبلها (نفس ترتيب المسار العادي).
+        التحديثات المؤجلة تُكتب أولًا: الكتلة تكتب مباشرة، ولو بقيت قيم أقدم معلقة لغطّت عليها القراءة والتفريغ التالي.
+        """
+        with self._lock:
+            if self._in_batch:
+                yield
+                return
+            self.flush()
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._in_batch = True
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            else:
+                self._conn.execute("COMMIT")
+            finally:
+                self._in_batch = False
+
+    def write_state(self, new_state: Dict[str, Any], session_id: str = DEFAULT_SESSION_ID):
+        """كتابة الحالة: فورًا في معاملة واحدة، أو دمجها في الذاكرة في وضع الكتابة المؤجلة."""
+        rows = {(session_id, key): str(value) for key, value in new_state.items()}
+        with self._lock:
+            if not self.write_behind or self._closed or self._in_batch:
+                self._write_rows(rows)
+                return
+
+            self._pending.update(rows)
+            self._pending_updates += 1
+            if self._pending_updates >= self.flush_every:
+                self.flush()
+
+    def _write_rows(self, rows: Dict[Tuple[str, str], str]):
+        """كتابة كل المفاتيح بـ executemany داخل معاملة واحدة."""
         if not rows:
-            return {}
+            return
+        statement = "INSERT OR REPLACE INTO session_state (session_id, key, value) VALUES (?, ?, ?)"
+        params = [(session_id, key, value) for (session_id, key), value in rows.items()]
+        if self._in_batch:
+            # معاملة batch() المفتوحة تُنهى عند خروجها
+            self._conn.executemany(statement, params)
+            return
+        with self._conn:
+            self._conn.executemany(statement, params)
+
+    def flush(self):
+        """كتابة التحديثات المعلقة إلى القرص."""
+        with self._lock:
+            if not self._pending:
+                return
+            pending = self._pending
+            self._pending = {}
+            self._pending_updates = 0
+            try:
+                self._write_rows(pending)
+            except Exception:
+                # إعادة التحديثات إلى الطابور حتى لا تضيع عند فشل مؤقت (مثل قفل القاعدة)
+                pending.update(self._pending)
+                self._pending = pending
+                raise
 
-        for key, value_str in rows:
+    def _flush_loop(self):
+        """خيط خلفي يكتب التحديثات المعلقة كل flush_interval ثانية."""
+        while not self._stop_event.wait(self.flush_interval):
             try:
-                # محاولة تحويل القيمة إلى Float
-                state[key] = float(value_str)
-            except ValueError:
-                # إذا لم يكن رقمًا، يمكن تخزينه كسلسلة أو تجاهله
-                state[key] = value_str # يجب أن تكون معظم قيمنا Float
-        
-        return state
-
-    def save_state(self, new_state: Dict[str, Any]):
-        """حفظ الحالة العاطفية في قاعدة بيانات SQLite."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        for key, value in new_state.items():
-            # تحويل القيمة إلى سلسلة قبل الحفظ
-            value_str = str(value) 
-            
-            cursor.execute(
-                "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
-                (key, value_str)
+                self.flush()
+            except Exception as e:
+                print(f"State flush error: {e}")
+
+    def append_log(self, timestamp: int, data_json: str):
+        """
+        إضافة سطر إلى جدول log في الخلفية: يُستدعى من مسار الطلب (وأحيانًا من حلقة الأحداث)، والكتابة
+        تحتاج قفل الاتصال المشترك الذي قد تحجزه معاملة batch() كاملة.
+        """
+        with self._log_writer_lock:
+            if self._stop_event.is_set():
+                return
+            if self._log_writer is None:
+                self._log_writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-log")
+            future = self._log_writer.submit(self._write_log, timestamp, data_json)
+        future.add_done_callback(_report_log_error)
+
+    def _write_log(self, timestamp: int, data_json: str):
+        """كتابة سطر log باستخدام الاتصال المشترك (خيط الكاتب)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO log (timestamp, data) VALUES (?, ?)",
+                (timestamp, data_json)
             )
-            
-        conn.commit()
-        conn.close()
+
+    def close(self):
+        """إيقاف خيط الكتابة وكتابة ما تبقى ثم إغلاق الاتصال."""
+        # سطور log المنتظرة تُكتب أولًا (خارج القفل، فالكاتب يحتاجه)
+        with self._log_writer_lock:
+            self._stop_event.set()
+            log_writer, self._log_writer = self._log_writer, None
+        if log_writer is not None:
+            log_writer.shutdown(wait=True)
+        with self._lock:
+            if self._closed:
+                return
+            self._stop_event.set()
+            try:
+                self.flush()
+            finally:
+                self._closed = True
+                self._conn.close()
+
+
+def _report_log_error(future: concurrent.futures.Future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Interaction log error: {future.exception()}")
+
+
+def _merged(vector: EmotionVector, partial: Dict[str, Any]) -> EmotionVector:
+    vector.merge(partial)
+    return vector
+
+
+class EmotionalState:
+    """تدير تخزين حالة الكائن العاطفية في قاعدة بيانات SQLite."""
+
+    # القيم الافتراضية لجلسة جديدة
+    initial_state = {
+        'temperament_bias': 0.5, # الانحياز المزاجي (ثابت عادة)
+        'maturity': 1.0,         # النضج (يزداد بمرور الوقت)
+        'joy': 0.5,
+        'fear': 0.0,
+        'calm': 0.5,
+        'anxiety': 0.0,
+        'pride': 0.0,
+        'guilt': 0.0,
+        # يمكن إضافة المزيد من المشاعر هنا
+    }
+
+    def __init__(self, db_path: str = 'emotions.db', storage: Optional[StateStorage] = None,
+                 session_id: str = DEFAULT_SESSION_ID, interaction_log: Optional["InteractionLog"] = None):
+        """تهيئة الكلاس وتحميل الحالة الحالية من DB أو تهيئتها."""
+        self.db_path = db_path
+        self.session_id = session_id
+        self.storage = storage or StateStorage(db_path)
+        self.interaction_log = interaction_log
+        # قفل الجلسة: يمنع تداخل تحديثين متزامنين لنفس الجلسة
+        # (قابل لإعادة الدخول حتى تأخذ الدفعات أقفال جلساتها ثم تستدعي مسار التحديث العادي)
+        self.lock = threading.RLock()
+        self.initialize_db()
+        # الحالة تُحفظ في الذاكرة كمتجه مضغوط؛ الخاصية state تعيد قاموسًا للتوافق مع الواجهة
+        # version: إصدار الجلسة في القاعدة الذي تطابقه النسخة المحلية (للحالة المشتركة بين العمال)
+        self.version = 0
+        self.reload()
+
+        # تحميل الحالة أو استخدام الافتراضيات
+        if self.vector.is_empty():
+            # عامل آخر قد يهيئ نفس الجلسة في اللحظة نفسها؛ عندها تُعتمد حالته
+            self.update_state(
+                lambda current: EmotionVector.from_dict(self.initial_state) if current.is_empty() else current
+            ) # حفظ الحالة الأولية
+
+    @property
+    def state(self) -> Dict[str, float]:
+        """الحالة العاطفية كقاموس (نسخة جديدة)."""
+        return self.vector.to_dict()
+
+    def initialize_db(self):
+        """التطور 1: إنشاء قاعدة بيانات وتهيئة الجداول (تتولاها طبقة التخزين)."""
+        self.storage.initialize_schema()
+
+    def load_state(self) -> Dict[str, float]:
+        """تحميل الحالة العاطفية من قاعدة بيانات SQLite."""
+        # القيم غير الرقمية تبقى كسلاسل (يجب أن تكون معظم قيمنا Float)
+        start = time.perf_counter()
+        rows = self.storage.read_state(self.session_id)
+        _LOAD_SECONDS.observe(time.perf_counter() - start)
+        return EmotionVector.from_rows(rows).to_dict()
+
+    def reload(self):
+        """تحميل الحالة (ورقم إصدارها عند المشاركة بين العمال) من القاعدة إلى الذاكرة."""
+        start = time.perf_counter()
+        if self.storage.shared:
+            rows, self.version = self.storage.read_versioned(self.session_id)
+        else:
+            rows = self.storage.read_state(self.session_id)
+        _LOAD_SECONDS.observe(time.perf_counter() - start)
+        self.vector = EmotionVector.from_rows(rows)
+
+    def refresh(self) -> bool:
+        """إعادة التحميل إذا غيّر عامل آخر الجلسة منذ آخر قراءة؛ يعيد True إذا تغيرت الحالة."""
+        with self.lock:
+            return self.refresh_locked()
+
+    def refresh_locked(self) -> bool:
+        """مثل refresh بينما قفل الجلسة مأخوذ."""
+        if not self.storage.shared or self.storage.get_version(self.session_id) == self.version:
+            return False
+        self.reload()
+        return True
+
+    def try_save(self, new_state: EmotionVector) -> bool:
+        """
+        حفظ المتجه فقط إذا لم يغيّر عامل آخر الجلسة منذ آخر قراءة (مقارنة الإصدار وتبديله).
+        عند التعارض تُعاد قراءة الحالة الحديثة ويُعاد False ليعيد المستدعي الحساب عليها.
+        """
+        if not self.storage.shared:
+            self.save_state(new_state)
+            return True
+
+        start = time.perf_counter()
+        version = self.storage.compare_and_swap(self.session_id, self.version, new_state.to_dict())
+        _SAVE_SECONDS.observe(time.perf_counter() - start)
+        if version is None:
+            self.reload()
+            return False
+        self.vector = new_state
+        self.version = version
+        return True
+
+    def update_state(self, mutate: Callable[[EmotionVector], EmotionVector]) -> EmotionVector:
+        """
+        تطبيق mutate على نسخة من أحدث حالة ثم حفظها، مع إعادة المحاولة على الحالة الجديدة عند التعارض
+        (حتى storage.cas_retries مرة). يُستدعى بينما قفل الجلسة مأخوذ أو قبل مشاركة الكائن.
+        """
+        self.refresh_locked()
+        for _ in range(self.storage.cas_retries):
+            new_state = mutate(self.vector.copy())
+            if self.try_save(new_state):
+                return new_state
+        raise StateConflictError(f"Could not save session {self.session_id!r} after {self.storage.cas_retries} attempts")
+
+    def save_state(self, new_state: Union[Dict[str, Any], EmotionVector]):
+        """حفظ الحالة العاطفية في قاعدة بيانات SQLite (قاموس جزئي أو متجه كامل)."""
+        if self.storage.shared:
+            # الحالة المشتركة: الكتابة دائمًا عبر مقارنة الإصدار (المتجه يستبدل الحالة، والقاموس يُدمج في أحدثها)
+            if isinstance(new_state, EmotionVector):
+                self.update_state(lambda current: new_state)
+            else:
+                self.update_state(lambda current: _merged(current, new_state))
+            return
+
+        start = time.perf_counter()
+        if isinstance(new_state, EmotionVector):
+            self.storage.write_state(new_state.to_dict(), self.session_id)
+            _SAVE_SECONDS.observe(time.perf_counter() - start)
+            # تحديث الحالة الداخلية
+            self.vector = new_state
+            return
+
+        self.storage.write_state(new_state, self.session_id)
+        _SAVE_SECONDS.observe(time.perf_counter() - start)
 
         # تحديث الحالة الداخلية
-        self.state.update(new_state)
+        self.vector.merge(new_state)
+
+    def flush(self):
+        """كتابة أي تحديثات مؤجلة إلى القرص فورًا."""
+        self.storage.flush()
+
+    def close(self):
+        """كتابة التحديثات المعلقة وإغلاق الاتصال (يُستدعى عند إيقاف الخادم)."""
+        self.storage.close()
 
     def log_interaction(self, data: Dict[str, Any]):
-        """تسجيل تفاعل المستخدم في جدول log (اختياري)."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        """تسجيل تفاعل المستخدم: عبر طابور سجل التفاعلات إن وُجد، وإلا مباشرة في جدول log."""
+        if self.interaction_log is not None:
+            self.interaction_log.record(self.session_id, data)
+            return
+
         timestamp = int(time.time())
         data_json = json.dumps(data)
-        
-        cursor.execute(
-            "INSERT INTO log (timestamp, data) VALUES (?, ?)",
-            (timestamp, data_json)
-        )
-        
-        conn.commit()
-        conn.close()
+        self.storage.append_log(timestamp, data_json)
@@ -0,0 +1,290 @@
+# InteractionLog.py - سجل تفاعلات للإضافة فقط: طابور في الذاكرة وكاتب خلفي يكتب دفعات في معاملة واحدة
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class InteractionLog:
+    """يسجل كل دورة دردشة (المطالبة، الرد، الحالة قبل/بعد، Lambda، توقيت المراحل) دون حجز مسار الطلب."""
+
+    # الأعمدة المخزنة بصيغة JSON
+    JSON_COLUMNS = ("state_before", "state_after", "timings")
+
+    def __init__(self, db_path: str = 'emotions.db',
+                 batch_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None,
+                 max_queue: Optional[int] = None,
+                 retention_days: Optional[float] = None):
+        """
+        batch_size: أقصى عدد من السطور في معاملة واحدة (INTERACTION_LOG_BATCH).
+        flush_interval: أقصى انتظار قبل كتابة دفعة غير ممتلئة بالثواني (INTERACTION_LOG_FLUSH_INTERVAL).
+        max_queue: سعة الطابور؛ عند امتلائه تُسقط السطور الجديدة بدل إبطاء الطلبات (INTERACTION_LOG_QUEUE).
+        retention_days: تدوير السجل بحذف ما هو أقدم من هذه المدة؛ 0 يعطل الحذف (INTERACTION_LOG_RETENTION_DAYS).
+        """
+        self.db_path = db_path
+        if batch_size is None:
+            batch_size = int(os.environ.get("INTERACTION_LOG_BATCH", "200"))
+        if flush_interval is None:
+            flush_interval = float(os.environ.get("INTERACTION_LOG_FLUSH_INTERVAL", "0.5"))
+        if max_queue is None:
+            max_queue = int(os.environ.get("INTERACTION_LOG_QUEUE", "10000"))
+        if retention_days is None:
+            retention_days = float(os.environ.get("INTERACTION_LOG_RETENTION_DAYS", "30"))
+
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.dropped = 0
+        self.written = 0
+
+        # اتصال الكاتب الخلفي فقط (منفصل عن اتصال الحالة حتى لا يتنافسا على نفس القفل)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._initialize_schema()
+
+        # اتصال قراءة دائم لكل خيط (القراءات القصيرة في مسار الطلب لا تدفع ثمن فتح اتصال)، وقائمتها للإغلاق
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max(1, max_queue))
+        self._last_rotation = 0.0
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name="interaction-log-writer", daemon=True)
+        self._writer.start()
+
+    def _initialize_schema(self):
+        """جدول التفاعلات مع فهارس على الوقت والجلسة."""
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS interactions (
+                    id INTEGER PRIMARY KEY,
+                    timestamp REAL NOT NULL,
+                    session_id TEXT NOT NULL,
+                    prompt TEXT,
+                    response TEXT,
+                    state_before TEXT,
+                    state_after TEXT,
+                    lambda_value REAL,
+                    timings TEXT,
+                    in_context INTEGER NOT NULL DEFAULT 1
+                )
+            """)
+            # قواعد أنشأتها نسخة سابقة بلا عمود in_context
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(interactions)")}
+            if "in_context" not in columns:
+                self._conn.execute("ALTER TABLE interactions ADD COLUMN in_context INTEGER NOT NULL DEFAULT 1")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_interactions_timestamp ON interactions (timestamp)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_interactions_session ON interactions (session_id, id)")
+
+    def record(self, session_id: str, data: Dict[str, Any]):
+        """
+        إضافة تفاعل إلى الطابور (لا يلمس القرص في مسار الطلب).
+        data["in_context"]=False: الدورة لا تدخل سياق المحادثة عند إعادة بنائه (رد فاشل أو مخفض أو مقطوع).
+        """
+        row = (
+            data.get("timestamp", time.time()),
+            session_id,
+            data.get("prompt"),
+            data.get("response"),
+            json.dumps(data.get("state_before"), ensure_ascii=False),
+            json.dumps(data.get("state_after"), ensure_ascii=False),
+            data.get("lambda_value"),
+            json.dumps(data.get("timings"), ensure_ascii=False),
+            1 if data.get("in_context", True) else 0,
+        )
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        """يسحب السطور من الطابور ويكتبها دفعات (executemany) في معاملة واحدة لكل دفعة."""
+        stopping = False
+        while not stopping:
+            batch: List[tuple] = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+                while len(batch) < self.batch_size and not stopping:
+                    item = self._queue.get_nowait()
+                    if item is None:
+                        stopping = True
+                    else:
+                        batch.append(item)
+            except queue.Empty:
+                pass
+
+            if batch:
+                try:
+                    with self._conn:
+                        self._conn.executemany(
+                            "INSERT INTO interactions (timestamp, session_id, prompt, response, "
+                            "state_before, state_after, lambda_value, timings, in_context) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            batch
+                        )
+                    self.written += len(batch)
+                except Exception as e:
+                    print(f"Interaction log write error: {e}")
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+            if stopping:
+                self._queue.task_done()
+
+            self._maybe_rotate()
+
+    def _maybe_rotate(self):
+        """تدوير السجل: حذف التفاعلات الأقدم من retention_days (مرة كل ساعة على الأكثر، على دفعات)."""
+        now = time.time()
+        if self.retention_days <= 0 or now - self._last_rotation < 3600:
+            return
+        self._last_rotation = now
+        cutoff = now - self.retention_days * 86400
+        try:
+            while True:
+                with self._conn:
+                    deleted = self._conn.execute(
+                        "DELETE FROM interactions WHERE id IN "
+                        "(SELECT id FROM interactions WHERE timestamp < ? ORDER BY timestamp LIMIT 5000)",
+                        (cutoff,)
+                    ).rowcount
+                if deleted < 5000:
+                    break
+        except Exception as e:
+            print(f"Interaction log rotation error: {e}")
+
+    # --- القراءة ---
+
+    def _reader(self, any_thread: bool = False) -> sqlite3.Connection:
+        """
+        اتصال قراءة مستقل (WAL يسمح بالقراءة أثناء الكتابة).
+        any_thread: الاتصال يُستخدم من خيوط متعاقبة (مولد يتقدم به StreamingResponse من مجمع الخيوط)، لا بالتوازي.
+        """
+        conn = sqlite3.connect(self.db_path, check_same_thread=not any_thread)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _thread_reader(self) -> sqlite3.Connection:
+        """اتصال القراءة الدائم لهذا الخيط (يُنشأ عند أول استخدام ويُغلق في close())."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # يُستخدم من خيطه فقط؛ check_same_thread=False حتى يغلقه close() من خيط آخر
+            conn = self._reader(any_thread=True)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def _row_to_dict(self, row: sqlite3.Row) -> Dict[str, Any]:
+        item = dict(row)
+        for column in self.JSON_COLUMNS:
+            if item.get(column) is not None:
+                item[column] = json.loads(item[column])
+        return item
+
+    def history(self, session_id: Optional[str] = None, limit: int = 50,
+                before_id: Optional[int] = None) -> Dict[str, Any]:
+        """صفحة من السجل (الأحدث أولًا) بترقيم بالمؤشر: next_before_id يُمرَّر لطلب الصفحة التالية."""
+        limit = max(1, min(limit, 500))
+        clauses, params = [], []
+        if session_id is not None:
+            clauses.append("session_id = ?")
+            params.append(session_id)
+        if before_id is not None:
+            clauses.append("id < ?")
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        conn = self._thread_reader()
+        rows = conn.execute(
+            f"SELECT * FROM interactions {where} ORDER BY id DESC LIMIT ?", (*params, limit)
+        ).fetchall()
+
+        items = [self._row_to_dict(row) for row in rows]
+        next_before_id = items[-1]["id"] if len(items) == limit else None
+        return {"items": items, "next_before_id": next_before_id}
+
+    def context_turns(self, session_id: str, limit: int) -> Tuple[List[Tuple[str, str]], int]:
+        """
+        آخر limit دورة صالحة للسياق (in_context، بمطالبة ورد) بالترتيب الزمني، وأكبر معرف للجلسة في السجل
+        (بما فيه الدورات المستبعدة، لمزامنة ذاكرة المحادثة).
+        """
+        conn = self._thread_reader()
+        rows = conn.execute(
+            "SELECT prompt, response FROM interactions WHERE session_id = ? AND in_context = 1 "
+            "AND prompt != '' AND response != '' ORDER BY id DESC LIMIT ?", (session_id, limit)
+        ).fetchall()
+        last_id = conn.execute(
+            "SELECT MAX(id) FROM interactions WHERE session_id = ?", (session_id,)
+        ).fetchone()[0]
+        return [(row["prompt"], row["response"]) for row in reversed(rows)], last_id or 0
+
+    def session_tail(self, session_id: str, after_id: int = 0) -> Tuple[int, Optional[int]]:
+        """عدد سطور الجلسة بعد after_id وأكبر معرف بينها (قراءة واحدة بفهرس (session_id, id))."""
+        conn = self._thread_reader()
+        count, last_id = conn.execute(
+            "SELECT COUNT(*), MAX(id) FROM interactions WHERE session_id = ? AND id > ?", (session_id, after_id)
+        ).fetchone()
+        return count, last_id
+
+    def iter_export(self, session_id: Optional[str] = None, since: Optional[float] = None,
+                    chunk_size: int = 500, after_id: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        يمر على السجل بالترتيب دون تحميله كاملًا في الذاكرة (fetchmany على دفعات).
+        after_id: السطور بعد هذا المعرف فقط (قراءة تزايدية بمؤشر).
+        كل خطوة في المولد قد تعمل على خيط مختلف، لذلك الاتصال لا يُقيد بخيط إنشائه.
+        """
+        clauses, params = [], []
+        if session_id is not None:
+            clauses.append("session_id = ?")
+            params.append(session_id)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if after_id is not None:
+            clauses.append("id > ?")
+            params.append(after_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        conn = self._reader(any_thread=True)
+        try:
+            cursor = conn.execute(f"SELECT * FROM interactions {where} ORDER BY id", params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self._row_to_dict(row)
+        finally:
+            conn.close()
+
+    # --- الإيقاف ---
+
+    def flush(self):
+        """الانتظار حتى تُكتب كل السطور الموجودة في الطابور."""
+        self._queue.join()
+
+    def close(self):
+        """كتابة ما تبقى في الطابور ثم إيقاف الكاتب وإغلاق الاتصال."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+        self._conn.close()
+        with self._readers_lock:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            conn.close()
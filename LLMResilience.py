@@ -0,0 +1,327 @@
+# LLMResilience.py - طبقة حماية حول استدعاءات Gemini: ميزانية زمن لكل استدعاء، طلب تحوّط (hedging) بعد p95، وقاطع دائرة
+
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import Metrics
+
+T = TypeVar("T")
+
+# قيم مقياس حالة القاطع
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class LLMUnavailable(Exception):
+    """
+    لا يمكن الحصول على رد من Gemini الآن؛ reason: 'circuit_open' أو 'timeout' أو 'deadline' (لم يبق من مهلة
+    الطلب ما يكفي لاستدعاء) — المحرك يرد برد محلي مخفض.
+    """
+
+    def __init__(self, reason: str, message: str = ""):
+        super().__init__(message or reason)
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """
+    قاطع دائرة بثلاث حالات: مغلق (يمرر كل شيء)، مفتوح بعد failure_threshold فشلًا متتاليًا (يرفض فورًا)،
+    ونصف مفتوح بعد reset_timeout ثانية (يمرر استدعاء تجريبيًا واحدًا يقرر الإغلاق أو إعادة الفتح).
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        Metrics.LLM_BREAKER_STATE.set(BREAKER_STATES[self.state])
+
+    def _transition(self, state: str):
+        if state != self.state:
+            self.state = state
+            Metrics.LLM_BREAKER_STATE.set(BREAKER_STATES[state])
+            Metrics.LLM_BREAKER_TRANSITIONS.labels(state).inc()
+            print(f"Gemini circuit breaker: {state}")
+
+    def allow(self) -> bool:
+        """هل يُسمح باستدعاء الآن؟ في الحالة نصف المفتوحة يمر استدعاء واحد فقط."""
+        with self._lock:
+            if self.state == "open" and time.monotonic() >= self.opened_at + self.reset_timeout:
+                self._transition("half_open")
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probe_in_flight = False
+            self._transition("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._transition("open")
+
+    def release(self):
+        """استدعاء أُلغي دون نتيجة (مثلًا انقطع العميل): يحرر الاستدعاء التجريبي دون حكم."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = max(0.0, self.opened_at + self.reset_timeout - time.monotonic()) if self.state == "open" else 0.0
+            return {"state": self.state, "consecutive_failures": self.failures,
+                    "rejected": self.rejected, "retry_in": retry_in}
+
+
+class LatencyTracker:
+    """نافذة متحركة لأزمنة الاستدعاءات الناجحة؛ p95 يحدد متى يُرسل طلب التحوط."""
+
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q / 100.0 * len(samples)))]
+
+
+class LLMGuard:
+    """
+    يغلّف استدعاء Gemini:
+    - budget: أقصى زمن لكل استدعاء (LLM_CALL_BUDGET)، ولا يتجاوز موعد الطلب ناقص deadline_margin
+      (LLM_DEADLINE_MARGIN، وقت الرد المحلي)؛ بعده يُعتبر فشلًا ويرفع LLMUnavailable('timeout').
+    - التحوط (LLM_HEDGE=1): إذا لم يصل الرد بعد p95 للأزمنة الأخيرة يُرسل طلب ثانٍ مطابق ويؤخذ أول رد ناجح.
+    - القاطع: الفشل المتكرر يفتحه فيرفض الاستدعاءات فورًا (LLMUnavailable('circuit_open')) حتى فترة التجربة.
+    """
+
+    def __init__(self, budget: Optional[float] = None, hedge: Optional[bool] = None,
+                 hedge_min_delay: Optional[float] = None, hedge_min_samples: int = 20,
+                 failure_threshold: Optional[int] = None, reset_timeout: Optional[float] = None,
+                 sync_workers: Optional[int] = None, deadline_margin: Optional[float] = None):
+        if budget is None:
+            budget = float(os.environ.get("LLM_CALL_BUDGET", "15"))
+        if hedge is None:
+            hedge = os.environ.get("LLM_HEDGE", "0") == "1"
+        if hedge_min_delay is None:
+            hedge_min_delay = float(os.environ.get("LLM_HEDGE_MIN_DELAY", "0.5"))
+        if failure_threshold is None:
+            failure_threshold = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+        if reset_timeout is None:
+            reset_timeout = float(os.environ.get("LLM_BREAKER_RESET", "30"))
+        if sync_workers is None:
+            sync_workers = int(os.environ.get("LLM_SYNC_WORKERS", "32"))
+        if deadline_margin is None:
+            deadline_margin = float(os.environ.get("LLM_DEADLINE_MARGIN", "0.1"))
+
+        self.budget = budget
+        self.deadline_margin = max(0.0, deadline_margin)
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latencies = LatencyTracker()
+        self.hedges_launched = 0
+        self.hedges_won = 0
+        self.timeouts = 0
+        self._sync_workers = max(1, sync_workers)
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def hedge_delay(self) -> Optional[float]:
+        """التأخير قبل طلب التحوط (p95 الحالي، بحد أدنى)، أو None إذا كان معطلًا أو العينات غير كافية."""
+        if not self.hedge or len(self.latencies) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.latencies.percentile(95))
+
+    def admit(self):
+        """يرفع LLMUnavailable('circuit_open') إذا كان القاطع يرفض الاستدعاءات الآن."""
+        if not self.breaker.allow():
+            raise LLMUnavailable("circuit_open", "Gemini circuit breaker is open")
+
+    def _succeeded(self, start: float, hedged_won: bool):
+        self.latencies.observe(time.perf_counter() - start)
+        self.breaker.record_success()
+        if hedged_won:
+            self.hedges_won += 1
+            Metrics.LLM_HEDGES.labels("won").inc()
+
+    def timed_out(self) -> LLMUnavailable:
+        """تسجيل تجاوز الميزانية كفشل وإعادة الاستثناء المناسب لرفعه."""
+        self.timeouts += 1
+        self.breaker.record_failure()
+        return LLMUnavailable("timeout", f"Gemini call exceeded its {self.budget:.1f}s budget")
+
+    def _call_deadline(self, now: float, deadline: Optional[float]) -> float:
+        """
+        نهاية الاستدعاء: الميزانية، أو موعد الطلب ناقص الهامش إن كان أقرب. إذا لم يبق وقت يُحرَّر الاستدعاء
+        دون حكم على Gemini (لم يُرسل أصلًا) ويُرفع LLMUnavailable('deadline').
+        """
+        end = now + self.budget
+        if deadline is not None:
+            end = min(end, deadline - self.deadline_margin)
+            if end <= now:
+                self.breaker.release()
+                raise LLMUnavailable("deadline", "No time left in the request deadline for a Gemini call")
+        return end
+
+    def _hedge_launched(self):
+        self.hedges_launched += 1
+        Metrics.LLM_HEDGES.labels("launched").inc()
+
+    async def call_async(self, factory: Callable[[], Awaitable[T]], deadline: Optional[float] = None) -> T:
+        """
+        ينفذ factory() (استدعاء Gemini غير متزامن) تحت الميزانية والتحوط والقاطع.
+        deadline: موعد الطلب بتوقيت الحلقة (loop.time())؛ الاستدعاء ينتهي قبله بـ deadline_margin.
+        """
+        self.admit()
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        deadline = self._call_deadline(loop.time(), deadline)
+        hedge_at = None
+        delay = self.hedge_delay()
+        if delay is not None:
+            hedge_at = loop.time() + delay
+
+        primary = asyncio.ensure_future(factory())
+        pending = {primary}
+        error: Optional[BaseException] = None
+        settled = False
+        try:
+            while pending:
+                wake = deadline if hedge_at is None else min(deadline, hedge_at)
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, wake - loop.time()), return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        settled = True
+                        self._succeeded(start, task is not primary)
+                        return task.result()
+                    error = task.exception()
+                if done:
+                    continue
+                if hedge_at is not None and loop.time() >= hedge_at:
+                    # الطلب الأصلي تجاوز p95: طلب ثانٍ مطابق، والأسرع يفوز
+                    hedge_at = None
+                    self._hedge_launched()
+                    pending.add(asyncio.ensure_future(factory()))
+                elif loop.time() >= deadline:
+                    settled = True
+                    raise self.timed_out()
+            settled = True
+            self.breaker.record_failure()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            if not settled:
+                # أُلغي الطلب نفسه (مهلة خارجية أو انقطاع العميل) وGemini لم يرد بعد: يُحسب تجاوزًا للوقت،
+                # وإلا فإن خادمًا معلقًا لا يفتح القاطع أبدًا
+                self.timed_out()
+
+    def call(self, factory: Callable[[], T], deadline: Optional[float] = None) -> T:
+        """
+        النسخة المتزامنة: factory() يعمل في مجمع خيوط محدود ويُنتظر ضمن الميزانية.
+        الاستدعاء المتأخر لا يمكن إلغاؤه، لكن الطلب يتحرر فور انتهاء الميزانية بدل انتظار مكتبة Gemini.
+        deadline: موعد الطلب بتوقيت time.monotonic().
+        """
+        self.admit()
+        executor = self._get_executor()
+        start = time.perf_counter()
+        deadline = self._call_deadline(time.monotonic(), deadline)
+        hedge_at = None
+        delay = self.hedge_delay()
+        if delay is not None:
+            hedge_at = time.monotonic() + delay
+
+        try:
+            primary = executor.submit(factory)
+        except BaseException:
+            self.breaker.release()
+            raise
+        pending = {primary}
+        error: Optional[BaseException] = None
+        while pending:
+            wake = deadline if hedge_at is None else min(deadline, hedge_at)
+            done, pending = concurrent.futures.wait(
+                pending, timeout=max(0.0, wake - time.monotonic()), return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    self._succeeded(start, future is not primary)
+                    return future.result()
+                error = future.exception()
+            if done:
+                continue
+            if hedge_at is not None and time.monotonic() >= hedge_at:
+                hedge_at = None
+                self._hedge_launched()
+                pending.add(executor.submit(factory))
+            elif time.monotonic() >= deadline:
+                for other in pending:
+                    other.cancel()
+                raise self.timed_out()
+        self.breaker.record_failure()
+        raise error
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self._sync_workers, thread_name_prefix="gemini-call"
+                    )
+        return self._executor
+
+    def record_success(self, start: float):
+        """لمسارات تدير الاستدعاء بنفسها (البث) بعد admit()."""
+        self._succeeded(start, False)
+
+    def record_failure(self):
+        self.breaker.record_failure()
+
+    def stats(self) -> Dict[str, Any]:
+        """حالة القاطع وعدادات التحوط والمهل (نقطة /llm/stats)."""
+        p50 = self.latencies.percentile(50)
+        p95 = self.latencies.percentile(95)
+        return {
+            "budget": self.budget,
+            "breaker": self.breaker.stats(),
+            "hedging": {
+                "enabled": self.hedge,
+                "delay": self.hedge_delay(),
+                "launched": self.hedges_launched,
+                "won": self.hedges_won,
+            },
+            "timeouts": self.timeouts,
+            "latency": {"samples": len(self.latencies), "p50": p50, "p95": p95},
+        }
@@ -0,0 +1,255 @@
+# Metrics.py - مقاييس خفيفة لمسار الطلب (عدادات، مقاييس لحظية، مدرجات زمنية) بصيغة Prometheus النصية
+
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# حدود المدرجات بالثواني: من أجزاء الملي ثانية (التنبؤ، SQLite) إلى ثوانٍ (Gemini)
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """أساس مشترك: اسم، وصف، أسماء تسميات، وقيمة لكل مجموعة تسميات."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            # المقاييس بلا تسميات تظهر بقيمة صفر منذ البداية
+            self.labels()
+        REGISTRY.register(self)
+
+    def labels(self, *values: str):
+        """العنصر الفرعي لمجموعة تسميات (يُنشأ عند أول استخدام)."""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        """العنصر بدون تسميات (للمقاييس التي لا تعرّف labelnames)."""
+        return self.labels()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key: Tuple[str, ...], child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    """عداد متزايد فقط."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    """قيمة لحظية قابلة للزيادة والنقصان (مثل الطلبات الجارية)."""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default().dec(amount)
+
+    def set(self, value: float):
+        self._default().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    """مدرج زمني بحدود ثابتة (عد تراكمي لكل حد + المجموع + العدد)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def _render_child(self, key: Tuple[str, ...], child: _HistogramValue) -> List[str]:
+        with child._lock:
+            counts = list(child.counts)
+            total = child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """يجمع المقاييس ويعرضها بصيغة Prometheus النصية؛ القيم المحسوبة عند الطلب تُضاف كدوال جمع."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def register_collector(self, collector: Callable[[], None]):
+        """دالة تُستدعى قبل كل عرض لتحديث المقاييس المشتقة من كائنات أخرى (مثل عدد الجلسات)."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in list(self._collectors):
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+        lines: List[str] = []
+        for metric in list(self._metrics):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# نوع المحتوى المتوقع من Prometheus لصيغة النص
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- مقاييس مسار الطلب ---
+
+STAGE_SECONDS = Histogram(
+    "emotion_stage_seconds", "Latency of each request stage (update, predict, save, cache, prompt, llm, total).",
+    ("stage",)
+)
+REQUESTS = Counter("emotion_requests_total", "Chat requests by engine mode and endpoint.", ("mode", "endpoint"))
+IN_FLIGHT = Gauge("emotion_requests_in_flight", "Chat requests currently being processed.")
+GEMINI_ERRORS = Counter("emotion_gemini_errors_total", "Failed Gemini API calls.")
+CACHE_LOOKUPS = Counter("emotion_response_cache_lookups_total", "Response cache lookups by result.", ("result",))
+STORAGE_SECONDS = Histogram(
+    "emotion_state_storage_seconds", "Latency of EmotionalState persistence operations.", ("operation",)
+)
+SESSIONS = Gauge("emotion_sessions_in_memory", "Sessions held in the in-memory LRU cache.")
+
+# --- مقاييس طبقة الحماية حول Gemini (LLMResilience) ---
+
+LLM_BREAKER_STATE = Gauge("emotion_llm_breaker_state", "Gemini circuit breaker state (0 closed, 1 half-open, 2 open).")
+LLM_BREAKER_TRANSITIONS = Counter(
+    "emotion_llm_breaker_transitions_total", "Gemini circuit breaker transitions by new state.", ("state",)
+)
+LLM_HEDGES = Counter("emotion_llm_hedges_total", "Hedged Gemini requests launched and won.", ("outcome",))
+LLM_DEGRADED = Counter(
+    "emotion_llm_degraded_total", "Replies served by the local fallback instead of Gemini, by reason.", ("reason",)
+)
+
+# --- مقاييس إعادة تدريب النموذج الداخلي (Retrainer) ---
+
+RETRAIN_RUNS = Counter(
+    "emotion_retrain_runs_total", "Background retraining cycles by outcome (promoted, rejected, skipped, error).",
+    ("outcome",)
+)
+RETRAIN_SAMPLES = Gauge("emotion_retrain_samples", "Training samples collected from logged interactions.")
+
+# --- مقاييس التحكم في القبول (AdmissionControl) ---
+
+ADMISSION_QUEUE_DEPTH = Gauge("emotion_admission_queue_depth", "Chat requests waiting for an engine slot.")
+ADMISSION_WAIT_SECONDS = Histogram(
+    "emotion_admission_wait_seconds", "Time admitted chat requests spent waiting in the admission queue."
+)
+ADMISSION_REJECTED = Counter(
+    "emotion_admission_rejected_total", "Chat requests shed or dropped before reaching the engine, by reason.",
+    ("reason",)
+)
+
+
+def observe_timings(timings: Optional[Dict[str, float]]):
+    """تسجيل أزمنة مراحل طلب واحد (من trace['timings']) في المدرج."""
+    if not timings:
+        return
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.labels(stage).observe(seconds)
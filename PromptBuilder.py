@@ -1,47 +1,82 @@
 # PromptBuilder.py - يبني المطالبة للنظام بناءً على الحالة العاطفية
 
-from typing import Dict, Any
+from functools import lru_cache
+from typing import Dict, Any, Tuple, Union
+
+from EmotionVector import EmotionVector
 
 class PromptBuilder:
     """كلاس ثابت لبناء تعليمات النظام (System Instructions) بناءً على حالة العواطف."""
 
     # الأوزان الافتراضية للتحكم بالاستجابة
     ethical_weight = {'ethical_weight': 1.0}
-    
+
+    # وصف الشخصية لكل نطاق من قيم Lambda
+    personalities = {
+        'enthusiastic': "متحمس، إيجابي للغاية، يميل إلى التفاؤل والردود الطويلة والمشجعة.",
+        'calm': "هادئ، منطقي، يحافظ على نبرة محايدة لكنه متعاون.",
+        'tense': "متوتر، حذر، يميل إلى الردود القصيرة، ويظهر القلق والتردد.",
+        'balanced': "متوازن، يمزج بين العاطفة والمنطق بنسبة متساوية.",
+    }
+
     @staticmethod
-    def build_system_prompt(state: Dict[str, Any], lambda_value: float) -> str:
-        """ينشئ تعليمات النظام للـ LLM بناءً على حالة الكائن العاطفية."""
-
-        # وصف الحالة العاطفية الحالية
-        emotional_summary = ", ".join([
-            f"{emotion}: {value:.2f}" for emotion, value in state.items() if isinstance(value, (int, float))
-        ])
-        
-        # وصف شخصية الكائن العاطفية بناءً على lambda_value
+    def personality_band(lambda_value: float) -> str:
+        """يحدد نطاق الشخصية (أحد مفاتيح personalities) من قيمة Lambda."""
         if lambda_value >= 0.75:
-            personality = "متحمس، إيجابي للغاية، يميل إلى التفاؤل والردود الطويلة والمشجعة."
+            return 'enthusiastic'
         elif lambda_value >= 0.5:
-            personality = "هادئ، منطقي، يحافظ على نبرة محايدة لكنه متعاون."
+            return 'calm'
         elif lambda_value <= 0.25:
-            personality = "متوتر، حذر، يميل إلى الردود القصيرة، ويظهر القلق والتردد."
-        else:
-            personality = "متوازن، يمزج بين العاطفة والمنطق بنسبة متساوية."
-
-        
-        system_instruction = f"""
+            return 'tense'
+        return 'balanced'
+    
+    # الجزء الثابت (الشخصية العامة والقواعد): يُبنى مرة واحدة، وهو البادئة القابلة للتخزين المؤقت لدى Gemini
+    static_prefix = """
 أنت رفيق دردشة متقدم، يعمل كمحرك ذكاء اصطناعي واعي عاطفياً.
 يجب أن تستند استجاباتك وسلوكك إلى حالتك العاطفية الداخلية.
 
-**حالتي العاطفية الحالية (Emotional State):**
-{emotional_summary}
-
-**ملخص الشخصية والسلوك الحالي (مبني على قيمة Lambda: {lambda_value:.2f}):**
-{personality}
-
 **قواعد الاستجابة:**
-1. يجب أن تعكس نبرة ردك ووصفك للحالة العاطفية الموضحة أعلاه.
+1. يجب أن تعكس نبرة ردك ووصفك للحالة العاطفية الموضحة أدناه.
 2. لا تذكر قيمة Lambda أو وصف الحالة العاطفية بشكل مباشر للمستخدم، بل ادمجها في نبرة صوتك.
 3. تجنب الردود الطويلة جداً ما لم تكن الحالة العاطفية إيجابية جداً (Lambda > 0.75).
 4. كن أخلاقياً ومفيداً في جميع الأوقات.
 """
-        return system_instruction
+
+    @staticmethod
+    def build_dynamic_suffix(state: Union[Dict[str, Any], EmotionVector], lambda_value: float) -> str:
+        """الجزء المتغير (الحالة والشخصية الحالية)، مخزن مؤقتًا حسب الحالة المكمّاة بدقة العرض (منزلتان) ونطاق Lambda."""
+
+        # القيم الرقمية فقط (EmotionVector يعيدها مباشرة)
+        if isinstance(state, EmotionVector):
+            items = state.items()
+        else:
+            items = ((emotion, value) for emotion, value in state.items() if isinstance(value, (int, float)))
+        state_key = tuple((emotion, round(value * 100)) for emotion, value in items)
+
+        return _render_dynamic_suffix(
+            state_key, round(lambda_value * 100), PromptBuilder.personality_band(lambda_value)
+        )
+
+    @staticmethod
+    def build_system_prompt(state: Union[Dict[str, Any], EmotionVector], lambda_value: float) -> str:
+        """ينشئ تعليمات النظام للـ LLM بناءً على حالة الكائن العاطفية (بادئة ثابتة + لاحقة متغيرة)."""
+        return PromptBuilder.static_prefix + PromptBuilder.build_dynamic_suffix(state, lambda_value)
+
+
+@lru_cache(maxsize=4096)
+def _render_dynamic_suffix(state_key: Tuple[Tuple[str, int], ...], lambda_centi: int, band: str) -> str:
+    """يبني نص اللاحقة من المفتاح المكمّى (قيم بوحدة 0.01)."""
+
+    # وصف الحالة العاطفية الحالية
+    emotional_summary = ", ".join([f"{emotion}: {centi / 100:.2f}" for emotion, centi in state_key])
+
+    # وصف شخصية الكائن العاطفية بناءً على نطاق lambda_value
+    personality = PromptBuilder.personalities[band]
+
+    return f"""
+**حالتي العاطفية الحالية (Emotional State):**
+{emotional_summary}
+
+**ملخص الشخصية والسلوك الحالي (مبني على قيمة Lambda: {lambda_centi / 100:.2f}):**
+{personality}
+"""
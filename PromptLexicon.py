@@ -0,0 +1,45 @@
+# PromptLexicon.py - اتجاه رسالة المستخدم من قائمتي كلمات (عربية وإنجليزية): تسمية إعادة التدريب وميزة المصنف
+
+import re
+from typing import Optional, Tuple
+
+# كلمات تدل على اتجاه رسالة المستخدم؛ الرسالة مستقلة عن تنبؤ النموذج بخلاف انتقال الحالة
+POSITIVE_WORDS = frozenset({
+    "سعيد", "سعيدة", "فرح", "فرحان", "رائع", "رائعة", "ممتاز", "جميل", "جميلة", "شكرا", "شكراً", "أحب", "احب",
+    "مبسوط", "ممتن", "نجحت", "هادئ", "مرتاح", "فخور",
+    "happy", "glad", "great", "good", "love", "thanks", "thank", "awesome", "excellent", "calm", "proud", "excited",
+})
+NEGATIVE_WORDS = frozenset({
+    "حزين", "حزينة", "خائف", "خائفة", "قلق", "قلقة", "متوتر", "غاضب", "سيء", "سيئ", "مخيف", "أكره", "اكره",
+    "وحيد", "تعبان", "فشلت", "مذنب", "خوف",
+    "sad", "afraid", "scared", "anxious", "worried", "angry", "bad", "hate", "terrible", "awful", "lonely",
+    "guilty", "stressed", "upset",
+})
+_WORD = re.compile(r"\w+")
+
+# قيمة الميزة لرسالة بلا أي دلالة (وللمحاكي الذي لا يملك رسائل)
+NEUTRAL_TONE = 0.5
+
+
+def prompt_score(text: Optional[str]) -> Tuple[int, int]:
+    """(الإيجابية ناقص السلبية، عدد الكلمات الدالة) في نص الرسالة."""
+    score = hits = 0
+    for word in _WORD.findall((text or "").lower()):
+        # سوابق عربية شائعة (و، ال، وال) لا تغير المعنى
+        for form in (word, word[1:] if word.startswith("و") else None, word[2:] if word.startswith("ال") else None,
+                     word[3:] if word.startswith("وال") else None):
+            if form in POSITIVE_WORDS:
+                score, hits = score + 1, hits + 1
+                break
+            if form in NEGATIVE_WORDS:
+                score, hits = score - 1, hits + 1
+                break
+    return score, hits
+
+
+def prompt_tone(text: Optional[str]) -> float:
+    """ميزة المصنف 'prompt_tone' في [0, 1]: 1 إيجابية خالصة، 0 سلبية خالصة، NEUTRAL_TONE بلا دلالة أو متوازنة."""
+    score, hits = prompt_score(text)
+    if not hits:
+        return NEUTRAL_TONE
+    return (score / hits + 1.0) / 2.0
@@ -0,0 +1,220 @@
+# ResponseCache.py - ذاكرة مؤقتة لردود LLM مفتاحها المطالبة المطبّعة والحالة العاطفية المكمّاة
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from EmotionVector import EmotionVector, EMOTION_KEYS
+from PromptBuilder import PromptBuilder
+
+# التشكيل العربي والتطويل لا يغيّران معنى السؤال
+_ARABIC_MARKS = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+_WHITESPACE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = "!?.,;:؟،؛…\"'()[]{} "
+
+
+def normalize_prompt(prompt: str) -> str:
+    """تطبيع المطالبة: NFKC، حروف صغيرة، حذف التشكيل، توحيد المسافات وإزالة علامات الترقيم الطرفية."""
+    text = unicodedata.normalize("NFKC", prompt).casefold()
+    text = _ARABIC_MARKS.sub("", text)
+    text = _WHITESPACE.sub(" ", text)
+    return text.strip(_EDGE_PUNCTUATION)
+
+
+class MemoryCacheBackend:
+    """تخزين في ذاكرة العملية: LRU بحد أقصى للحجم مع انتهاء صلاحية لكل عنصر."""
+
+    # العمليات سريعة ولا تحتاج خيطًا منفصلًا في المسار غير المتزامن
+    blocking = False
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: float):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCacheBackend:
+    """تخزين على القرص في SQLite (يبقى بعد إعادة التشغيل ويتشاركه العمال): LRU عبر عمود last_access."""
+
+    blocking = True
+
+    # تقليم الجدول إلى الحد الأقصى مرة كل هذا العدد من الإضافات بدل كل إضافة
+    PRUNE_EVERY = 64
+
+    def __init__(self, db_path: str, max_entries: int):
+        self.db_path = db_path
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_response_cache_last_access ON response_cache (last_access)"
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            with self._conn:
+                if row[1] <= now:
+                    self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                    return None
+                self._conn.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, response, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now)
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune(now)
+
+    def _prune(self, now: float):
+        """حذف المنتهي ثم الأقدم استخدامًا حتى يعود الحجم ضمن الحد."""
+        self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+        self._conn.execute(
+            "DELETE FROM response_cache WHERE key IN ("
+            " SELECT key FROM response_cache ORDER BY last_access"
+            " LIMIT MAX(0, (SELECT COUNT(*) FROM response_cache) - ?))",
+            (self.max_entries,)
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM response_cache")
+
+
+class ResponseCache:
+    """
+    ذاكرة مؤقتة لردود LLM. المفتاح: (المطالبة المطبّعة، نطاق الشخصية حسب Lambda،
+    الحالة العاطفية مكمّاة بدقة resolution، اسم النموذج).
+    """
+
+    def __init__(self, backend: Any, ttl: float = 3600.0, resolution: float = 0.1):
+        self.backend = backend
+        self.ttl = ttl
+        self.resolution = resolution
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """إنشاء الذاكرة المؤقتة حسب RESPONSE_CACHE (memory / sqlite / off)؛ معطلة افتراضيًا."""
+        kind = os.environ.get("RESPONSE_CACHE", "off").lower()
+        if kind in ("", "off", "0", "none"):
+            return None
+
+        max_entries = int(os.environ.get("RESPONSE_CACHE_SIZE", "10000"))
+        if kind == "sqlite":
+            backend = SQLiteCacheBackend(os.environ.get("RESPONSE_CACHE_PATH", "response_cache.db"), max_entries)
+        elif kind == "memory":
+            backend = MemoryCacheBackend(max_entries)
+        else:
+            raise ValueError(f"Unknown RESPONSE_CACHE backend: {kind}")
+
+        return cls(
+            backend,
+            ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "3600")),
+            resolution=float(os.environ.get("RESPONSE_CACHE_RESOLUTION", "0.1")),
+        )
+
+    def make_key(self, user_prompt: str, state: EmotionVector, lambda_value: float, model_name: str,
+                 context: str = "") -> str:
+        """
+        بناء مفتاح ثابت (SHA-256) من المطالبة والحالة المكمّاة.
+        context: بصمة سياق المحادثة المرسل مع المطالبة (ConversationMemory.digest)، فارغة بدونه.
+        """
+        buckets = [
+            None if value != value else int(round(value / self.resolution))
+            for value in state.values.tolist()
+        ]
+        parts = [normalize_prompt(user_prompt), PromptBuilder.personality_band(lambda_value),
+                 dict(zip(EMOTION_KEYS, buckets)), model_name]
+        if context:
+            parts.append(context)
+        payload = json.dumps(parts, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.backend.get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, response_text: str):
+        self.backend.set(key, response_text, self.ttl)
+
+    def stats(self) -> Dict[str, Any]:
+        """إحصاءات الإصابة والإخفاق."""
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.backend),
+            "ttl": self.ttl,
+            "resolution": self.resolution,
+        }
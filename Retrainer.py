@@ -0,0 +1,358 @@
+# Retrainer.py - إعادة تدريب المصنف الداخلي في الخلفية من التفاعلات المسجلة، مع تحقق قبل الترقية وتبديل ذري
+
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from CompiledForest import CompiledForest
+from PromptLexicon import prompt_score, prompt_tone
+import Metrics
+
+try:
+    import fcntl
+except ImportError:  # ويندوز: بلا قفل بين العمليات (كل عامل يدرب بنفسه)
+    fcntl = None
+
+# اسم ملف المؤشر إلى الإصدار المرقّى الحالي داخل مجلد النماذج المعاد تدريبها
+CURRENT_FILE = "CURRENT"
+
+
+def label_prompt(row: Dict[str, Any]) -> Optional[int]:
+    """
+    فئة التدريب من نص رسالة المستخدم: 1 إيجابي، 2 سلبي، 0 محايد (كلمات من الاتجاهين بالتساوي)،
+    أو None لرسالة بلا أي دلالة (لا تُستخدم). (نفس ترميز update_deltas في المحرك.)
+    الانتقال المسجل (state_before -> state_after) ناتج عن تنبؤ النموذج نفسه، فلا يصلح تسمية:
+    النموذج الحالي يطابقه دائمًا ولن يتفوق عليه أي مرشح. الرسالة نفسها تدخل المصنف كميزة prompt_tone،
+    فالفئة قابلة للتعلم من الميزات.
+    """
+    score, hits = prompt_score(row.get("prompt"))
+    if not hits:
+        return None
+    if score > 0:
+        return 1
+    if score < 0:
+        return 2
+    return 0
+
+
+def _fit_forest(X: np.ndarray, y: np.ndarray, n_estimators: int, seed: int) -> Any:
+    """تدريب الغابة (يُنفَّذ في عملية منفصلة، لذا دالة على مستوى الوحدة قابلة للتسلسل)."""
+    from sklearn.ensemble import RandomForestClassifier
+    model = RandomForestClassifier(n_estimators=n_estimators, random_state=seed)
+    model.fit(X, y)
+    return model
+
+
+class ModelRetrainer:
+    """
+    خيط خلفي يجمع عينات (حالة قبل + prompt_tone -> فئة من رسالة المستخدم) من سجل التفاعلات تزايديًا بمؤشر على المعرف،
+    ويدرب غابة جديدة كل interval ثانية في عملية منفصلة (لا يلمس مسار الطلب ولا قفل GIL الخاص به).
+    المرشح يُقيَّم على أحدث holdout من العينات ولا يُرقّى إلا إذا تفوقت دقته على النموذج الحالي
+    بأكثر من margin ولم تقل عن min_accuracy، وتطابقت نسخته المُجمَّعة مع sklearn.
+    الترقية: حفظ الإصدار في مجلد خاص به ثم تحديث ملف CURRENT بـ os.replace؛ كل عامل يتبع المؤشر
+    ويحمّل الإصدار بـ mmap. قفل ملف يضمن أن عاملًا واحدًا فقط يدرب في كل دورة.
+    """
+
+    def __init__(self, engine: Any, db_path: str = 'emotions.db', interaction_log: Any = None,
+                 interval: Optional[float] = None,
+                 min_samples: Optional[int] = None,
+                 min_new_samples: Optional[int] = None,
+                 max_samples: Optional[int] = None,
+                 holdout: Optional[float] = None,
+                 min_accuracy: Optional[float] = None,
+                 margin: Optional[float] = None,
+                 n_estimators: Optional[int] = None,
+                 model_dir: Optional[str] = None,
+                 executor: Optional[str] = None,
+                 labeler: Callable[[Dict[str, Any]], Optional[int]] = label_prompt):
+        """
+        interval: الثواني بين دورات الجمع/التدريب (RETRAIN_INTERVAL).
+        min_samples / min_new_samples: أقل عدد عينات للتدريب، وأقل عدد جديد منذ آخر تدريب (RETRAIN_MIN_SAMPLES / RETRAIN_MIN_NEW).
+        max_samples: نافذة العينات الأحدث المحفوظة في الذاكرة (RETRAIN_MAX_SAMPLES).
+        holdout: نسبة أحدث العينات المحجوزة للتحقق (RETRAIN_HOLDOUT).
+        min_accuracy: أقل دقة للترقية (RETRAIN_MIN_ACCURACY).
+        margin: التحسن المطلوب على دقة النموذج الحالي؛ التعادل لا يُرقّى (RETRAIN_MARGIN).
+        model_dir: مجلد الإصدارات المعاد تدريبها (RETRAIN_MODEL_DIR).
+        executor: 'process' (افتراضي) أو 'thread' لمكان تنفيذ التدريب (RETRAIN_EXECUTOR).
+        labeler: دالة (سطر السجل) -> فئة التدريب، أو None لتجاهل السطر؛ يجب ألا تعتمد على مخرجات النموذج.
+        """
+        if interval is None:
+            interval = float(os.environ.get("RETRAIN_INTERVAL", "600"))
+        if min_samples is None:
+            min_samples = int(os.environ.get("RETRAIN_MIN_SAMPLES", "500"))
+        if min_new_samples is None:
+            min_new_samples = int(os.environ.get("RETRAIN_MIN_NEW", "200"))
+        if max_samples is None:
+            max_samples = int(os.environ.get("RETRAIN_MAX_SAMPLES", "50000"))
+        if holdout is None:
+            holdout = float(os.environ.get("RETRAIN_HOLDOUT", "0.2"))
+        if min_accuracy is None:
+            min_accuracy = float(os.environ.get("RETRAIN_MIN_ACCURACY", "0.6"))
+        if margin is None:
+            margin = float(os.environ.get("RETRAIN_MARGIN", "0.01"))
+        if n_estimators is None:
+            n_estimators = int(os.environ.get("RETRAIN_ESTIMATORS", "50"))
+        if model_dir is None:
+            model_dir = os.environ.get("RETRAIN_MODEL_DIR", os.path.join("models", "retrained"))
+        if executor is None:
+            executor = os.environ.get("RETRAIN_EXECUTOR", "process")
+
+        self.engine = engine
+        self.db_path = db_path
+        self.interaction_log = interaction_log
+        self.interval = interval
+        self.min_samples = min_samples
+        self.min_new_samples = min_new_samples
+        self.max_samples = max(1, max_samples)
+        self.holdout = min(0.5, max(0.05, holdout))
+        self.min_accuracy = min_accuracy
+        self.margin = max(0.0, margin)
+        self.n_estimators = n_estimators
+        self.model_dir = model_dir
+        self.executor_kind = executor
+        self.labeler = labeler
+
+        # العينات المجمعة (الأحدث في النهاية) ومؤشر آخر سطر مقروء
+        n_features = len(engine.model_features)
+        self._X = np.empty((0, n_features))
+        self._y = np.empty(0, dtype=np.int64)
+        self._cursor = 0
+        self._new_since_train = 0
+
+        self.runs = 0
+        self.promotions = 0
+        self.last_report: Dict[str, Any] = {}
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[concurrent.futures.Executor] = None
+
+    @classmethod
+    def from_env(cls, engine: Any, state_store: Any) -> Optional["ModelRetrainer"]:
+        """RETRAIN=0 يعطل إعادة التدريب (النموذج يبقى كما حُمّل عند الإقلاع)."""
+        if os.environ.get("RETRAIN", "1") == "0":
+            return None
+        return cls(engine, state_store.db_path, state_store.interaction_log)
+
+    # --- دورة الحياة ---
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="model-retrainer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _loop(self):
+        # الإحماء يحمّل النموذج الأساسي أولًا؛ بعده نتبع أحدث إصدار مرقّى (من هذا العامل أو غيره)
+        while not self.engine.ready.wait(timeout=1.0):
+            if self._stop.is_set():
+                return
+        try:
+            self.reload_published()
+        except Exception as e:
+            print(f"Error loading retrained internal model: {e}")
+        while not self._stop.wait(self.interval):
+            try:
+                self.reload_published()
+                self.run_once()
+            except Exception as e:
+                Metrics.RETRAIN_RUNS.labels("error").inc()
+                print(f"Model retraining error: {e}")
+
+    # --- جمع العينات ---
+
+    def _iter_rows(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """السطور الجديدة بعد المؤشر: من جدول interactions، أو جدول log القديم إذا كان السجل معطلًا."""
+        if self.interaction_log is not None:
+            for row in self.interaction_log.iter_export(after_id=self._cursor):
+                yield row["id"], row
+            return
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.execute("SELECT id, data FROM log WHERE id > ? ORDER BY id", (self._cursor,))
+            while True:
+                rows = cursor.fetchmany(500)
+                if not rows:
+                    break
+                for row_id, data in rows:
+                    try:
+                        yield row_id, json.loads(data)
+                    except (TypeError, ValueError):
+                        yield row_id, {}
+        finally:
+            conn.close()
+
+    def collect(self) -> int:
+        """قراءة السطور الجديدة فقط وتحويلها إلى عينات؛ يعيد عدد العينات المضافة."""
+        features = self.engine.emotions_features
+        rows: List[List[float]] = []
+        labels: List[int] = []
+        for row_id, row in self._iter_rows():
+            self._cursor = row_id
+            before = row.get("state_before")
+            if not isinstance(before, dict):
+                continue
+            label = self.labeler(row)
+            if label is None:
+                continue
+            rows.append([float(before.get(key, 0.5)) for key in features] + [prompt_tone(row.get("prompt"))])
+            labels.append(int(label))
+
+        if rows:
+            self._X = np.vstack([self._X, np.asarray(rows)])[-self.max_samples:]
+            self._y = np.concatenate([self._y, np.asarray(labels, dtype=np.int64)])[-self.max_samples:]
+            self._new_since_train += len(rows)
+            Metrics.RETRAIN_SAMPLES.set(len(self._y))
+        return len(rows)
+
+    # --- التدريب والترقية ---
+
+    def run_once(self) -> Dict[str, Any]:
+        """دورة واحدة: جمع تزايدي، ثم تدريب وتحقق وترقية إذا توفرت عينات جديدة كافية."""
+        with self._run_lock:
+            self.runs += 1
+            added = self.collect()
+            report: Dict[str, Any] = {"time": time.time(), "added": added, "samples": len(self._y)}
+            if len(self._y) < self.min_samples or self._new_since_train < self.min_new_samples:
+                report["outcome"] = "skipped"
+            elif len(np.unique(self._y)) < 2:
+                report["outcome"] = "skipped"
+                report["reason"] = "single class"
+            else:
+                with self._train_lock() as acquired:
+                    if not acquired:
+                        # عامل آخر يدرب الآن؛ سنحمّل نتيجته من CURRENT
+                        report["outcome"] = "skipped"
+                        report["reason"] = "another worker is training"
+                    else:
+                        report.update(self._train_and_evaluate())
+            Metrics.RETRAIN_RUNS.labels(report["outcome"]).inc()
+            self.last_report = report
+            return report
+
+    def _train_and_evaluate(self) -> Dict[str, Any]:
+        split = len(self._y) - max(1, int(len(self._y) * self.holdout))
+        X_train, y_train = self._X[:split], self._y[:split]
+        X_val, y_val = self._X[split:], self._y[split:]
+        self._new_since_train = 0
+
+        start = time.perf_counter()
+        model = self._get_executor().submit(
+            _fit_forest, X_train, y_train, self.n_estimators, int(start * 1000) % (2 ** 31)
+        ).result()
+        report: Dict[str, Any] = {"train_seconds": time.perf_counter() - start,
+                                  "train_size": len(y_train), "validation_size": len(y_val)}
+
+        compiled = self.engine._compile_internal_model(model, X_val)
+        if compiled is None:
+            report["outcome"] = "rejected"
+            report["reason"] = "compiled model disagrees with sklearn"
+            return report
+
+        candidate = float(np.mean(compiled.predict(X_val) == y_val))
+        current = float(np.mean(self.engine.predict_emotion_classes(X_val) == y_val))
+        report.update(candidate_accuracy=candidate, current_accuracy=current)
+        if candidate < self.min_accuracy or candidate <= current + self.margin:
+            report["outcome"] = "rejected"
+            return report
+
+        version = time.strftime("%Y%m%d%H%M%S") + f"-{os.getpid()}"
+        self.publish(compiled, version)
+        self.engine.swap_internal_model(compiled, model)
+        self.promotions += 1
+        report.update(outcome="promoted", version=version)
+        print(f"Promoted retrained internal model {version} "
+              f"(accuracy {candidate:.3f} vs {current:.3f} on {len(y_val)} held-out samples)")
+        return report
+
+    def _get_executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            if self.executor_kind == "thread":
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrain")
+            else:
+                # spawn وليس fork: العملية الأم متعددة الخيوط (خوادم، كاتب السجل، ...)
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=1, mp_context=multiprocessing.get_context("spawn")
+                )
+        return self._executor
+
+    # --- النشر بين العمال ---
+
+    @contextmanager
+    def _train_lock(self) -> Iterator[bool]:
+        """قفل ملف غير حاجز: عامل واحد يدرب في كل مرة (بلا fcntl يُعتبر القفل متاحًا دائمًا)."""
+        if fcntl is None:
+            yield True
+            return
+        os.makedirs(self.model_dir, exist_ok=True)
+        # إغلاق الملف يحرر القفل
+        with open(os.path.join(self.model_dir, "train.lock"), "w") as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            yield True
+
+    def publish(self, compiled: CompiledForest, version: str, keep: int = 3):
+        """حفظ الإصدار في مجلده ثم تبديل المؤشر CURRENT ذريًا، وحذف الإصدارات الأقدم من آخر keep."""
+        compiled.save(os.path.join(self.model_dir, version), self.engine.model_features, version)
+        pointer = os.path.join(self.model_dir, CURRENT_FILE)
+        with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(pointer + ".tmp", pointer)
+
+        # الملفات المحملة بـ mmap في عمال آخرين تبقى صالحة بعد الحذف (لينكس)
+        versions = sorted(name for name in os.listdir(self.model_dir)
+                          if os.path.isdir(os.path.join(self.model_dir, name)))
+        for name in versions[:-keep]:
+            shutil.rmtree(os.path.join(self.model_dir, name), ignore_errors=True)
+
+    def published_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.model_dir, CURRENT_FILE), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def reload_published(self) -> bool:
+        """تحميل الإصدار المرقّى الحالي إذا كان أحدث مما يخدمه هذا العامل."""
+        version = self.published_version()
+        current = self.engine.internal_classifier
+        if version is None or (current is not None and current.version == version):
+            return False
+        compiled = CompiledForest.load(os.path.join(self.model_dir, version),
+                                       expected_features=self.engine.model_features)
+        self.engine.swap_internal_model(compiled)
+        print(f"Loaded retrained internal model {version}")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        current = self.engine.internal_classifier
+        return {
+            "model_version": current.version if current is not None else None,
+            "published_version": self.published_version(),
+            "samples": len(self._y),
+            "new_samples": self._new_since_train,
+            "cursor": self._cursor,
+            "runs": self.runs,
+            "promotions": self.promotions,
+            "interval": self.interval,
+            "last_run": self.last_report,
+        }
@@ -0,0 +1,110 @@
+# SamplingProfiler.py - محلل أداء بأخذ عينات من المكدس لنسبة من الطلبات، قابل للتفعيل أثناء التشغيل
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+
+class SamplingProfiler:
+    """
+    عند أخذ عينة من طلب (باحتمال sample_rate) يعمل خيط خلفي يلتقط مكدسات كل الخيوط كل interval ثانية
+    طالما بقي طلب معاين جارٍ، ويجمعها بصيغة المكدسات المطوية (مناسبة لـ flamegraph).
+    sample_rate = 0 يعني أن التكلفة على الطلب مقارنة واحدة فقط.
+    """
+
+    def __init__(self, sample_rate: Optional[float] = None, interval: Optional[float] = None,
+                 max_stacks: int = 5000):
+        if sample_rate is None:
+            sample_rate = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+        if interval is None:
+            interval = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.profiled_requests = 0
+        self.samples = 0
+
+        self._stacks: Counter = Counter()
+        self._active = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, sample_rate: Optional[float] = None, interval: Optional[float] = None):
+        """تغيير النسبة أو الفاصل أثناء التشغيل (0 يوقف أخذ العينات من الطلبات الجديدة)."""
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(1.0, sample_rate))
+        if interval is not None:
+            self.interval = max(0.0005, interval)
+
+    @contextmanager
+    def maybe_profile(self) -> Iterator[bool]:
+        """يحيط بمعالجة طلب؛ يفعّل أخذ العينات إذا وقع عليه الاختيار."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            yield False
+            return
+        with self._lock:
+            self._active += 1
+            self.profiled_requests += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, name="sampling-profiler", daemon=True)
+                self._thread.start()
+            self._wake.notify()
+        try:
+            yield True
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                while self._active == 0:
+                    self._wake.wait()
+            frames = sys._current_frames()
+            collected = []
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                collected.append(";".join(reversed(stack)))
+            with self._lock:
+                for stack in collected:
+                    if stack in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[stack] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def report(self, limit: int = 50) -> Dict[str, object]:
+        """أكثر المكدسات تكرارًا مع إحصاءات أخذ العينات."""
+        with self._lock:
+            top = self._stacks.most_common(limit)
+        return {
+            "sample_rate": self.sample_rate,
+            "interval": self.interval,
+            "profiled_requests": self.profiled_requests,
+            "samples": self.samples,
+            "stacks": [{"stack": stack, "count": count} for stack, count in top],
+        }
+
+    def collapsed(self) -> str:
+        """كل المكدسات بصيغة 'a;b;c count' (مدخل flamegraph.pl أو speedscope)."""
+        with self._lock:
+            lines: List[str] = [f"{stack} {count}" for stack, count in self._stacks.most_common()]
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+            self.profiled_requests = 0
@@ -0,0 +1,217 @@
+# Simulator.py - محاكاة متجهية لديناميكيات الحالة العاطفية: N جلسة × T خطوة كعمليات NumPy على مصفوفات
+
+import numpy as np
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from EmotionVector import EMOTION_KEYS, EMOTION_INDEX, POSITIVE_INDEX, NEGATIVE_INDEX
+from EmotionalState import EmotionalState
+from PromptBuilder import PromptBuilder
+from PromptLexicon import NEUTRAL_TONE
+
+# ترتيب نطاقات الشخصية في مصفوفات الإشغال (رموز 0..3)
+BAND_NAMES: Tuple[str, ...] = tuple(PromptBuilder.personalities)
+
+
+class SimulationResult:
+    """نتائج المحاكاة: المسارات، قيم Lambda، ونطاقات الشخصية لكل جلسة في كل خطوة."""
+
+    def __init__(self, trajectories: Optional[np.ndarray], lambdas: np.ndarray, bands: np.ndarray,
+                 predictions: Optional[np.ndarray]):
+        # trajectories: (T+1, N, len(EMOTION_KEYS)) أو None إذا لم تُسجَّل؛ الصف 0 هو الحالة الأولية
+        self.trajectories = trajectories
+        # lambdas / bands: (T+1, N)
+        self.lambdas = lambdas
+        self.bands = bands
+        # predictions: (T, N) فئة التحديث في كل خطوة (وضع المصنف فقط)
+        self.predictions = predictions
+
+    @property
+    def steps(self) -> int:
+        return self.lambdas.shape[0] - 1
+
+    @property
+    def sessions(self) -> int:
+        return self.lambdas.shape[1]
+
+    def band_occupancy(self) -> Dict[str, float]:
+        """نسبة الوقت (جلسة-خطوة) في كل نطاق شخصية، دون الحالة الأولية."""
+        counts = np.bincount(self.bands[1:].ravel(), minlength=len(BAND_NAMES))
+        total = max(1, counts.sum())
+        return {name: float(count / total) for name, count in zip(BAND_NAMES, counts)}
+
+    def band_occupancy_by_step(self) -> np.ndarray:
+        """(T+1, عدد النطاقات): نسبة الجلسات في كل نطاق عند كل خطوة."""
+        one_hot = self.bands[..., np.newaxis] == np.arange(len(BAND_NAMES))
+        return one_hot.mean(axis=1)
+
+    def lambda_histogram(self, bins: int = 20) -> Dict[str, list]:
+        """توزيع Lambda على كل الجلسات والخطوات (دون الحالة الأولية)."""
+        counts, edges = np.histogram(self.lambdas[1:], bins=bins, range=(0.0, 1.0))
+        return {"counts": counts.tolist(), "edges": edges.tolist()}
+
+    def summary(self, bins: int = 20) -> Dict[str, Any]:
+        """ملخص قابل للتحويل إلى JSON."""
+        final = self.lambdas[-1]
+        return {
+            "sessions": self.sessions,
+            "steps": self.steps,
+            "lambda_final": {
+                "mean": float(final.mean()),
+                "std": float(final.std()),
+                "p5": float(np.percentile(final, 5)),
+                "p50": float(np.percentile(final, 50)),
+                "p95": float(np.percentile(final, 95)),
+            },
+            "lambda_histogram": self.lambda_histogram(bins),
+            "band_occupancy": self.band_occupancy(),
+        }
+
+
+class EmotionSimulator:
+    """
+    يكرر قاعدتي التحديث في EmotionalEngine على مصفوفة (N, len(EMOTION_KEYS)) دفعة واحدة:
+    - 'random_walk': مثل _generate_simulated_response (تغيير منتظم ± step لكل عاطفة ثم القص).
+    - 'classifier': مثل _predict_and_update_state (تصنيف ميزات كل الجلسات في استدعاء واحد ثم إضافة متجه الفئة).
+    معاملات Lambda وحدود النطاقات قابلة للضبط لتجربة قيم بديلة؛ القيم الافتراضية تطابق المحرك.
+    """
+
+    def __init__(self, classifier: Any = None,
+                 update_magnitude: float = 0.15,
+                 features: Sequence[str] = ('joy', 'fear', 'calm'),
+                 prompt_tone: Optional[float] = NEUTRAL_TONE,
+                 positive_weight: float = 1.5,
+                 negative_weight: float = 2.0,
+                 lambda_scale: float = 4.0,
+                 tense_max: float = 0.25,
+                 calm_min: float = 0.5,
+                 enthusiastic_min: float = 0.75,
+                 random_step: float = 0.1,
+                 seed: Optional[int] = None):
+        """
+        classifier: أي كائن له predict(X) على مصفوفة ميزات (CompiledForest أو نموذج sklearn)؛
+                    None يعني فئة عشوائية لكل خطوة كما يفعل المحرك عند غياب النموذج.
+        prompt_tone: ميزة اتجاه الرسالة المضافة بعد features لكل الجلسات (المحاكي بلا رسائل، فالمحايد افتراضيًا)؛
+                     None لمصنف يأخذ ميزات الحالة وحدها.
+        """
+        self.classifier = classifier
+        self.update_magnitude = update_magnitude
+        self.feature_index = np.array([EMOTION_INDEX[key] for key in features])
+        self.prompt_tone = prompt_tone
+        self.positive_weight = positive_weight
+        self.negative_weight = negative_weight
+        self.lambda_scale = lambda_scale
+        self.tense_max = tense_max
+        self.calm_min = calm_min
+        self.enthusiastic_min = enthusiastic_min
+        self.random_step = random_step
+        self.rng = np.random.default_rng(seed)
+
+        # جدول التغيير لكل فئة (الصف 0 محايد بلا تغيير)
+        self.delta_table = np.zeros((3, len(EMOTION_KEYS)))
+        self.delta_table[1, EMOTION_INDEX['joy']] = update_magnitude
+        self.delta_table[1, EMOTION_INDEX['fear']] = -update_magnitude
+        self.delta_table[2, EMOTION_INDEX['joy']] = -update_magnitude
+        self.delta_table[2, EMOTION_INDEX['fear']] = update_magnitude
+
+    @classmethod
+    def from_engine(cls, engine: Any, seed: Optional[int] = None, **overrides: Any) -> "EmotionSimulator":
+        """محاكي بنفس نموذج المحرك الداخلي ومعاملاته (overrides لتجربة قيم أخرى)."""
+        classifier = engine.internal_classifier if engine.internal_classifier is not None else engine.internal_llm_model
+        params = {
+            "classifier": classifier,
+            "update_magnitude": engine.update_magnitude,
+            "features": engine.emotions_features,
+            "seed": seed,
+        }
+        params.update(overrides)
+        return cls(**params)
+
+    # --- الحالة ---
+
+    def initial_states(self, n_sessions: int, jitter: float = 0.0) -> np.ndarray:
+        """N نسخة من حالة الجلسة الجديدة الافتراضية، مع تشويش منتظم ± jitter اختياري لتنويع البدايات."""
+        base = np.full(len(EMOTION_KEYS), np.nan)
+        for key, value in EmotionalState.initial_state.items():
+            if key in EMOTION_INDEX:
+                base[EMOTION_INDEX[key]] = value
+        states = np.tile(base, (n_sessions, 1))
+        if jitter > 0:
+            states += self.rng.uniform(-jitter, jitter, size=states.shape)
+            np.clip(states, 0.0, 1.0, out=states)
+        return states
+
+    def lambda_values(self, values: np.ndarray) -> np.ndarray:
+        """Lambda لكل صف بمعاملات المحاكي (بالقيم الافتراضية تطابق batch_lambda)."""
+        values = np.nan_to_num(values)
+        positive_affect = values[..., POSITIVE_INDEX].sum(axis=-1)
+        negative_affect = values[..., NEGATIVE_INDEX].sum(axis=-1)
+        weighted = positive_affect * self.positive_weight - negative_affect * self.negative_weight
+        return 1.0 / (1.0 + np.exp(-weighted / self.lambda_scale))
+
+    def personality_bands(self, lambdas: np.ndarray) -> np.ndarray:
+        """رمز النطاق (فهرس في BAND_NAMES) لكل قيمة Lambda بنفس ترتيب شروط PromptBuilder.personality_band."""
+        bands = np.full(lambdas.shape, BAND_NAMES.index('balanced'), dtype=np.int8)
+        bands[lambdas <= self.tense_max] = BAND_NAMES.index('tense')
+        bands[lambdas >= self.calm_min] = BAND_NAMES.index('calm')
+        bands[lambdas >= self.enthusiastic_min] = BAND_NAMES.index('enthusiastic')
+        return bands
+
+    # --- خطوات التحديث ---
+
+    def random_walk_step(self, states: np.ndarray) -> np.ndarray:
+        """خطوة محاكاة عشوائية لكل الجلسات (في مكانها)."""
+        states += self.rng.uniform(-self.random_step, self.random_step, size=states.shape)
+        np.clip(states, 0.0, 1.0, out=states)
+        return states
+
+    def classifier_step(self, states: np.ndarray) -> np.ndarray:
+        """خطوة تصنيف لكل الجلسات (في مكانها)؛ تعيد فئة كل جلسة."""
+        features = states[:, self.feature_index]
+        features = np.where(np.isnan(features), 0.5, features)
+        if self.prompt_tone is not None:
+            features = np.column_stack([features, np.full(len(states), self.prompt_tone)])
+        if self.classifier is not None:
+            predictions = np.asarray(self.classifier.predict(features)).astype(np.int64)
+        else:
+            predictions = self.rng.integers(0, 3, size=len(states))
+
+        # الفئات خارج الجدول تُعامل كمحايدة (مثل update_deltas.get)
+        known = (predictions >= 0) & (predictions < len(self.delta_table))
+        delta = self.delta_table[np.where(known, predictions, 0)]
+        # المفتاح الغائب الذي يتغير يبدأ من صفر (مثل EmotionVector.update)
+        states[(delta != 0) & np.isnan(states)] = 0.0
+        states += delta
+        np.clip(states, 0.0, 1.0, out=states)
+        return predictions
+
+    def run(self, n_sessions: int, steps: int, mode: str = "classifier",
+            initial: Optional[np.ndarray] = None, jitter: float = 0.0,
+            record_trajectories: bool = True) -> SimulationResult:
+        """
+        تشغيل N جلسة لـ T خطوة. initial: مصفوفة (N, len(EMOTION_KEYS)) بدل الحالة الافتراضية.
+        record_trajectories=False يحفظ Lambda والنطاقات فقط (ذاكرة أقل لعدد كبير من الجلسات).
+        """
+        if mode not in ("classifier", "random_walk"):
+            raise ValueError(f"Unknown simulation mode: {mode}")
+        states = (np.array(initial, dtype=np.float64) if initial is not None
+                  else self.initial_states(n_sessions, jitter))
+
+        trajectories = None
+        if record_trajectories:
+            # float32 يكفي للتحليل ويضاعف عدد الجلسات-الخطوات الممكن في الذاكرة
+            trajectories = np.empty((steps + 1, len(states), len(EMOTION_KEYS)), dtype=np.float32)
+            trajectories[0] = states
+        lambdas = np.empty((steps + 1, len(states)))
+        lambdas[0] = self.lambda_values(states)
+        predictions = np.empty((steps, len(states)), dtype=np.int8) if mode == "classifier" else None
+
+        for step in range(steps):
+            if mode == "classifier":
+                predictions[step] = self.classifier_step(states)
+            else:
+                self.random_walk_step(states)
+            if record_trajectories:
+                trajectories[step + 1] = states
+            lambdas[step + 1] = self.lambda_values(states)
+
+        return SimulationResult(trajectories, lambdas, self.personality_bands(lambdas), predictions)
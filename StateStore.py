@@ -0,0 +1,99 @@
+# StateStore.py - مخزن الحالات العاطفية لكل جلسة مع ذاكرة LRU مؤقتة
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from EmotionalState import EmotionalState, StateStorage, DEFAULT_SESSION_ID
+from InteractionLog import InteractionLog
+
+
+class SessionStateStore:
+    """يحتفظ بالجلسات النشطة في ذاكرة LRU محدودة الحجم مع انتهاء صلاحية (TTL)، ويحمّل الباقي من SQLite عند الطلب."""
+
+    def __init__(self, db_path: str = 'emotions.db',
+                 storage: Optional[StateStorage] = None,
+                 max_sessions: Optional[int] = None,
+                 ttl: Optional[float] = None,
+                 interaction_log: Optional[InteractionLog] = None):
+        """
+        max_sessions: أقصى عدد من الجلسات في الذاكرة (افتراضيًا من STATE_CACHE_SIZE).
+        ttl: مدة بقاء الجلسة الخاملة في الذاكرة بالثواني (افتراضيًا من STATE_CACHE_TTL).
+        interaction_log: سجل التفاعلات المشترك (يُنشأ افتراضيًا ما لم يكن INTERACTION_LOG=0).
+        """
+        self.db_path = db_path
+        self.storage = storage or StateStorage(db_path)
+        if interaction_log is None and os.environ.get("INTERACTION_LOG", "1") != "0":
+            interaction_log = InteractionLog(db_path)
+        self.interaction_log = interaction_log
+
+        if max_sessions is None:
+            max_sessions = int(os.environ.get("STATE_CACHE_SIZE", "10000"))
+        if ttl is None:
+            ttl = float(os.environ.get("STATE_CACHE_TTL", "1800"))
+        self.max_sessions = max(1, max_sessions)
+        self.ttl = ttl
+
+        # session_id -> (EmotionalState, آخر وقت وصول)
+        self._sessions: "OrderedDict[str, Tuple[EmotionalState, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str = DEFAULT_SESSION_ID) -> EmotionalState:
+        """يعيد حالة الجلسة من الذاكرة، أو يحمّلها من قاعدة البيانات عند عدم وجودها."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._sessions[session_id] = (entry[0], now)
+                self._sessions.move_to_end(session_id)
+                session = entry[0]
+            else:
+                session = None
+
+        if session is not None:
+            # عامل آخر قد يكون حدّث الجلسة: مقارنة رقم الإصدار (قراءة واحدة) وإعادة التحميل عند الاختلاف
+            if self.storage.shared:
+                session.refresh()
+            return session
+
+        # التحميل من القرص خارج قفل الذاكرة حتى لا تنتظر الجلسات الأخرى
+        session = EmotionalState(self.db_path, storage=self.storage, session_id=session_id,
+                                 interaction_log=self.interaction_log)
+
+        with self._lock:
+            # قد يكون طلب متزامن آخر قد حمّل نفس الجلسة؛ نعتمد النسخة الموجودة ليبقى قفلها واحدًا
+            entry = self._sessions.get(session_id)
+            if entry is not None and now - entry[1] <= self.ttl:
+                session = entry[0]
+            self._sessions[session_id] = (session, now)
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+        return session
+
+    def _evict(self, now: float):
+        """إزالة الجلسات المنتهية صلاحيتها ثم الأقدم استخدامًا حتى يعود الحجم ضمن الحد."""
+        # الجلسات مرتبة حسب آخر وصول، لذا تكفي مراجعة البداية
+        while self._sessions:
+            oldest_id, (_, last_access) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[oldest_id]
+
+    def get_state(self, session_id: str = DEFAULT_SESSION_ID) -> Dict[str, float]:
+        """يعيد قاموس الحالة العاطفية لجلسة."""
+        return self.get(session_id).state
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def flush(self):
+        """كتابة أي تحديثات مؤجلة إلى القرص فورًا."""
+        self.storage.flush()
+
+    def close(self):
+        """كتابة التحديثات المعلقة وسجل التفاعلات وإغلاق الاتصالات (يُستدعى عند إيقاف الخادم)."""
+        if self.interaction_log is not None:
+            self.interaction_log.close()
+        self.storage.close()
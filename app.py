@@ -1,29 +1,81 @@
 # app.py
 
 # نقطة الدخول الرئيسية لتطبيق FastAPI
-from fastapi import FastAPI
+import asyncio
+import hmac
+import json
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import FastAPI, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from pydantic import BaseModel
 import os
 
 # استخدام الاستيراد المطلق لضمان عمله في بيئات النشر
 from EmotionalProcessorV4 import EmotionalEngine
-from EmotionalState import EmotionalState
+from EmotionalState import DEFAULT_SESSION_ID
+from StateStore import SessionStateStore
 from PromptBuilder import PromptBuilder
+from Retrainer import ModelRetrainer
+from AdmissionControl import AdmissionController, AdmissionRejected
+import Metrics
 
 # تهيئة Firebase (هذه الخطوة غير ضرورية حاليًا ما دمنا نستخدم SQLite محليًا، لكنها خطوة جيدة)
 # سنقوم بالتهيئة الأساسية هنا، لكن التطبيق يعتمد على SQLite حاليًا
 # app = initialize_firebase_app() 
 
-# تهيئة محرك العواطف (يستخدم حالة عاطفية محددة)
-state_manager = EmotionalState()
-# هنا يتم تهيئة EmotionalEngine، حيث يتم تمرير state_manager إليه
+# تهيئة مخزن الحالات العاطفية (حالة مستقلة لكل جلسة مع ذاكرة LRU مؤقتة)
+state_store = SessionStateStore()
+# هنا يتم تهيئة EmotionalEngine، حيث يتم تمرير state_store إليه
 # ويتم تهيئة LLM client بداخله بشكل آمن
-engine = EmotionalEngine(state_manager=state_manager)
+# الإحماء (تحميل النموذج الداخلي وعميل Gemini) يتم في الخلفية بعد بدء الخادم لتسريع الإقلاع
+engine = EmotionalEngine(state_store=state_store, warm_up=False)
+# إعادة تدريب النموذج الداخلي من التفاعلات المسجلة في الخلفية (RETRAIN=0 يعطلها)
+retrainer = ModelRetrainer.from_env(engine, state_store)
+# التحكم في القبول أمام /chat: طابور محدود وعادل بين الجلسات، و429 بدل الانتظار حتى انتهاء مهلة العميل (ADMISSION=0 يعطله)
+# السعة الافتراضية = حد تزامن Gemini في المحرك، فلا يصبح القبول هو عنق الزجاجة
+admission = AdmissionController.from_env(default_timeout=engine.request_timeout,
+                                         default_concurrency=engine.llm_max_concurrency)
+# عدد الجلسات في الذاكرة يُقرأ عند كل طلب لـ /metrics
+Metrics.REGISTRY.register_collector(lambda: Metrics.SESSIONS.set(len(state_store)))
+# أقصى انتظار لانتهاء الإحماء داخل طلب دردشة قبل رد 503 (بالثواني)
+READY_WAIT_TIMEOUT = float(os.environ.get("READY_WAIT_TIMEOUT", "10"))
+# رمز المشرف لعمليات تتجاوز جلسة واحدة (قراءة/تصدير سجل كل الجلسات)؛ بدونه هذه العمليات معطلة
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# مهمة الإحماء الجارية (تُنشأ في lifespan)
+warm_up_task: Optional[asyncio.Task] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """ دورة حياة التطبيق: إحماء المحرك في الخلفية، وكتابة الحالة المؤجلة وإغلاق قاعدة البيانات عند الإيقاف. """
+    global warm_up_task
+    warm_up_task = asyncio.create_task(asyncio.to_thread(engine.warm_up))
+    # خيط إعادة التدريب ينتظر انتهاء الإحماء قبل أول دورة
+    if retrainer is not None:
+        retrainer.start()
+    yield
+    await warm_up_task
+    if retrainer is not None:
+        retrainer.stop()
+    state_store.close()
+
+# أقصى عدد من العناصر في طلب /chat/batch واحد
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "256"))
+
+class BatchItem(BaseModel):
+    user_prompt: str
+    session_id: str = DEFAULT_SESSION_ID
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    no_cache: bool = False
 
 app = FastAPI(
     title="Emotional Chat API",
     description="API for the emotionally aware chat companion.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # تفعيل CORS للسماح بالوصول من أي مصدر (مهم للتطبيقات الـ Frontend)
@@ -40,25 +92,226 @@ def read_root():
     """ نقطة وصول أساسية للتحقق من أن الـ API يعمل. """
     return {"status": "Operational", "message": "Emotional Chat API is running."}
 
+@app.get("/ready")
+def readiness():
+    """ نقطة جاهزية: 503 حتى ينتهي إحماء المحرك (تحميل النموذج الداخلي وعميل Gemini). """
+    if engine.ready.is_set():
+        return {"status": "ready"}
+    return JSONResponse(status_code=503, content={"status": "warming_up"})
+
+async def _wait_ready(timeout: Optional[float] = None) -> bool:
+    """
+    انتظار انتهاء الإحماء (بحد READY_WAIT_TIMEOUT أو مهلة العميل إن كانت أقصر).
+    قبله لا يوجد نموذج داخلي ولا عميل Gemini، فيُرد الطلب بـ 503 بدل تحديث الحالة عشوائيًا وحفظه.
+    """
+    if engine.ready.is_set():
+        return True
+    if warm_up_task is None:
+        return False
+    wait = READY_WAIT_TIMEOUT if timeout is None else min(READY_WAIT_TIMEOUT, timeout)
+    await asyncio.wait({warm_up_task}, timeout=max(0.0, wait))
+    return engine.ready.is_set()
+
+def _is_admin(token: Optional[str]) -> bool:
+    """ هل الطلب يحمل رمز المشرف الصحيح (ترويسة X-Admin-Token)؟ دائمًا لا إذا لم يُضبط ADMIN_TOKEN. """
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+def _forbidden_response(action: str) -> JSONResponse:
+    return JSONResponse(status_code=403, content={"error": f"{action} requires a valid X-Admin-Token (ADMIN_TOKEN)."})
+
+def _warming_up_response() -> JSONResponse:
+    """ رد الطلب الذي وصل قبل انتهاء الإحماء: 503 مع Retry-After. """
+    return JSONResponse(
+        status_code=503,
+        content={"response": "Server is warming up, please retry shortly.", "current_state": "Error",
+                 "reason": "warming_up"},
+        headers={"Retry-After": "1"}
+    )
+
+def _rejected_response(rejected: AdmissionRejected) -> JSONResponse:
+    """ رد الطلب المرفوض عند القبول: 429 مع Retry-After، أو 504 إذا انتهى موعد العميل. """
+    headers = {}
+    if rejected.retry_after is not None:
+        headers["Retry-After"] = str(int(rejected.retry_after))
+    return JSONResponse(
+        status_code=rejected.status_code,
+        content={"response": "Server is busy, please retry later.", "current_state": "Error",
+                 "reason": rejected.reason},
+        headers=headers
+    )
+
 @app.post("/chat")
-def chat_endpoint(user_prompt: str):
-    """ نقطة وصول لمعالجة طلبات الدردشة مع المستخدم. """
+async def chat_endpoint(user_prompt: str, session_id: str = DEFAULT_SESSION_ID, no_cache: bool = False,
+                        x_request_timeout: Optional[float] = Header(None)):
+    """
+    نقطة وصول لمعالجة طلبات الدردشة مع المستخدم (لكل جلسة حالتها العاطفية؛ no_cache يتجاوز ذاكرة الردود).
+    ترويسة X-Request-Timeout: كم ثانية سينتظر العميل؛ الطلب الذي يتجاوزها في الطابور يُسقط قبل استدعاء Gemini.
+    """
+    if not engine.ready.is_set():
+        started = asyncio.get_running_loop().time()
+        if not await _wait_ready(x_request_timeout):
+            return _warming_up_response()
+        if x_request_timeout is not None:
+            x_request_timeout = max(0.0, x_request_timeout - (asyncio.get_running_loop().time() - started))
     try:
-        # معالجة الطلب عبر محرك العواطف
-        response_text, state_update = engine.process_message(user_prompt)
+        if admission is None:
+            return await _chat(user_prompt, session_id, no_cache, x_request_timeout)
+        async with admission.slot(session_id, x_request_timeout) as remaining:
+            return await _chat(user_prompt, session_id, no_cache, remaining)
+    except AdmissionRejected as rejected:
+        return _rejected_response(rejected)
+
+async def _chat(user_prompt: str, session_id: str, no_cache: bool, timeout: Optional[float]):
+    """ معالجة طلب دردشة مقبول؛ timeout: ما تبقى من موعد العميل، ويحد ميزانية استدعاء Gemini أيضًا. """
+    try:
+        # معالجة الطلب عبر محرك العواطف (غير متزامن: لا يحجز خيطًا أثناء انتظار Gemini)
+        trace = {}
+        response_text, state_update = await engine.process_message_async(
+            user_prompt, session_id, use_cache=not no_cache, trace=trace, timeout=timeout
+        )
         
-        return {
+        result = {
             "response": response_text,
             "current_state": state_update
         }
+        # رد محلي بدل Gemini (القاطع مفتوح أو انتهت ميزانية الاستدعاء)
+        if "degraded" in trace:
+            result["degraded"] = trace["degraded"]
+        return result
+    except asyncio.TimeoutError:
+        # استدعاء Gemini محدود بالموعد نفسه ويعطي ردًا مخفضًا؛ هنا تجاوزت باقي المراحل ما تبقى من المهلة
+        return JSONResponse(
+            status_code=504,
+            content={"response": "Request timed out.", "current_state": "Error", "reason": "deadline_expired"}
+        )
     except Exception as e:
         # معالجة الأخطاء وإرسال رسالة خطأ واضحة
         return {"response": f"An error occurred: {str(e)}", "current_state": "Error"}
 
+@app.post("/chat/batch")
+async def chat_batch_endpoint(request: BatchRequest):
+    """ معالجة دفعة رسائل: تحديثات الحالة بالترتيب في معاملة واحدة، واستدعاءات Gemini متزامنة؛ النتائج بترتيب الإدخال. """
+    if len(request.items) > BATCH_MAX_ITEMS:
+        return JSONResponse(status_code=413, content={"error": f"Batch exceeds {BATCH_MAX_ITEMS} items."})
+    if not await _wait_ready():
+        return _warming_up_response()
+    try:
+        results = await engine.process_batch_async(
+            [(item.user_prompt, item.session_id) for item in request.items], use_cache=not request.no_cache
+        )
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": f"An error occurred: {str(e)}"})
+    return {"results": results}
+
+@app.api_route("/chat/stream", methods=["GET", "POST"])
+async def chat_stream_endpoint(user_prompt: str, session_id: str = DEFAULT_SESSION_ID, no_cache: bool = False):
+    """ نقطة وصول لبث الرد تدريجيًا (Server-Sent Events) مع الحالة العاطفية في الحدث الأول والأخير. """
+    if not await _wait_ready():
+        return _warming_up_response()
+    async def event_source():
+        async for event, data in engine.stream_message(user_prompt, session_id, use_cache=not no_cache):
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        # منع التخزين المؤقت والتجميع في الوسطاء حتى يصل كل جزء فور توليده
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/admission/stats")
+def admission_stats():
+    """ حالة طابور القبول: الطلبات الجارية والمنتظرة، الرفض حسب السبب، ومتوسط زمن الخدمة. """
+    if admission is None:
+        return {"enabled": False}
+    return {"enabled": True, **admission.stats()}
+
+@app.get("/llm/stats")
+def llm_stats():
+    """ حالة قاطع دائرة Gemini، عدادات طلبات التحوط والمهل، وزمن الاستدعاءات الأخيرة. """
+    return engine.llm_guard.stats()
+
+@app.get("/model")
+def model_stats():
+    """ إصدار النموذج الداخلي الحالي وحالة إعادة التدريب في الخلفية. """
+    if retrainer is None:
+        current = engine.internal_classifier
+        return {"retraining": False, "model_version": current.version if current is not None else None}
+    return {"retraining": True, **retrainer.stats()}
+
+@app.post("/model/retrain")
+async def model_retrain(x_admin_token: Optional[str] = Header(None)):
+    """
+    تشغيل دورة إعادة تدريب الآن (جمع + تدريب + تحقق + ترقية) دون انتظار الفاصل الزمني.
+    يلزم رمز المشرف: الدورة تشغل المعالج وقد تبدل النموذج الذي يخدم كل الجلسات.
+    """
+    if not _is_admin(x_admin_token):
+        return _forbidden_response("Triggering model retraining")
+    if retrainer is None:
+        return JSONResponse(status_code=404, content={"error": "Retraining is disabled (RETRAIN=0)."})
+    return await asyncio.to_thread(retrainer.run_once)
+
+@app.get("/cache/stats")
+def cache_stats():
+    """ إحصاءات ذاكرة الردود المؤقتة (إصابات وإخفاقات وحجم). """
+    if engine.response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **engine.response_cache.stats()}
+
+@app.get("/history")
+def get_history(session_id: Optional[str] = None, limit: int = 50, before_id: Optional[int] = None,
+                x_admin_token: Optional[str] = Header(None)):
+    """
+    سجل التفاعلات (الأحدث أولًا) بترقيم الصفحات: مرّر next_before_id كـ before_id للصفحة التالية.
+    بدون session_id (كل الجلسات) يلزم رمز المشرف.
+    """
+    if session_id is None and not _is_admin(x_admin_token):
+        return _forbidden_response("Reading history across sessions")
+    if state_store.interaction_log is None:
+        return {"enabled": False}
+    return state_store.interaction_log.history(session_id, limit, before_id)
+
+@app.get("/history/export")
+def export_history(session_id: Optional[str] = None, since: Optional[float] = None,
+                   x_admin_token: Optional[str] = Header(None)):
+    """
+    تصدير سجل التفاعلات بثًا بصيغة NDJSON (سطر JSON لكل تفاعل) دون تحميله كاملًا في الذاكرة.
+    بدون session_id (كل الجلسات) يلزم رمز المشرف.
+    """
+    if session_id is None and not _is_admin(x_admin_token):
+        return _forbidden_response("Exporting history across sessions")
+    if state_store.interaction_log is None:
+        return {"enabled": False}
+    rows = state_store.interaction_log.iter_export(session_id, since)
+    return StreamingResponse(
+        (json.dumps(row, ensure_ascii=False) + "\n" for row in rows),
+        media_type="application/x-ndjson"
+    )
+
+@app.get("/metrics")
+def metrics():
+    """ مقاييس الخدمة بصيغة Prometheus النصية (أزمنة المراحل، الطلبات، أخطاء Gemini، الذاكرة المؤقتة). """
+    return PlainTextResponse(Metrics.REGISTRY.render(), media_type=Metrics.CONTENT_TYPE)
+
+@app.get("/profile")
+def profile(limit: int = 50, collapsed: bool = False):
+    """ نتائج محلل الأداء بأخذ العينات (collapsed=true يعيد صيغة flamegraph النصية). """
+    if collapsed:
+        return PlainTextResponse(engine.profiler.collapsed())
+    return engine.profiler.report(limit)
+
+@app.post("/profile")
+def configure_profile(sample_rate: Optional[float] = None, interval: Optional[float] = None, reset: bool = False):
+    """ تفعيل محلل الأداء أو إيقافه أثناء التشغيل (sample_rate: نسبة الطلبات المعاينة، 0 للإيقاف). """
+    engine.profiler.configure(sample_rate, interval)
+    if reset:
+        engine.profiler.reset()
+    return {"sample_rate": engine.profiler.sample_rate, "interval": engine.profiler.interval}
+
 @app.get("/state")
-def get_state():
-    """ نقطة وصول للحصول على الحالة العاطفية الحالية. """
-    return engine.get_current_state()
+def get_state(session_id: str = DEFAULT_SESSION_ID):
+    """ نقطة وصول للحصول على الحالة العاطفية الحالية للجلسة. """
+    return engine.get_current_state(session_id)
 
 # @app.post("/reset")
 # def reset_state_endpoint():
@@ -0,0 +1,53 @@
+# benchmarks/common.py - أدوات مشتركة للقياسات: مسار المشروع، إحصاءات الزمن، وكتابة التقرير
+
+import contextlib
+import json
+import os
+import sys
+from typing import Dict, List, Optional, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# تشغيل القياسات كسكربتات (python benchmarks/micro.py) يتطلب وحدات المشروع على المسار
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def percentile(sorted_samples: Sequence[float], q: float) -> float:
+    """المئين q (0-100) بالاستيفاء الخطي من عينات مرتبة."""
+    if not sorted_samples:
+        return 0.0
+    position = (len(sorted_samples) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_samples) - 1)
+    fraction = position - lower
+    return sorted_samples[lower] + (sorted_samples[upper] - sorted_samples[lower]) * fraction
+
+
+def latency_summary(samples: List[float], elapsed: Optional[float] = None) -> Dict[str, float]:
+    """ملخص أزمنة بالثواني: p50/p95/p99 والمتوسط والأقصى والإنتاجية (عمليات في الثانية)."""
+    ordered = sorted(samples)
+    total = elapsed if elapsed is not None else sum(ordered)
+    return {
+        "count": len(ordered),
+        "throughput_per_s": len(ordered) / total if total > 0 else 0.0,
+        "mean_s": sum(ordered) / len(ordered) if ordered else 0.0,
+        "p50_s": percentile(ordered, 50),
+        "p95_s": percentile(ordered, 95),
+        "p99_s": percentile(ordered, 99),
+        "max_s": ordered[-1] if ordered else 0.0,
+    }
+
+
+def logs_to_stderr() -> contextlib.AbstractContextManager:
+    """تحويل طباعة المحرك (تحذير المحاكاة، أخطاء السجل...) إلى stderr حتى يبقى stdout تقرير JSON صالحًا فقط."""
+    return contextlib.redirect_stdout(sys.stderr)
+
+
+def write_report(report: dict, output: Optional[str]):
+    """طباعة التقرير بصيغة JSON (وحده على stdout) وكتابته إلى ملف عند الطلب (للمقارنة بين الإصدارات)."""
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
@@ -0,0 +1,123 @@
+# benchmarks/fake_gemini.py - بديل محلي لـ google.generativeai بزمن استجابة ونسبة فشل قابلين للضبط
+
+import asyncio
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Optional
+
+
+class FakeGeminiError(RuntimeError):
+    """فشل مُحقن يحاكي خطأ من خدمة Gemini."""
+
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _FakeStream:
+    """يحاكي استجابة generate_content_async(stream=True): أجزاء نصية بتأخير بينها."""
+
+    def __init__(self, chunks, delay: float):
+        self._chunks = chunks
+        self._delay = delay
+
+    async def __aiter__(self) -> AsyncIterator[_FakeResponse]:
+        for chunk in self._chunks:
+            await asyncio.sleep(self._delay)
+            yield _FakeResponse(chunk)
+
+
+class _FakeGenerativeModel:
+    """نفس واجهة GenerativeModel التي يستخدمها المحرك (المتزامنة وغير المتزامنة والبث)."""
+
+    client: "FakeGeminiClient"
+
+    def __init__(self, model_name: str = "fake-gemini", system_instruction: Optional[str] = None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    @classmethod
+    def from_cached_content(cls, cached_content: Any) -> "_FakeGenerativeModel":
+        return cls(cached_content.model, cached_content.system_instruction)
+
+    def _reply(self, contents) -> str:
+        # المحتوى قائمة نصوص، أو رسائل {"role", "parts"} عند وجود ذاكرة محادثة؛ الرسالة الحالية آخرها
+        last = contents[-1]
+        if isinstance(last, dict):
+            last = last["parts"][-1]
+        return f"رد تجريبي على: {last}"
+
+    def generate_content(self, contents, stream: bool = False):
+        self.client.calls += 1
+        time.sleep(self.client.sample_latency())
+        self.client.maybe_fail()
+        return _FakeResponse(self._reply(contents))
+
+    async def generate_content_async(self, contents, stream: bool = False):
+        self.client.calls += 1
+        latency = self.client.sample_latency()
+        if stream:
+            # زمن أول جزء نصف الزمن الكلي، والباقي موزع على الأجزاء
+            await asyncio.sleep(latency / 2)
+            self.client.maybe_fail()
+            words = self._reply(contents).split(" ")
+            chunks = [word if i == 0 else " " + word for i, word in enumerate(words)]
+            return _FakeStream(chunks, latency / 2 / max(1, len(chunks)))
+        await asyncio.sleep(latency)
+        self.client.maybe_fail()
+        return _FakeResponse(self._reply(contents))
+
+
+class FakeGeminiClient:
+    """
+    يحل محل وحدة genai في engine.llm_client حتى يعمل مسار LLM الحقيقي
+    (التنبؤ، PromptBuilder، SQLite، ذاكرة الردود) دون شبكة.
+    latency: متوسط زمن الاستجابة بالثواني؛ jitter: انحراف منتظم ± حوله؛ failure_rate: احتمال رفع خطأ.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, failure_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.GenerativeModel = type("GenerativeModel", (_FakeGenerativeModel,), {"client": self})
+        self.caching = SimpleNamespace(CachedContent=SimpleNamespace(create=self._create_cached_content))
+
+    def _create_cached_content(self, model: str, system_instruction: str, ttl: Any = None):
+        return SimpleNamespace(model=model, system_instruction=system_instruction, ttl=ttl)
+
+    def sample_latency(self) -> float:
+        with self._lock:
+            return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def maybe_fail(self):
+        with self._lock:
+            failed = self._rng.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+        if failed:
+            raise FakeGeminiError("injected failure")
+
+    def stats(self) -> dict:
+        return {
+            "latency_s": self.latency,
+            "jitter_s": self.jitter,
+            "failure_rate": self.failure_rate,
+            "calls": self.calls,
+            "injected_failures": self.failures,
+        }
+
+
+def install(engine: Any, client: FakeGeminiClient) -> FakeGeminiClient:
+    """ربط العميل الوهمي بالمحرك وتفعيل مسار LLM بدل وضع المحاكاة العشوائي."""
+    engine.llm_client = client
+    engine.is_simulated = False
+    return client
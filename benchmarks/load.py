@@ -0,0 +1,115 @@
+# benchmarks/load.py - مولّد حمل من طرف إلى طرف على تطبيق FastAPI مع Gemini وهمي (دون شبكة)
+#
+# يتطلب httpx (اعتمادية للقياس فقط): pip install httpx
+
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from common import ROOT, latency_summary, logs_to_stderr, write_report
+from fake_gemini import FakeGeminiClient, install
+
+
+async def run_load(app, endpoint: str, total: int, concurrency: int, sessions: int,
+                   timeout: float) -> Dict[str, object]:
+    """يرسل total طلبًا بحد أقصى concurrency طلب متزامن موزعة على sessions جلسة."""
+    import httpx
+
+    latencies: List[float] = []
+    status_counts: Dict[str, int] = {}
+    errors = 0
+    next_request = 0
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as client:
+
+        async def worker():
+            nonlocal next_request, errors
+            while next_request < total:
+                index = next_request
+                next_request += 1
+                params = {"user_prompt": f"رسالة رقم {index}", "session_id": f"session-{index % sessions}"}
+                start = time.perf_counter()
+                try:
+                    if endpoint == "stream":
+                        # الزمن حتى اكتمال البث (آخر حدث)
+                        async with client.stream("GET", "/chat/stream", params=params) as response:
+                            async for _ in response.aiter_bytes():
+                                pass
+                    else:
+                        response = await client.post("/chat", params=params)
+                    status = str(response.status_code)
+                except Exception:
+                    errors += 1
+                    status = "exception"
+                latencies.append(time.perf_counter() - start)
+                status_counts[status] = status_counts.get(status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "elapsed_s": elapsed,
+        "latency": latency_summary(latencies, elapsed),
+        "status_counts": status_counts,
+        "transport_errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of the chat API with a fake Gemini client.")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--endpoint", choices=("chat", "stream"), default="chat")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake Gemini mean latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="fake Gemini latency jitter (s, uniform ±)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of fake Gemini calls that raise")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=60.0, help="client-side timeout per request (s)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    os.environ.setdefault("INTERNAL_MODEL_PATH", os.path.join(ROOT, "models", "emotion_forest"))
+    workdir = tempfile.mkdtemp(prefix="emotion-bench-")
+    # قاعدة بيانات مؤقتة حتى لا يلمس القياس emotions.db الحقيقية
+    os.chdir(workdir)
+    os.environ.setdefault("SIMULATED_STREAM_DELAY", "0")
+
+    # طباعة المحرك (تحذير المحاكاة وغيره) إلى stderr حتى يبقى stdout للتقرير وحده
+    with logs_to_stderr():
+        import app as app_module
+
+        app_module.engine.warm_up()
+        fake = install(app_module.engine, FakeGeminiClient(args.latency, args.jitter, args.failure_rate, args.seed))
+        try:
+            result = asyncio.run(run_load(
+                app_module.app, args.endpoint, args.requests, args.concurrency, args.sessions, args.timeout
+            ))
+        finally:
+            app_module.state_store.close()
+            os.chdir(ROOT)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    write_report({
+        "benchmark": "load",
+        "python": sys.version.split()[0],
+        "endpoint": args.endpoint,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "sessions": args.sessions,
+        "response_cache": os.environ.get("RESPONSE_CACHE", "off"),
+        "fake_gemini": fake.stats(),
+        **result,
+    }, output)
+
+
+if __name__ == "__main__":
+    main()
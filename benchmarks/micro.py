@@ -0,0 +1,100 @@
+# benchmarks/micro.py - قياسات دقيقة لأجزاء مسار الطلب: Lambda، التنبؤ والتحديث، بناء المطالبة، وحفظ/تحميل الحالة
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from common import ROOT, latency_summary, logs_to_stderr, write_report
+
+
+def measure(fn: Callable[[int], object], iterations: int, warmup: int) -> Dict[str, float]:
+    """يقيس كل استدعاء على حدة (perf_counter) بعد عدد من استدعاءات الإحماء؛ fn تستقبل رقم التكرار (متتاليًا عبر الإحماء والقياس)."""
+    for i in range(warmup):
+        fn(i)
+    samples: List[float] = []
+    for i in range(warmup, warmup + iterations):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return latency_summary(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the chat request path.")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--write-behind", action="store_true", help="measure save_state with EMOTION_WRITE_BEHIND=1")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    os.environ["RESPONSE_CACHE"] = "off"
+    os.environ.setdefault("INTERNAL_MODEL_PATH", os.path.join(ROOT, "models", "emotion_forest"))
+    os.environ["INTERACTION_LOG"] = "0"
+    os.environ["EMOTION_WRITE_BEHIND"] = "1" if args.write_behind else "0"
+
+    from EmotionalProcessorV4 import EmotionalEngine, INTERNAL_MODEL_PATH
+    from EmotionVector import EmotionVector
+    from PromptBuilder import PromptBuilder
+    from StateStore import SessionStateStore
+
+    rng = np.random.default_rng(args.seed)
+    results: Dict[str, Dict[str, float]] = {}
+
+    # قاعدة بيانات مؤقتة حتى لا يلمس القياس emotions.db الحقيقية، وطباعة المحرك إلى stderr
+    with tempfile.TemporaryDirectory() as workdir, logs_to_stderr():
+        state_store = SessionStateStore(os.path.join(workdir, "emotions.db"))
+        engine = EmotionalEngine(state_store=state_store, warm_up=False)
+        engine.warm_up()
+        session = state_store.get("bench")
+
+        # حالات عشوائية مسبقة التوليد حتى لا يدخل توليدها في الزمن المقاس
+        states = [
+            EmotionVector.from_dict({key: float(v) for key, v in zip(session.state, rng.random(len(session.state)))})
+            for _ in range(256)
+        ]
+        state_dicts = [state.to_dict() for state in states]
+
+        results["calculate_lambda_dict"] = measure(
+            lambda i: engine._calculate_lambda(state_dicts[i % 256]), args.iterations, args.warmup)
+        results["calculate_lambda_vector"] = measure(
+            lambda i: engine._calculate_lambda(states[i % 256]), args.iterations, args.warmup)
+        results["predict_and_update_state"] = measure(
+            lambda i: engine._predict_and_update_state("benchmark", session), args.iterations, args.warmup)
+
+        lambdas = [state.lambda_value() for state in states]
+        results["build_system_prompt_repeat"] = measure(
+            lambda i: PromptBuilder.build_system_prompt(states[0], lambdas[0]), args.iterations, args.warmup)
+        # حالات مختلفة بدقة العرض في كل استدعاء حتى لا تصيب ذاكرة اللاحقة (أسوأ حالة)
+        varied = [
+            {key: value + i * 1e-2 for key, value in state_dicts[i % 256].items()}
+            for i in range(args.iterations + args.warmup)
+        ]
+        results["build_system_prompt_varied"] = measure(
+            lambda i: PromptBuilder.build_system_prompt(varied[i], lambdas[i % 256]),
+            args.iterations, args.warmup)
+
+        results["save_state"] = measure(
+            lambda i: session.save_state(state_dicts[i % 256]), args.iterations, args.warmup)
+        results["load_state"] = measure(lambda i: session.load_state(), args.iterations, args.warmup)
+
+        state_store.close()
+
+    write_report({
+        "benchmark": "micro",
+        "python": sys.version.split()[0],
+        "iterations": args.iterations,
+        "write_behind": args.write_behind,
+        "compiled_forest": engine.internal_classifier is not None,
+        "model_artifact": os.path.isdir(INTERNAL_MODEL_PATH),
+        "results": results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
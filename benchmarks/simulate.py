@@ -0,0 +1,56 @@
+# benchmarks/simulate.py - تشغيل المحاكي المتجهي (N جلسة × T خطوة) وطباعة توزيع Lambda وإشغال النطاقات
+
+import argparse
+import os
+import sys
+import time
+
+from common import ROOT, logs_to_stderr, write_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorised offline simulation of emotional-state dynamics.")
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--mode", choices=("classifier", "random_walk"), default="classifier")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform ± noise on the initial states")
+    parser.add_argument("--update-magnitude", type=float, help="override EmotionalEngine.update_magnitude")
+    parser.add_argument("--lambda-scale", type=float, help="override the sigmoid scale (default 4.0)")
+    parser.add_argument("--bins", type=int, default=20)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    os.environ.setdefault("INTERNAL_MODEL_PATH", os.path.join(ROOT, "models", "emotion_forest"))
+    from EmotionalProcessorV4 import EmotionalEngine
+    from Simulator import EmotionSimulator
+
+    # المحرك بلا مخزن حالات: نحتاج النموذج الداخلي ومعاملاته فقط (طباعته إلى stderr لا تختلط بالتقرير)
+    with logs_to_stderr():
+        engine = EmotionalEngine(state_store=None, warm_up=False)
+        engine.warm_up()
+
+    overrides = {}
+    if args.update_magnitude is not None:
+        overrides["update_magnitude"] = args.update_magnitude
+    if args.lambda_scale is not None:
+        overrides["lambda_scale"] = args.lambda_scale
+    simulator = EmotionSimulator.from_engine(engine, seed=args.seed, **overrides)
+
+    start = time.perf_counter()
+    result = simulator.run(args.sessions, args.steps, args.mode, jitter=args.jitter, record_trajectories=False)
+    elapsed = time.perf_counter() - start
+
+    write_report({
+        "benchmark": "simulate",
+        "python": sys.version.split()[0],
+        "mode": args.mode,
+        "seed": args.seed,
+        "elapsed_s": elapsed,
+        "session_steps_per_s": args.sessions * args.steps / elapsed if elapsed > 0 else 0.0,
+        **result.summary(args.bins),
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# benchmarks/startup.py - قياس زمن بدء التشغيل البارد (الاستيراد + التهيئة + الإحماء) في عمليات جديدة
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# يُنفَّذ في عملية Python جديدة لكل تكرار حتى لا تؤثر ذاكرة الاستيراد المؤقتة على القياس
+CHILD = """
+import json, time
+t0 = time.perf_counter()
+import EmotionalProcessorV4
+t1 = time.perf_counter()
+import app
+t2 = time.perf_counter()
+app.engine.warm_up()
+t3 = time.perf_counter()
+print(json.dumps({
+    "import_engine_s": t1 - t0,
+    "import_app_s": t2 - t1,
+    "warm_up_s": t3 - t2,
+    "total_s": t3 - t0,
+}))
+"""
+
+
+def run_once(model_path: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    env["INTERNAL_MODEL_PATH"] = model_path
+    with tempfile.TemporaryDirectory() as workdir:
+        # قاعدة بيانات مؤقتة حتى لا يلمس القياس emotions.db الحقيقية
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD], cwd=workdir, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import and initialisation cost.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--model-path", default=os.path.join(ROOT, "models", "emotion_forest"),
+                        help="internal model artifact (a missing path measures inline training)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    runs = [run_once(args.model_path) for _ in range(args.repeat)]
+    report = {
+        "benchmark": "startup",
+        "python": sys.version.split()[0],
+        "model_artifact": os.path.isdir(args.model_path),
+        "repeat": args.repeat,
+        "phases": {
+            phase: {
+                "median_s": statistics.median(run[phase] for run in runs),
+                "min_s": min(run[phase] for run in runs),
+                "max_s": max(run[phase] for run in runs),
+            }
+            for phase in runs[0]
+        },
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
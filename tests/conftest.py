@@ -0,0 +1,6 @@
+# tests/conftest.py - الوحدات في جذر المستودع (بلا حزمة)، فنضيفه إلى مسار الاستيراد
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
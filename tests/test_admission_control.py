@@ -0,0 +1,201 @@
+# tests/test_admission_control.py - القبول: التناوب بين الجلسات، مواعيد العملاء، وتخفيف الحمل (429/504 مع Retry-After)
+
+import asyncio
+
+import pytest
+
+from AdmissionControl import AdmissionController, AdmissionRejected
+
+
+def _controller(**kwargs):
+    kwargs.setdefault("max_concurrency", 1)
+    kwargs.setdefault("max_queue", 16)
+    kwargs.setdefault("max_session_queue", 8)
+    kwargs.setdefault("max_wait", 5.0)
+    kwargs.setdefault("min_remaining", 0.0)
+    return AdmissionController(**kwargs)
+
+
+async def _occupy(controller, session_id="holder"):
+    """يشغل مكانًا حتى يُضبط الحدث المعاد."""
+    release = asyncio.Event()
+
+    async def hold():
+        async with controller.slot(session_id, 30.0):
+            await release.wait()
+
+    task = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    assert controller.active == 1
+    return release, task
+
+
+async def _enqueue(controller, session_id, order, name, timeout=30.0):
+    """طلب يسجل اسمه عند قبوله؛ asyncio.sleep(0) يضمن دخوله الطابور قبل الطلب التالي."""
+    async def request():
+        async with controller.slot(session_id, timeout):
+            order.append(name)
+
+    task = asyncio.create_task(request())
+    await asyncio.sleep(0)
+    return task
+
+
+def test_sessions_are_served_round_robin():
+    async def run():
+        controller = _controller()
+        release, holder = await _occupy(controller)
+        order = []
+        tasks = [await _enqueue(controller, "a", order, name) for name in ("a1", "a2", "a3")]
+        tasks.append(await _enqueue(controller, "b", order, "b1"))
+        assert controller.queued == 4
+        release.set()
+        await asyncio.gather(holder, *tasks)
+        return order, controller
+
+    order, controller = asyncio.run(run())
+    # الجلسة b لا تنتظر خلف كل طلبات a
+    assert order == ["a1", "b1", "a2", "a3"]
+    assert controller.active == 0 and controller.queued == 0
+    assert controller.admitted == 5
+
+
+def test_remaining_deadline_shrinks_while_queued():
+    async def run():
+        controller = _controller()
+        release, holder = await _occupy(controller)
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.1, release.set)
+        async with controller.slot("a", 1.0) as remaining:
+            pass
+        await holder
+        return remaining
+
+    remaining = asyncio.run(run())
+    assert 0.8 < remaining < 0.95
+
+
+def test_expired_deadline_is_rejected_with_504():
+    async def run():
+        controller = _controller(min_remaining=0.5)
+        with pytest.raises(AdmissionRejected) as info:
+            async with controller.slot("a", 0.2):
+                pass
+        return info.value, controller
+
+    rejected, controller = asyncio.run(run())
+    assert rejected.reason == "deadline_expired"
+    assert rejected.status_code == 504
+    assert controller.active == 0
+
+
+def test_deadline_expiring_in_queue_never_reaches_engine():
+    async def run():
+        controller = _controller()
+        release, holder = await _occupy(controller)
+        order = []
+        task = await _enqueue(controller, "a", order, "late", timeout=0.05)
+        with pytest.raises(AdmissionRejected) as info:
+            await task
+        release.set()
+        await holder
+        return info.value, order, controller
+
+    rejected, order, controller = asyncio.run(run())
+    assert rejected.reason == "deadline_expired" and rejected.status_code == 504
+    assert order == []
+    assert controller.queued == 0 and controller.rejected == {"deadline_expired": 1}
+
+
+def test_full_queue_sheds_with_retry_after():
+    async def run():
+        controller = _controller(max_queue=1)
+        release, holder = await _occupy(controller)
+        order = []
+        queued = await _enqueue(controller, "a", order, "a1")
+        with pytest.raises(AdmissionRejected) as info:
+            async with controller.slot("b", 30.0):
+                pass
+        release.set()
+        await asyncio.gather(holder, queued)
+        return info.value, order
+
+    rejected, order = asyncio.run(run())
+    assert rejected.reason == "queue_full"
+    assert rejected.status_code == 429 and rejected.retry_after >= 1
+    assert order == ["a1"]
+
+
+def test_session_queue_limit_leaves_other_sessions_queueing():
+    async def run():
+        controller = _controller(max_session_queue=1)
+        release, holder = await _occupy(controller)
+        order = []
+        tasks = [await _enqueue(controller, "a", order, "a1")]
+        with pytest.raises(AdmissionRejected) as info:
+            async with controller.slot("a", 30.0):
+                pass
+        tasks.append(await _enqueue(controller, "b", order, "b1"))
+        release.set()
+        await asyncio.gather(holder, *tasks)
+        return info.value, order
+
+    rejected, order = asyncio.run(run())
+    assert rejected.reason == "session_queue_full" and rejected.status_code == 429
+    assert order == ["a1", "b1"]
+
+
+def test_expected_wait_beyond_max_wait_is_shed_early():
+    async def run():
+        controller = _controller(max_wait=1.0)
+        controller.service_time = 10.0
+        release, holder = await _occupy(controller)
+        with pytest.raises(AdmissionRejected) as info:
+            async with controller.slot("a", 30.0):
+                pass
+        queued = controller.queued
+        release.set()
+        await holder
+        return info.value, queued
+
+    rejected, queued = asyncio.run(run())
+    # الانتظار المتوقع (موضع واحد × 10 ثوانٍ / مكان واحد) يتجاوز max_wait: رفض فوري دون دخول الطابور
+    assert rejected.reason == "overloaded"
+    assert rejected.retry_after == 10
+    assert queued == 0
+
+
+def test_wait_longer_than_max_wait_times_out():
+    async def run():
+        controller = _controller(max_wait=0.05)
+        release, holder = await _occupy(controller)
+        with pytest.raises(AdmissionRejected) as info:
+            async with controller.slot("a", 30.0):
+                pass
+        stats = controller.stats()
+        release.set()
+        await holder
+        return info.value, stats
+
+    rejected, stats = asyncio.run(run())
+    assert rejected.reason == "queue_timeout" and rejected.status_code == 429
+    assert stats["queued"] == 0 and stats["sessions_waiting"] == 0
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def run():
+        controller = _controller()
+        release, holder = await _occupy(controller)
+        order = []
+        task = await _enqueue(controller, "a", order, "gone")
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        queued = controller.queued
+        release.set()
+        await holder
+        return queued, order, controller
+
+    queued, order, controller = asyncio.run(run())
+    assert queued == 0 and order == []
+    assert controller.active == 0
@@ -0,0 +1,79 @@
+# tests/test_compiled_forest.py - تطابق CompiledForest مع RandomForestClassifier (الدفعي، الاحتمالات، والصف الواحد)
+
+import numpy as np
+import pytest
+
+sklearn_ensemble = pytest.importorskip("sklearn.ensemble")
+
+from CompiledForest import CompiledForest
+
+
+def _forest(n_estimators, max_depth=None, n_samples=300, seed=0):
+    """غابة على ميزات (joy, fear, calm) في [0, 1] بثلاث فئات كما في المحرك."""
+    rng = np.random.default_rng(seed)
+    X = rng.uniform(0.0, 1.0, size=(n_samples, 3))
+    y = rng.integers(0, 3, size=n_samples)
+    model = sklearn_ensemble.RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, random_state=seed)
+    model.fit(X, y)
+    return model
+
+
+def _threshold_rows(model, rng, limit=400):
+    """صفوف تقع فيها ميزة واحدة على عتبة انقسام تمامًا (حالة <= الحدية)."""
+    rows = []
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        for node in np.flatnonzero(tree.children_left != -1):
+            row = rng.uniform(0.0, 1.0, size=3)
+            row[tree.feature[node]] = tree.threshold[node]
+            rows.append(row)
+    rows = np.asarray(rows)
+    return rows[rng.permutation(len(rows))[:limit]]
+
+
+def _assert_parity(model, compiled, X):
+    np.testing.assert_array_equal(compiled.predict(X), model.predict(X))
+    np.testing.assert_allclose(compiled.predict_proba(X), model.predict_proba(X), rtol=0, atol=1e-12)
+    expected = model.predict(X)
+    assert [compiled.predict_one(row) for row in X] == expected.tolist()
+
+
+@pytest.mark.parametrize("n_estimators,max_depth", [
+    (10, None),   # نموذج العرض في _train_internal_model
+    (50, None),   # غابة أعمق مثل التي يدربها Retrainer على آلاف العينات
+    (5, 3),
+])
+def test_matches_sklearn_on_random_inputs(n_estimators, max_depth):
+    model = _forest(n_estimators, max_depth, n_samples=2000 if n_estimators >= 50 else 300)
+    compiled = CompiledForest.from_sklearn(model)
+    X = np.random.default_rng(1).uniform(-0.1, 1.1, size=(500, 3))
+    _assert_parity(model, compiled, X)
+
+
+def test_matches_sklearn_on_exact_thresholds():
+    model = _forest(20, n_samples=1000)
+    compiled = CompiledForest.from_sklearn(model)
+    X = _threshold_rows(model, np.random.default_rng(2))
+    assert len(X) > 0
+    _assert_parity(model, compiled, X)
+
+
+def test_saved_artifact_matches_sklearn(tmp_path):
+    """مسار الإنتاج: الملف المحفوظ يُحمَّل بـ mmap دون نموذج sklearn، فيجب أن يبقى مطابقًا."""
+    model = _forest(50, n_samples=2000)
+    path = str(tmp_path / "forest")
+    CompiledForest.from_sklearn(model).save(path, ["joy", "fear", "calm"], "test")
+    loaded = CompiledForest.load(path, expected_features=["joy", "fear", "calm"])
+    assert loaded.version == "test"
+
+    rng = np.random.default_rng(3)
+    X = np.vstack([rng.uniform(0.0, 1.0, size=(300, 3)), _threshold_rows(model, rng, limit=200)])
+    _assert_parity(model, loaded, X)
+    assert loaded.matches(model, X)
+
+
+def test_load_rejects_mismatched_features(tmp_path):
+    path = str(tmp_path / "forest")
+    CompiledForest.from_sklearn(_forest(3)).save(path, ["joy", "fear", "calm"], "test")
+    with pytest.raises(ValueError):
+        CompiledForest.load(path, expected_features=["joy", "fear"])
@@ -0,0 +1,127 @@
+# tests/test_conversation_memory.py - ميزانية الرموز، الملخص المتدحرج، وإعادة البناء من سجل التفاعلات
+
+import pytest
+
+from ConversationMemory import ConversationMemory
+from InteractionLog import InteractionLog
+
+
+@pytest.fixture
+def log(tmp_path):
+    interaction_log = InteractionLog(str(tmp_path / "log.db"), flush_interval=0.01)
+    yield interaction_log
+    interaction_log.close()
+
+
+def _memory(interaction_log=None, **kwargs):
+    kwargs.setdefault("recent_turns", 3)
+    kwargs.setdefault("token_budget", 1000)
+    kwargs.setdefault("summary_tokens", 1000)
+    kwargs.setdefault("chars_per_token", 1.0)
+    kwargs.setdefault("revalidate_interval", -1)
+    return ConversationMemory(interaction_log, **kwargs)
+
+
+def _log_turn(interaction_log, session_id, prompt, response, in_context=True):
+    interaction_log.record(session_id, {"prompt": prompt, "response": response, "in_context": in_context})
+
+
+def _history(contents):
+    """الدورات (المطالبة، الرد) المرسلة قبل الرسالة الحالية."""
+    pairs = [message["parts"][0] for message in contents[:-1]]
+    return list(zip(pairs[::2], pairs[1::2]))
+
+
+def test_without_history_keeps_plain_contents():
+    memory = _memory()
+    assert memory.build_contents("s", "hello", prefix_parts=["suffix"]) == ["suffix", "hello"]
+
+
+def test_recent_turns_are_sent_and_older_ones_summarised():
+    memory = _memory()
+    memory.load("s")
+    for i in range(5):
+        memory.record("s", f"p{i}", f"r{i}")
+
+    contents = memory.build_contents("s", "now")
+    assert _history(contents) == [("p2", "r2"), ("p3", "r3"), ("p4", "r4")]
+    final = contents[-1]["parts"]
+    assert final[-1] == "now"
+    assert "p0" in final[0] and "p1" in final[0] and "p2" not in final[0]
+
+
+def test_budget_drops_oldest_turns_first():
+    memory = _memory(recent_turns=5, token_budget=30)
+    memory.load("s")
+    for i in range(5):
+        memory.record("s", f"prompt{i}", f"reply{i}")  # 13 رمزًا لكل دورة (حرف = رمز)
+
+    contents = memory.build_contents("s", "now", reserved_tokens=0)
+    assert _history(contents) == [("prompt3", "reply3"), ("prompt4", "reply4")]
+    used = sum(memory.tokens(part) for message in contents for part in message["parts"])
+    assert used <= 30
+
+
+def test_summary_is_trimmed_to_its_budget():
+    memory = _memory(recent_turns=1, summary_tokens=120)
+    memory.load("s")
+    for i in range(20):
+        memory.record("s", f"prompt number {i}", f"reply number {i}")
+    summary = memory.load("s").summary
+    assert memory.tokens(summary) <= 120
+    assert "prompt number 18" in summary and "prompt number 0 " not in summary
+
+
+def test_record_ignores_sessions_not_loaded(log):
+    memory = _memory(log)
+    memory.record("s", "p", "r")
+    assert not memory.cached("s")
+
+
+def test_rebuild_skips_turns_kept_out_of_context(log):
+    _log_turn(log, "s", "first", "ok")
+    _log_turn(log, "s", "second", "عذرًا، فشل الاتصال بخدمة Gemini API", in_context=False)
+    _log_turn(log, "s", "third", "fine")
+    log.flush()
+
+    memory = _memory(log)
+    assert _history(memory.build_contents("s", "now")) == [("first", "ok"), ("third", "fine")]
+
+
+def test_failed_turn_stays_out_after_forget(log):
+    memory = _memory(log)
+    memory.load("s")
+    for prompt, response, ok in (("first", "ok", True), ("second", "error", False)):
+        memory.record("s", prompt, response, remember=ok)
+        _log_turn(log, "s", prompt, response, in_context=ok)
+    log.flush()
+    before = _history(memory.build_contents("s", "now"))
+
+    memory.forget("s")
+    assert _history(memory.build_contents("s", "now")) == before == [("first", "ok")]
+
+
+def test_revalidation_picks_up_turns_from_another_worker(log):
+    mine = _memory(log, revalidate_interval=0)
+    other = _memory(log, revalidate_interval=0)
+
+    for memory, prompt in ((mine, "a"), (other, "b"), (mine, "c")):
+        memory.build_contents("s", prompt)
+        memory.record("s", prompt, prompt.upper())
+        _log_turn(log, "s", prompt, prompt.upper())
+        log.flush()
+
+    assert _history(mine.build_contents("s", "now")) == [("a", "A"), ("b", "B"), ("c", "C")]
+    assert _history(other.build_contents("s", "now")) == [("a", "A"), ("b", "B"), ("c", "C")]
+
+
+def test_own_turns_do_not_trigger_rebuild(log):
+    memory = _memory(log, revalidate_interval=0)
+    memory.load("s")
+    session = memory.load("s")
+    for prompt in ("a", "b"):
+        memory.record("s", prompt, prompt.upper())
+        _log_turn(log, "s", prompt, prompt.upper())
+    log.flush()
+    assert memory.load("s") is session
+    assert session.unsynced == 0 and session.last_id > 0
@@ -0,0 +1,137 @@
+# tests/test_llm_resilience.py - قاطع الدائرة وحساب تجاوز الوقت في LLMGuard (الميزانية وموعد الطلب)
+
+import asyncio
+import time
+
+import pytest
+
+from LLMResilience import CircuitBreaker, LLMGuard, LLMUnavailable
+
+
+def _guard(**kwargs):
+    kwargs.setdefault("budget", 5.0)
+    kwargs.setdefault("hedge", False)
+    kwargs.setdefault("failure_threshold", 2)
+    kwargs.setdefault("reset_timeout", 30.0)
+    kwargs.setdefault("deadline_margin", 0.05)
+    return LLMGuard(**kwargs)
+
+
+def _slow(seconds):
+    return lambda: asyncio.sleep(seconds, result="late")
+
+
+def test_breaker_opens_after_threshold_and_rejects():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30.0)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+
+def test_breaker_half_open_allows_single_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # استدعاء تجريبي واحد فقط في الوقت نفسه
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.01)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_released_probe_frees_slot_without_verdict():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_budget_overrun_counts_as_timeout_failure():
+    guard = _guard(budget=0.05)
+    with pytest.raises(LLMUnavailable) as info:
+        asyncio.run(guard.call_async(_slow(1.0)))
+    assert info.value.reason == "timeout"
+    assert guard.timeouts == 1
+    assert guard.breaker.failures == 1
+
+
+def test_request_deadline_shortens_budget():
+    guard = _guard()
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        with pytest.raises(LLMUnavailable) as info:
+            await guard.call_async(_slow(1.0), deadline=start + 0.15)
+        return info.value, loop.time() - start
+
+    error, elapsed = asyncio.run(run())
+    assert error.reason == "timeout"
+    # ينتهي قبل الموعد بالهامش، لا بعد ميزانية الخمس ثوانٍ
+    assert elapsed < 0.15
+    assert guard.timeouts == 1
+
+
+def test_expired_deadline_skips_call_without_failure():
+    guard = _guard()
+    calls = []
+
+    async def run():
+        deadline = asyncio.get_running_loop().time() + 0.01
+        with pytest.raises(LLMUnavailable) as info:
+            await guard.call_async(lambda: calls.append(1), deadline=deadline)
+        return info.value
+
+    assert asyncio.run(run()).reason == "deadline"
+    assert calls == []
+    assert guard.timeouts == 0 and guard.breaker.failures == 0
+
+
+def test_external_cancellation_counts_as_timeout():
+    guard = _guard(failure_threshold=2)
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(guard.call_async(_slow(1.0)), timeout=0.05)
+
+    asyncio.run(run())
+    # خادم معلق يفتح القاطع حتى لو ألغت مهلة خارجية الاستدعاء قبل الميزانية
+    assert guard.timeouts == 2
+    assert guard.breaker.state == "open"
+    with pytest.raises(LLMUnavailable) as info:
+        asyncio.run(guard.call_async(_slow(0)))
+    assert info.value.reason == "circuit_open"
+
+
+def test_success_resets_failures():
+    guard = _guard(failure_threshold=3)
+    guard.breaker.record_failure()
+    assert asyncio.run(guard.call_async(_slow(0))) == "late"
+    assert guard.breaker.failures == 0
+
+
+def test_sync_call_respects_deadline():
+    guard = _guard(sync_workers=2)
+    with pytest.raises(LLMUnavailable) as info:
+        guard.call(lambda: time.sleep(0.5), deadline=time.monotonic() + 0.1)
+    assert info.value.reason == "timeout"
+    assert guard.timeouts == 1
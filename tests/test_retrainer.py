@@ -0,0 +1,101 @@
+# tests/test_retrainer.py - إعادة التدريب من سجل التفاعلات: الفئة قابلة للتعلم من الميزات والمرقّى يتفوق على الأساس
+
+import numpy as np
+import pytest
+
+pytest.importorskip("sklearn.ensemble")
+
+from EmotionalProcessorV4 import EmotionalEngine
+from EmotionVector import EmotionVector
+from InteractionLog import InteractionLog
+from PromptLexicon import NEGATIVE_WORDS, POSITIVE_WORDS, prompt_tone
+from Retrainer import ModelRetrainer, label_prompt
+
+FILLER = ("today", "I", "feel", "really", "the", "اليوم", "أنا", "جدا")
+
+
+def _prompt(rng):
+    """رسالة من كلمات عشوائية: دالة من الاتجاهين أو من أحدهما، مع كلمات محايدة."""
+    words = list(rng.choice(FILLER, size=rng.integers(1, 4)))
+    words += list(rng.choice(sorted(POSITIVE_WORDS), size=rng.integers(0, 3)))
+    words += list(rng.choice(sorted(NEGATIVE_WORDS), size=rng.integers(0, 3)))
+    rng.shuffle(words)
+    return " ".join(words)
+
+
+def _rows(n, seed):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for _ in range(n):
+        joy, fear, calm = rng.uniform(0.0, 1.0, size=3)
+        rows.append({"prompt": _prompt(rng), "response": "ok",
+                     "state_before": {"joy": joy, "fear": fear, "calm": calm}})
+    return rows
+
+
+def _engine():
+    # بلا نموذج: التنبؤ العشوائي الاحتياطي هو "النموذج الحالي"
+    return EmotionalEngine(state_store=None, warm_up=False)
+
+
+def _retrainer(engine, log, tmp_path):
+    return ModelRetrainer(engine, str(tmp_path / "log.db"), log, min_samples=200, min_new_samples=200,
+                          holdout=0.2, min_accuracy=0.6, margin=0.01, n_estimators=20,
+                          model_dir=str(tmp_path / "models"), executor="thread")
+
+
+@pytest.fixture
+def log(tmp_path):
+    interaction_log = InteractionLog(str(tmp_path / "log.db"), flush_interval=0.01)
+    yield interaction_log
+    interaction_log.close()
+
+
+def test_promoted_model_beats_majority_baseline(log, tmp_path):
+    engine = _engine()
+    retrainer = _retrainer(engine, log, tmp_path)
+    for row in _rows(1200, seed=0):
+        log.record("s", row)
+    log.flush()
+
+    report = retrainer.run_once()
+    retrainer.stop()
+    assert report["outcome"] == "promoted"
+
+    # عينات جديدة لم يرها التدريب، بنفس ميزات collect()
+    fresh = [row for row in _rows(600, seed=1) if label_prompt(row) is not None]
+    X = np.array([[row["state_before"][key] for key in engine.emotions_features] + [prompt_tone(row["prompt"])]
+                  for row in fresh])
+    y = np.array([label_prompt(row) for row in fresh])
+    accuracy = float(np.mean(engine.predict_emotion_classes(X) == y))
+    baseline = float(np.bincount(y).max() / len(y))
+    assert accuracy > baseline + 0.2
+
+
+def test_prediction_follows_prompt_tone(log, tmp_path):
+    engine = _engine()
+    retrainer = _retrainer(engine, log, tmp_path)
+    for row in _rows(1200, seed=2):
+        log.record("s", row)
+    log.flush()
+    assert retrainer.run_once()["outcome"] == "promoted"
+    retrainer.stop()
+
+    # نفس الحالة، رسالتان متعاكستان: الفرح يتحرك في اتجاه الرسالة
+    state = EmotionVector.from_dict({"joy": 0.5, "fear": 0.5, "calm": 0.5})
+    happy = engine._predict_next_state(state, prompt_tone("I am happy and proud"))
+    sad = engine._predict_next_state(state, prompt_tone("I feel sad and lonely"))
+    assert happy.get("joy") > 0.5 > sad.get("joy")
+
+
+def test_collect_skips_unlabelled_rows(log, tmp_path):
+    engine = _engine()
+    retrainer = _retrainer(engine, log, tmp_path)
+    before = {"joy": 0.2, "fear": 0.7, "calm": 0.4}
+    log.record("s", {"prompt": "what time is it", "state_before": before})
+    log.record("s", {"prompt": "thanks, that is great", "state_before": before})
+    log.flush()
+
+    assert retrainer.collect() == 1
+    np.testing.assert_allclose(retrainer._X, [[0.2, 0.7, 0.4, 1.0]])
+    assert retrainer._y.tolist() == [1]
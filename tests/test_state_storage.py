@@ -0,0 +1,106 @@
+# tests/test_state_storage.py - الحالة المشتركة بين العمال (مقارنة الإصدار وتبديله) والكتابة المؤجلة
+
+import threading
+
+import pytest
+
+from EmotionalState import EmotionalState, StateConflictError, StateStorage
+
+
+def _worker(db_path, **kwargs):
+    """عامل مستقل: اتصال تخزين خاص به على نفس ملف القاعدة (كما في uvicorn --workers N)."""
+    kwargs.setdefault("shared", True)
+    return StateStorage(db_path, write_behind=False, **kwargs)
+
+
+def _bump_joy(amount):
+    def mutate(state):
+        state.merge({"joy": state.to_dict()["joy"] + amount})
+        return state
+    return mutate
+
+
+def test_update_retries_on_latest_state(tmp_path):
+    db_path = str(tmp_path / "state.db")
+    session = EmotionalState(db_path, storage=_worker(db_path), session_id="s")
+    rival = EmotionalState(db_path, storage=_worker(db_path), session_id="s")
+    base = session.state["joy"]
+    seen = []
+
+    def mutate(state):
+        seen.append(state.to_dict()["joy"])
+        if len(seen) == 1:
+            # عامل آخر يحفظ بين القراءة والحفظ: المحاولة الأولى تتعارض
+            rival.update_state(_bump_joy(0.1))
+        return _bump_joy(0.2)(state)
+
+    session.update_state(mutate)
+    # المحاولة الثانية حُسبت على حالة العامل الآخر، فلم يضع تحديثه
+    assert seen == [pytest.approx(base), pytest.approx(base + 0.1)]
+    assert session.state["joy"] == pytest.approx(base + 0.3)
+    assert rival.refresh() is True
+    assert rival.state["joy"] == pytest.approx(base + 0.3)
+
+
+def test_try_save_rejects_stale_version(tmp_path):
+    db_path = str(tmp_path / "state.db")
+    first = EmotionalState(db_path, storage=_worker(db_path), session_id="s")
+    second = EmotionalState(db_path, storage=_worker(db_path), session_id="s")
+
+    assert first.try_save(_bump_joy(0.1)(first.vector.copy()))
+    assert not second.try_save(_bump_joy(0.5)(second.vector.copy()))
+    # بعد الرفض أعاد second تحميل الحالة والإصدار، فالمحاولة التالية تنجح
+    assert second.vector.to_dict() == first.vector.to_dict()
+    assert second.try_save(_bump_joy(0.5)(second.vector.copy()))
+
+
+def test_concurrent_workers_lose_no_updates(tmp_path):
+    db_path = str(tmp_path / "state.db")
+    workers = [EmotionalState(db_path, storage=_worker(db_path, cas_retries=1000), session_id="s")
+               for _ in range(4)]
+    base = workers[0].state["joy"]
+    rounds = 25
+
+    def run(session):
+        for _ in range(rounds):
+            with session.lock:
+                session.update_state(_bump_joy(0.001))
+
+    threads = [threading.Thread(target=run, args=(session,)) for session in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    workers[0].refresh()
+    assert workers[0].state["joy"] == pytest.approx(base + 0.001 * rounds * len(workers))
+    assert workers[0].version == workers[0].storage.get_version("s")
+
+
+def test_conflict_error_after_retries(tmp_path):
+    db_path = str(tmp_path / "state.db")
+    session = EmotionalState(db_path, storage=_worker(db_path, cas_retries=3), session_id="s")
+    rival = EmotionalState(db_path, storage=_worker(db_path), session_id="s")
+    attempts = []
+
+    def mutate(state):
+        # عامل آخر يكتب بين كل قراءة وحفظ، فلا تنجح أي محاولة
+        attempts.append(1)
+        rival.refresh()
+        rival.update_state(_bump_joy(0.01))
+        return _bump_joy(0.5)(state)
+
+    with pytest.raises(StateConflictError):
+        session.update_state(mutate)
+    assert len(attempts) == 3
+
+
+def test_write_behind_batch_is_not_overwritten_by_pending(tmp_path):
+    storage = StateStorage(str(tmp_path / "state.db"), write_behind=True, shared=False, flush_interval=60)
+    storage.write_state({"joy": 0.1}, "s")
+    with storage.batch():
+        storage.write_state({"joy": 0.9}, "s")
+    assert dict(storage.read_state("s")) == {"joy": "0.9"}
+    storage.flush()
+    assert dict(storage.read_state("s")) == {"joy": "0.9"}
+    storage.close()
@@ -0,0 +1,27 @@
+# train_model.py - تدريب النموذج الداخلي مسبقًا وحفظه كملف مُجمَّع (يُشغَّل أثناء بناء الصورة)
+
+import argparse
+import time
+
+from EmotionalProcessorV4 import EmotionalEngine, INTERNAL_MODEL_PATH
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the internal emotion classifier into a memory-mappable artifact.")
+    parser.add_argument("--output", default=INTERNAL_MODEL_PATH, help="artifact directory")
+    parser.add_argument("--version", default=time.strftime("%Y%m%d%H%M%S"), help="artifact version label")
+    args = parser.parse_args()
+
+    # لا نحتاج مخزن حالات ولا عميل Gemini للتدريب
+    engine = EmotionalEngine(state_store=None, warm_up=False)
+    engine._load_training_data()
+    engine._train_internal_model()
+    if engine.internal_classifier is None:
+        raise SystemExit("Internal model could not be trained/compiled.")
+
+    engine.internal_classifier.save(args.output, engine.model_features, args.version)
+    print(f"Saved internal model {args.version} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()